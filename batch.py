@@ -0,0 +1,217 @@
+"""Offline batch analysis of a video archive on all cores.
+
+Runs the same pose extraction and metrics as ``/analyze`` over every clip
+in a directory (searched recursively) or a manifest, without the upload
+and per-request setup of the API. Clips are spread over supervised worker
+processes (``workers.WorkerPool``); each keeps one warm pose estimator
+(``pose.shared_pose``) for all the clips it handles, and a clip that
+crashes its worker fails alone.
+
+Results are appended to a CSV file, one row per clip as soon as it
+finishes, so an interrupted run loses nothing. Clips whose content hash
+already has a successful row in the output are skipped: re-running over
+the same archive picks up where it stopped, and byte-identical copies are
+analysed once.
+
+A manifest is a CSV file with a ``path`` column and optional ``distance``
+and ``pixels_per_meter`` columns overriding the command-line defaults.
+Relative paths are resolved against the manifest's directory.
+
+Example:
+    python batch.py /data/season24 --distance 100m --ppm 52 --out season24.csv
+    python batch.py clips.csv --processes 8 --sampling adaptive
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import execution
+
+VIDEO_EXTENSIONS = (".mp4", ".mov", ".avi", ".mkv", ".m4v", ".webm")
+# List-valued metrics are left out of the CSV
+LIST_METRICS = ("feedback", "drills", "splits")
+CLIP_COLUMNS = (
+    "path", "sha256", "status", "error", "distance", "pixels_per_meter",
+    "fps", "frames", "extract_s", "total_s",
+)
+
+
+def find_clips(source: str, distance: str, pixels_per_meter: float):
+    """(path, distance, pixels_per_meter) of every clip in a directory or manifest"""
+    if os.path.isdir(source):
+        clips = []
+        for root, dirs, files in os.walk(source):
+            dirs.sort()
+            clips.extend(
+                (os.path.join(root, name), distance, pixels_per_meter)
+                for name in sorted(files) if name.lower().endswith(VIDEO_EXTENSIONS)
+            )
+        return clips
+    base = os.path.dirname(os.path.abspath(source))
+    with open(source, newline="") as f:
+        reader = csv.DictReader(f)
+        if "path" not in (reader.fieldnames or ()):
+            raise ValueError(f"{source}: a manifest needs a 'path' column")
+        return [
+            (
+                os.path.join(base, row["path"]),
+                row.get("distance") or distance,
+                float(row.get("pixels_per_meter") or pixels_per_meter),
+            )
+            for row in reader if row["path"]
+        ]
+
+
+def output_columns():
+    """CSV header: clip columns followed by the scalar metrics"""
+    from metrics import METRIC_NAMES
+    return list(CLIP_COLUMNS) + [m for m in METRIC_NAMES if m not in LIST_METRICS]
+
+
+def load_done(out_path: str, columns):
+    """Content hashes that already have a successful row in the output"""
+    if not os.path.exists(out_path) or os.path.getsize(out_path) == 0:
+        return set()
+    with open(out_path, newline="") as f:
+        reader = csv.DictReader(f)
+        if reader.fieldnames != columns:
+            raise ValueError(f"{out_path} was written with different columns; choose a new --out")
+        return {row["sha256"] for row in reader if row["status"] == "ok"}
+
+
+def _init_worker():
+    """Apply the thread budget and load the pose graph once per worker"""
+    execution.configure()
+    from pose import shared_pose
+    shared_pose()
+
+
+def analyze_clip(path: str, distance: str, pixels_per_meter: float, sampling: str = "full"):
+    """Pose extraction and scalar metrics of one clip; runs in a worker"""
+    from metrics import compute_metrics
+    from pose import extract_pose_series, shared_pose
+
+    started = time.perf_counter()
+    series = extract_pose_series(path, sampling=sampling, pose=shared_pose())
+    extract_s = time.perf_counter() - started
+    metrics = compute_metrics(series, distance, pixels_per_meter)
+    return {
+        "fps": series["fps"],
+        "frames": series["frames"],
+        "extract_s": round(extract_s, 3),
+        **{name: value for name, value in metrics.items() if name not in LIST_METRICS},
+    }
+
+
+def run_batch(clips, out_path: str, processes: int, sampling: str = "full", progress=sys.stderr):
+    """Analyse clips into out_path; returns a summary with throughput"""
+    from uploads import file_sha256
+    from workers import WorkerCrashed, WorkerPool
+
+    columns = output_columns()
+    claimed = load_done(out_path, columns)
+    lock = threading.Lock()
+    pool = WorkerPool(processes=processes, initializer=_init_worker, preload=("__main__", "metrics", "pose"))
+    counts = {"ok": 0, "failed": 0, "crashed": 0, "skipped": 0}
+    frames = 0
+
+    def process(clip):
+        path, distance, pixels_per_meter = clip
+        started = time.perf_counter()
+        row = {"path": path, "distance": distance, "pixels_per_meter": pixels_per_meter}
+        try:
+            row["sha256"] = file_sha256(path)
+        except OSError as e:
+            return {**row, "status": "failed", "error": str(e)}
+        with lock:
+            if row["sha256"] in claimed:
+                return None
+            claimed.add(row["sha256"])
+        try:
+            row.update(pool.run(analyze_clip, path, distance, pixels_per_meter, sampling=sampling), status="ok")
+        except WorkerCrashed as e:
+            row.update(status="crashed", error=str(e))
+        except Exception as e:
+            row.update(status="failed", error=str(e))
+        row["total_s"] = round(time.perf_counter() - started, 3)
+        return row
+
+    started = time.perf_counter()
+    new_file = not os.path.exists(out_path) or os.path.getsize(out_path) == 0
+    # Extra threads hash the next clips while every worker is busy; inline
+    # runs share one pose graph, so they get a single thread
+    executor = ThreadPoolExecutor(max_workers=2 * processes if processes > 0 else 1)
+    try:
+        with open(out_path, "a", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=columns)
+            if new_file:
+                writer.writeheader()
+            futures = [executor.submit(process, clip) for clip in clips]
+            for n, future in enumerate(as_completed(futures), 1):
+                row = future.result()
+                if row is None:
+                    counts["skipped"] += 1
+                    continue
+                writer.writerow(row)
+                f.flush()
+                counts[row["status"]] += 1
+                frames += row.get("frames") or 0
+
+                elapsed = time.perf_counter() - started
+                analysed = n - counts["skipped"]
+                rate = analysed / max(elapsed, 1e-9)
+                eta = (len(clips) - n) / rate if rate > 0 else 0.0
+                if progress is not None:
+                    print(
+                        f"[{n}/{len(clips)}] {row['status']:<7} {rate:5.2f} clips/s "
+                        f"{frames / max(elapsed, 1e-9):7.1f} frames/s  eta {eta:5.0f}s  {row['path']}",
+                        file=progress, flush=True,
+                    )
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+        pool.close()
+
+    elapsed = time.perf_counter() - started
+    analysed = len(clips) - counts["skipped"]
+    return {
+        "clips": len(clips),
+        **counts,
+        "elapsed_s": round(elapsed, 2),
+        "clips_per_s": round(analysed / max(elapsed, 1e-9), 3),
+        "frames_per_s": round(frames / max(elapsed, 1e-9), 1),
+        "workers": pool.status(),
+        "output": out_path,
+    }
+
+
+def main(argv=None):
+    from metrics import DEFAULT_PIXELS_PER_METER
+
+    parser = argparse.ArgumentParser(description="Analyse a directory or manifest of videos on all cores")
+    parser.add_argument("source", help="Directory of videos, or a CSV manifest with a 'path' column")
+    parser.add_argument("--out", default="batch_results.csv", help="CSV file results are appended to")
+    parser.add_argument("--distance", default="100m", help="Race distance for clips without one in the manifest")
+    parser.add_argument(
+        "--ppm", type=float, default=DEFAULT_PIXELS_PER_METER,
+        help=f"Pixels per meter for clips without one (default: {DEFAULT_PIXELS_PER_METER:g}, as for /analyze)",
+    )
+    parser.add_argument("--processes", type=int, default=None, help="Worker processes (default: usable cores)")
+    parser.add_argument("--sampling", choices=("full", "adaptive"), default="full")
+    args = parser.parse_args(argv)
+
+    processes = args.processes if args.processes is not None else execution.effective_cpus()
+    # Workers split the cores between them, like API workers do
+    os.environ["SPRINT_WORKERS"] = str(max(1, processes))
+    execution.configure()
+
+    clips = find_clips(args.source, args.distance, args.ppm)
+    print(json.dumps(run_batch(clips, args.out, processes, sampling=args.sampling), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+"""Cross-request batching of pose inference.
+
+Concurrent extractions each drive their own model at batch size one,
+repeating the per-call overhead and leaving the CPU's vector units
+underused. With ``SPRINT_POSE_MAX_BATCH`` set, every extraction in the
+process gets a ``BatchedEstimator`` instead: it tracks its own runner and
+crops its own frames, but the crops of all active extractions queue up in
+one ``InferenceBatcher``, whose thread runs them through a single landmark
+model in batches of up to that many frames. A batch waits at most
+``SPRINT_POSE_MAX_WAIT_MS`` after its first frame for others to arrive, and
+not at all once every extraction is blocked on its results, so the added
+latency per frame stays bounded. Each frame's outputs come back on its own
+Future and are resolved by the extraction that submitted it, in its order,
+against its own track.
+
+Only extractions in one process share a batcher, so analyses must run in
+the API process (``SPRINT_ANALYSIS_PROCESSES=0``); the API refuses to start
+otherwise. It needs the onnx backend and a landmark model with a dynamic
+batch dimension.
+"""
+import os
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+from inference import POSE_BATCH, Estimator, OnnxEstimator, Track
+
+MAX_BATCH = int(os.environ.get("SPRINT_POSE_MAX_BATCH", "0"))
+MAX_WAIT_MS = float(os.environ.get("SPRINT_POSE_MAX_WAIT_MS", "5"))
+
+_batchers = {}
+_batchers_lock = threading.Lock()
+
+
+class InferenceBatcher:
+    """One landmark model fed with the frames of every extraction in the process"""
+
+    def __init__(
+        self, settings: dict, lite: bool = False, max_batch: int = MAX_BATCH, max_wait_ms: float = MAX_WAIT_MS
+    ):
+        self.model = OnnxEstimator(settings, lite=lite, batch_size=max(1, max_batch))
+        self.max_batch = self.model.batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._cond = threading.Condition()
+        # (uint8 crop, Future, time queued) per frame
+        self._queue = []
+        self._open = 0
+        self._blocked = 0
+        self._thread = None
+        self.stats = {"batches": 0, "frames": 0, "largest_batch": 0, "queued_s": 0.0}
+
+    def estimator(self, in_flight: int = POSE_BATCH):
+        """Estimator for one extraction, keeping up to in_flight frames queued"""
+        return BatchedEstimator(self, in_flight)
+
+    def submit(self, crop):
+        """Queue one crop; its Future receives (raw landmarks, presence score)"""
+        future = Future()
+        with self._cond:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name="pose-batcher", daemon=True)
+                self._thread.start()
+            self._queue.append((crop, future, time.perf_counter()))
+            self._cond.notify_all()
+        return future
+
+    def _attach(self, delta: int):
+        with self._cond:
+            self._open += delta
+            self._cond.notify_all()
+
+    def _block(self, delta: int):
+        with self._cond:
+            self._blocked += delta
+            self._cond.notify_all()
+
+    def _take(self):
+        """Next batch: full, past the wait, or everything that can arrive"""
+        with self._cond:
+            while not self._queue:
+                self._cond.wait()
+            deadline = self._queue[0][2] + self.max_wait
+            while len(self._queue) < self.max_batch and self._blocked < self._open:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            batch, self._queue = self._queue[:self.max_batch], self._queue[self.max_batch:]
+        return batch
+
+    def _loop(self):
+        buffer = None
+        while True:
+            batch = self._take()
+            started = time.perf_counter()
+            try:
+                shape = batch[0][0].shape
+                if buffer is None or buffer.shape[1:] != shape:
+                    buffer = np.empty((self.max_batch,) + shape, dtype=np.float32)
+                crops = buffer[:len(batch)]
+                for k, (crop, _, _) in enumerate(batch):
+                    np.multiply(crop, 1 / 255, out=crops[k])
+                raw, flag = self.model.infer(crops)
+            except Exception as e:
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+            for k, (_, future, _) in enumerate(batch):
+                future.set_result((raw[k], flag[k]))
+            with self._cond:
+                self.stats["batches"] += 1
+                self.stats["frames"] += len(batch)
+                self.stats["largest_batch"] = max(self.stats["largest_batch"], len(batch))
+                self.stats["queued_s"] += sum(started - queued for _, _, queued in batch)
+
+    def status(self):
+        """Batch counts and sizes, as reported by /runtime"""
+        with self._cond:
+            stats = dict(self.stats)
+            queued = len(self._queue)
+            extractions = self._open
+        frames = max(stats["frames"], 1)
+        return {
+            "max_batch": self.max_batch,
+            "max_wait_ms": self.max_wait * 1000,
+            "extractions": extractions,
+            "queued": queued,
+            "batches": stats["batches"],
+            "frames": stats["frames"],
+            "largest_batch": stats["largest_batch"],
+            "mean_batch": round(stats["frames"] / max(stats["batches"], 1), 2),
+            "mean_queued_ms": round(stats["queued_s"] / frames * 1000, 2),
+        }
+
+
+class BatchedEstimator(Estimator):
+    """One extraction's estimator on a shared InferenceBatcher: its own track, the shared model"""
+
+    name = "onnx"
+
+    def __init__(self, batcher: InferenceBatcher, in_flight: int = POSE_BATCH):
+        super().__init__()
+        self.batcher = batcher
+        self.batch_size = max(1, int(in_flight))
+        self._track = Track()
+        # (entry, Future or None) per submitted frame
+        self._pending = []
+        self._closed = False
+        batcher._attach(1)
+
+    def submit(self, rgb, t_ms: float = None):
+        entry, crop = self.batcher.model.crop(rgb, t_ms, self._track)
+        self._pending.append((entry, None if crop is None else self.batcher.submit(crop)))
+
+    def _collect(self):
+        if not self._pending:
+            return
+        last = self._pending[-1][1]
+        blocked = last is not None and not last.done()
+        if blocked:
+            self.batcher._block(1)
+        try:
+            outputs = [None if future is None else future.result() for _, future in self._pending]
+        finally:
+            if blocked:
+                self.batcher._block(-1)
+        # Resolved in submission order: each frame moves the track on
+        for (entry, _), output in zip(self._pending, outputs):
+            self._results.append(None if output is None else self.batcher.model.resolve(entry, *output))
+        self._pending = []
+
+    def flush(self):
+        self._collect()
+        return super().flush()
+
+    def reset(self, width: int, height: int):
+        self._collect()
+        self._track.lose()
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            self.batcher._attach(-1)
+
+
+def shared_batcher(settings: dict, lite: bool = False):
+    """This process's batcher for the heavy (or cascade first-pass) model, created on first use"""
+    with _batchers_lock:
+        if lite not in _batchers:
+            _batchers[lite] = InferenceBatcher(settings, lite=lite)
+        return _batchers[lite]
+
+
+def status():
+    """Shared batching settings and the state of each batcher"""
+    with _batchers_lock:
+        batchers = dict(_batchers)
+    return {
+        "max_batch": MAX_BATCH,
+        "max_wait_ms": MAX_WAIT_MS,
+        **{("lite" if lite else "heavy"): b.status() for lite, b in batchers.items()},
+    }
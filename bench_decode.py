@@ -0,0 +1,110 @@
+"""Benchmark of the decoder backends in ``decoders``.
+
+For every backend and codec thread count, measures frames/s of:
+
+- ``decode``: decoding alone (``grab``)
+- ``rgb``: decoding plus the RGB inference copy at source size
+- ``rgb@W``: decoding plus the RGB inference copy downscaled to width W
+
+over the given clips, or a synthetic one if none are given. Backends that
+are not installed are reported as unavailable. Pose inference is left out;
+its cost does not depend on the decoder.
+
+Example:
+    python bench_decode.py phone_clips/*.mp4 --threads 0,1,2,4 --infer-width 960
+    python bench_decode.py --size 1920x1080 --frames 240
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+
+import cv2
+
+from decoders import DECODER_BACKENDS, open_decoder
+from loadtest import draw_runner
+
+
+def render(path, width, height, n, fps):
+    """Write a synthetic MPEG-4 clip"""
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), fps, (width, height))
+    for i in range(n):
+        writer.write(draw_runner(width, height, i, fps))
+    writer.release()
+
+
+def run(path, backend, threads, mode, infer_width=None):
+    """Frames/s of one backend, thread count and mode over a clip"""
+    decoder = open_decoder(path, max_width=infer_width, backend=backend, threads=threads)
+    if not decoder.is_opened():
+        raise RuntimeError(f"{backend} cannot open {path}")
+    n = 0
+    start = time.perf_counter()
+    try:
+        if mode == "decode":
+            while decoder.grab():
+                n += 1
+        else:
+            while (frame := decoder.read()) is not None:
+                decoder.to_rgb(frame)
+                n += 1
+    finally:
+        decoder.close()
+    return {"frames": n, "fps": round(n / max(time.perf_counter() - start, 1e-9), 1)}
+
+
+def bench_clip(path, backends, thread_counts, infer_width, repeat):
+    rows = []
+    modes = ["decode", "rgb"] + ([f"rgb@{infer_width}"] if infer_width else [])
+    for backend in backends:
+        try:
+            for threads in thread_counts:
+                for mode in modes:
+                    width = infer_width if mode.startswith("rgb@") else None
+                    best = max(
+                        (run(path, backend, threads, mode.split("@")[0], width) for _ in range(repeat)),
+                        key=lambda r: r["fps"],
+                    )
+                    rows.append({"backend": backend, "threads": threads, "mode": mode, **best})
+        except RuntimeError as e:
+            rows.append({"backend": backend, "error": str(e)})
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark decoder backends")
+    parser.add_argument("clips", nargs="*", help="Clips to decode (default: a synthetic one)")
+    parser.add_argument("--backends", default=",".join(DECODER_BACKENDS))
+    parser.add_argument("--threads", default="0,1", help="Comma-separated codec thread counts (0 = FFmpeg's choice)")
+    parser.add_argument("--infer-width", type=int, default=640, help="Width of the downscaled RGB mode (0 to skip)")
+    parser.add_argument("--repeat", type=int, default=3, help="Passes per setting (best is kept)")
+    parser.add_argument("--size", default="1920x1080", help="Synthetic clip size WxH")
+    parser.add_argument("--frames", type=int, default=240, help="Synthetic clip length")
+    parser.add_argument("--fps", type=float, default=60.0)
+    args = parser.parse_args(argv)
+
+    backends = [b for b in args.backends.split(",") if b]
+    thread_counts = [int(t) for t in args.threads.split(",") if t]
+    clips, path = list(args.clips), None
+    if not clips:
+        width, height = (int(v) for v in args.size.lower().split("x"))
+        fd, path = tempfile.mkstemp(suffix=".mp4")
+        os.close(fd)
+        render(path, width, height, args.frames, args.fps)
+        clips = [path]
+    try:
+        report = {
+            clip if clip != path else f"synthetic {args.size}": bench_clip(
+                clip, backends, thread_counts, args.infer_width, args.repeat
+            )
+            for clip in clips
+        }
+        print(json.dumps(report, indent=2))
+    finally:
+        if path is not None:
+            os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
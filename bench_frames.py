@@ -0,0 +1,151 @@
+"""Benchmark of the pose-extraction frame loop: fresh allocations vs reused buffers.
+
+Runs the decode / colour-convert / landmark-store loop of
+``extract_pose_series`` two ways over the same synthetic clip:
+
+- ``alloc``: ``cap.read()`` and ``cv2.cvtColor`` return new arrays every
+  frame and landmarks are collected as Python tuples (the previous loop)
+- ``reuse``: ``FrameRing`` and ``LandmarkBuffer`` from ``frames``
+
+Throughput is measured in an untraced pass. Allocation churn is measured in
+a second pass under tracemalloc: the peak traced memory within each frame,
+above what was live when the frame started, summed over the clip. Pose
+inference is replaced by fixed landmarks unless ``--pose`` is given, since
+its cost is the same in both variants and would hide the difference.
+
+Example:
+    python bench_frames.py --size 1920x1080 --frames 240
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+import types
+
+import cv2
+import numpy as np
+
+from frames import FrameRing, LandmarkBuffer, fill_normalized
+from loadtest import draw_runner
+
+LANDMARK_IDS = (25, 26, 27, 28, 31, 32, 23, 24, 11, 12)
+
+
+def render(path, width, height, n, fps):
+    """Write a synthetic clip"""
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"MJPG"), fps, (width, height))
+    for i in range(n):
+        writer.write(draw_runner(width, height, i, fps))
+    writer.release()
+
+
+class StubPose:
+    """Returns the same 33 landmarks for every frame"""
+
+    def __init__(self):
+        lm = [types.SimpleNamespace(x=0.5 + 0.01 * k, y=0.5 - 0.01 * k, visibility=0.9) for k in range(33)]
+        self.result = types.SimpleNamespace(pose_landmarks=types.SimpleNamespace(landmark=lm))
+
+    def process(self, rgb):
+        return self.result
+
+
+def loop_alloc(cap, pose, width, height, on_frame):
+    pts = []
+    while True:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        res = pose.process(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+        if res.pose_landmarks:
+            lm = res.pose_landmarks.landmark
+            _ = [(p.x, p.y) for p in lm]
+            pts.append([(lm[i].x * width, lm[i].y * height) for i in LANDMARK_IDS])
+        on_frame()
+    return np.array(pts, dtype=float)
+
+
+def loop_reuse(cap, pose, width, height, on_frame):
+    frames = FrameRing(width, height)
+    points = LandmarkBuffer(LANDMARK_IDS, width, height, int(cap.get(cv2.CAP_PROP_FRAME_COUNT)) + 1)
+    overlay_pts = np.empty((33, 2), dtype=np.float32)
+    while True:
+        frame = frames.read(cap)
+        if frame is None:
+            break
+        res = pose.process(frames.to_rgb(frame))
+        if res.pose_landmarks:
+            fill_normalized(res.pose_landmarks.landmark, overlay_pts)
+            points.append(res.pose_landmarks.landmark)
+        on_frame()
+    return points.data[:points.n]
+
+
+LOOPS = {"alloc": loop_alloc, "reuse": loop_reuse}
+
+
+def run(variant, path, pose, traced):
+    """Run one variant; returns frames/s or per-frame allocation stats"""
+    cap = cv2.VideoCapture(path)
+    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    churn = []
+    if traced:
+        tracemalloc.start()
+        base = [tracemalloc.get_traced_memory()[0]]
+
+        def on_frame():
+            current, peak = tracemalloc.get_traced_memory()
+            churn.append(peak - base[0])
+            tracemalloc.reset_peak()
+            base[0] = current
+    else:
+        def on_frame():
+            churn.append(0)
+
+    start = time.perf_counter()
+    LOOPS[variant](cap, pose, width, height, on_frame)
+    elapsed = time.perf_counter() - start
+    cap.release()
+    if traced:
+        tracemalloc.stop()
+        return {
+            "churn_mb": round(sum(churn) / 2 ** 20, 2),
+            "churn_kb_per_frame": round(float(np.mean(churn)) / 1024, 1),
+        }
+    return {"frames": len(churn), "fps": round(len(churn) / elapsed, 1)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark frame-loop allocations")
+    parser.add_argument("--size", default="1280x720", help="Clip size WxH")
+    parser.add_argument("--frames", type=int, default=240)
+    parser.add_argument("--fps", type=float, default=120.0)
+    parser.add_argument("--repeat", type=int, default=3, help="Throughput passes per variant (best is kept)")
+    parser.add_argument("--pose", action="store_true", help="Run real MediaPipe inference instead of a stub")
+    args = parser.parse_args(argv)
+
+    width, height = (int(v) for v in args.size.lower().split("x"))
+    fd, path = tempfile.mkstemp(suffix=".avi")
+    os.close(fd)
+    try:
+        render(path, width, height, args.frames, args.fps)
+        if args.pose:
+            import mediapipe as mp
+            pose = mp.solutions.pose.Pose(model_complexity=1)
+        else:
+            pose = StubPose()
+
+        report = {"size": args.size, "frames": args.frames, "pose": args.pose}
+        for variant in LOOPS:
+            best = max((run(variant, path, pose, traced=False) for _ in range(args.repeat)), key=lambda r: r["fps"])
+            report[variant] = {**best, **run(variant, path, pose, traced=True)}
+        print(json.dumps(report, indent=2))
+    finally:
+        os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
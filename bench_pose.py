@@ -0,0 +1,180 @@
+"""Benchmark of the pose-inference backends in ``inference``.
+
+Frames are decoded (and downscaled to ``--infer-width``) into memory first,
+so only inference is timed: each backend, and each batch size for the
+backends that batch, runs over the same frames as a tracked clip. Besides
+frames/s, every run reports how far its landmarks are from the first
+backend's (mean absolute difference of the series landmarks, normalized to
+the frame) and on how many frames a pose was found. Backends that are not
+installed or have no model configured are reported as unavailable.
+
+Models come from the usual settings (``SPRINT_POSE_MODEL``,
+``SPRINT_POSE_DETECTOR``); for a quantized ONNX model, point
+``SPRINT_POSE_MODEL`` at it.
+
+With ``--streams N``, N pipelines also run the frames concurrently on the
+onnx backend, first each with its own model and then sharing one
+``batching.InferenceBatcher`` per ``--batch`` size, reporting aggregate
+frames/s, the mean batch and how long frames queued for it.
+
+Example:
+    SPRINT_POSE_MODEL=pose_landmark_full.onnx SPRINT_POSE_DETECTOR=pose_detection.onnx \\
+        python bench_pose.py clip.mp4 --backends solution,onnx --batch 1,4,8
+    python bench_pose.py --backends onnx --batch 4,8,16 --streams 8 --infer-width 640
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from bench_decode import render
+from batching import MAX_WAIT_MS, InferenceBatcher
+from decoders import open_decoder
+from inference import POSE_BACKENDS, POSE_BATCH, open_estimator
+from pose import POSE_SETTINGS, SERIES_LANDMARKS
+
+
+def load_frames(path, n, infer_width):
+    """First n frames of a clip as RGB at the inference size, and its fps"""
+    decoder = open_decoder(path, max_width=infer_width)
+    if not decoder.is_opened():
+        raise SystemExit(f"Cannot open {path}")
+    frames = []
+    while len(frames) < n and (frame := decoder.read()) is not None:
+        frames.append(decoder.to_rgb(frame).copy())
+    decoder.close()
+    return frames, decoder.fps or 30.0
+
+
+def drive(estimator, frames, fps):
+    """Landmarks of every frame, flushing as an extraction does"""
+    results = []
+    pending = 0
+    for i, rgb in enumerate(frames):
+        estimator.submit(rgb, i * 1000 / fps)
+        pending += 1
+        if pending >= estimator.batch_size:
+            results.extend(estimator.flush())
+            pending = 0
+    results.extend(estimator.flush())
+    return results
+
+
+def run(frames, fps, backend, batch_size=None):
+    """Landmarks of every frame and the seconds inference took"""
+    options = {} if batch_size is None else {"batch_size": batch_size}
+    with open_estimator(POSE_SETTINGS, backend=backend, **options) as estimator:
+        start = time.perf_counter()
+        results = drive(estimator, frames, fps)
+        return results, time.perf_counter() - start
+
+
+def landmarks(results):
+    """(frames, landmarks, 2) normalized series landmarks; NaN where no pose was found"""
+    out = np.full((len(results), len(SERIES_LANDMARKS), 2), np.nan)
+    for i, lm in enumerate(results):
+        if lm is not None:
+            out[i] = [(lm[idx].x, lm[idx].y) for idx in SERIES_LANDMARKS.values()]
+    return out
+
+
+def bench_clip(frames, fps, backends, batch_sizes):
+    rows = []
+    reference = None
+    for backend in backends:
+        for batch_size in batch_sizes if backend == "onnx" else [None]:
+            try:
+                results, seconds = run(frames, fps, backend, batch_size)
+            except (RuntimeError, ValueError) as e:
+                rows.append({"backend": backend, "error": str(e)})
+                break
+            points = landmarks(results)
+            if reference is None:
+                reference = points
+            row = {
+                "backend": backend,
+                "batch": batch_size or 1,
+                "fps": round(len(frames) / max(seconds, 1e-9), 1),
+                "found": int((~np.isnan(points[:, 0, 0])).sum()),
+            }
+            diff = np.abs(points - reference)
+            if not np.isnan(diff).all():
+                row["mean_abs_diff"] = round(float(np.nanmean(diff)), 4)
+            rows.append(row)
+    return rows
+
+
+def bench_streams(frames, fps, streams, max_batches, max_wait_ms):
+    """Aggregate frames/s of concurrent onnx pipelines, each on its own model or sharing a batcher"""
+    rows = []
+    for max_batch in [0] + max_batches:
+        try:
+            if max_batch:
+                batcher = InferenceBatcher(POSE_SETTINGS, max_batch=max_batch, max_wait_ms=max_wait_ms)
+                estimators = [batcher.estimator() for _ in range(streams)]
+            else:
+                batcher = None
+                estimators = [
+                    open_estimator(POSE_SETTINGS, backend="onnx", batch_size=POSE_BATCH) for _ in range(streams)
+                ]
+        except (RuntimeError, ValueError) as e:
+            return rows + [{"streams": streams, "error": str(e)}]
+        with ThreadPoolExecutor(max_workers=streams) as executor:
+            start = time.perf_counter()
+            list(executor.map(lambda estimator: drive(estimator, frames, fps), estimators))
+            seconds = time.perf_counter() - start
+        for estimator in estimators:
+            estimator.close()
+        row = {"streams": streams, "max_batch": max_batch, "fps": round(streams * len(frames) / max(seconds, 1e-9), 1)}
+        if batcher is not None:
+            stats = batcher.status()
+            row.update(mean_batch=stats["mean_batch"], mean_queued_ms=stats["mean_queued_ms"])
+        rows.append(row)
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark pose-inference backends")
+    parser.add_argument("clips", nargs="*", help="Clips to run (default: a synthetic one)")
+    parser.add_argument("--backends", default=",".join(POSE_BACKENDS))
+    parser.add_argument("--batch", default="1,4,8", help="Comma-separated batch sizes for the onnx backend")
+    parser.add_argument("--frames", type=int, default=240, help="Frames per clip")
+    parser.add_argument("--infer-width", type=int, default=0, help="Downscale frames wider than this (0 to keep)")
+    parser.add_argument("--size", default="1280x720", help="Synthetic clip size WxH")
+    parser.add_argument("--fps", type=float, default=60.0)
+    parser.add_argument(
+        "--streams", type=int, default=0,
+        help="Also run this many concurrent onnx pipelines, unbatched and sharing a batcher of each --batch size",
+    )
+    parser.add_argument("--max-wait-ms", type=float, default=MAX_WAIT_MS, help="Batcher wait for --streams")
+    args = parser.parse_args(argv)
+
+    backends = [b for b in args.backends.split(",") if b]
+    batch_sizes = [int(b) for b in args.batch.split(",") if b]
+    clips, path = list(args.clips), None
+    if not clips:
+        width, height = (int(v) for v in args.size.lower().split("x"))
+        fd, path = tempfile.mkstemp(suffix=".mp4")
+        os.close(fd)
+        render(path, width, height, args.frames, args.fps)
+        clips = [path]
+    try:
+        report = {}
+        for clip in clips:
+            frames, fps = load_frames(clip, args.frames, args.infer_width or None)
+            name = clip if clip != path else f"synthetic {args.size}"
+            report[name] = bench_clip(frames, fps, backends, batch_sizes)
+            if args.streams > 0:
+                report[name] += bench_streams(frames, fps, args.streams, batch_sizes, args.max_wait_ms)
+        print(json.dumps(report, indent=2))
+    finally:
+        if path is not None:
+            os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
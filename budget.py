@@ -0,0 +1,523 @@
+"""Pre-flight memory and time estimates per analysis, and the budget guard.
+
+``plan()`` reads resolution, frame rate and frame count from the container
+header with ``VideoCapture`` before anything is decoded, and predicts the
+peak resident memory of the process running the extraction and the
+extraction time for the requested settings. Over budget it either rejects
+the request with ``BudgetExceeded`` or, by default, downgrades settings
+until the estimate fits: a narrower overlay, inference at a lower
+resolution, then adaptive sampling.
+
+Both models are linear in a few features of the clip. Every completed
+analysis appends its features, the measured peak memory and the time of
+each extraction stage (decode, inference, overlay, cascade refinement) to
+``budget_log.jsonl`` in ``SPRINT_DATA_DIR``, along with the share of
+frames cascade mode re-ran. Each stage's time is fitted on the features
+that drive it, the refined share is averaged, and the coefficients are
+written to ``budget_model.json`` next to the log, which replaces the
+defaults below. The fit uses the last ``SPRINT_BUDGET_REFIT_WINDOW``
+records; it reruns in a background thread every
+``SPRINT_BUDGET_REFIT_EVERY`` analyses an API process logs, or on demand
+with ``python budget.py --fit``.
+
+``predict()`` gives the estimates for every client-selectable quality
+setting from container metadata alone; ``/probe`` serves it.
+
+Example:
+    python budget.py            # error of the current model on the log
+    python budget.py --fit      # refit and save the coefficients
+"""
+import argparse
+import json
+import os
+import threading
+import time
+
+import cv2
+import numpy as np
+
+import execution
+from pose import ADAPTIVE_BASE_FPS, ADAPTIVE_MARGIN, MODEL_MODES, SAMPLING_MODES
+from store import DATA_DIR
+from workers import ANALYSIS_PROCESSES
+
+BUDGET_POLICIES = ("downgrade", "reject", "off")
+BUDGET_POLICY = os.environ.get("SPRINT_BUDGET_POLICY", "downgrade")
+# Peak memory allowed per analysis; 0 divides the machine's memory between
+# the analyses that can run at once
+MEMORY_BUDGET_MB = float(os.environ.get("SPRINT_MEMORY_BUDGET_MB", "0"))
+# Estimated extraction time allowed per analysis; 0 for no limit
+MAX_EXTRACT_S = float(os.environ.get("SPRINT_MAX_EXTRACT_S", "0"))
+DOWNGRADE_WIDTH = int(os.environ.get("SPRINT_DOWNGRADE_WIDTH", "1280"))
+# How long reading a container header may take before the probe is killed
+PROBE_TIMEOUT_S = float(os.environ.get("SPRINT_PROBE_TIMEOUT_S", "10"))
+# Logged analyses between automatic refits; 0 disables them
+REFIT_EVERY = int(os.environ.get("SPRINT_BUDGET_REFIT_EVERY", "50"))
+# Most recent log records a refit uses; 0 for the whole log
+REFIT_WINDOW = int(os.environ.get("SPRINT_BUDGET_REFIT_WINDOW", "2000"))
+
+LOG_PATH = os.path.join(DATA_DIR, "budget_log.jsonl")
+MODEL_PATH = os.path.join(DATA_DIR, "budget_model.json")
+
+# Coefficients per feature, in MB and seconds. Measured on 360p-4K clips;
+# the decoder and frame ring scale with the source size, the model's input
+# copies with the inference size and the overlay queue with its output size.
+# The codec and cascade terms start unmeasured and are learned by the fit;
+# cascade mode re-runs about 40-45% of sprint frames on the heavy model
+DEFAULT_MODEL = {
+    "memory_mb": {
+        "base": 220.0, "decoded_mp": 14.0, "inferred_mp": 5.5, "overlay_mp": 32.0, "kframes": 2.0, "cascade": 40.0,
+    },
+    "extract_s": {
+        "base": 0.0, "decoded_frame_mp": 0.0035, "heavy_codec_frame_mp": 0.0, "inferred": 0.04, "inferred_lite": 0.015,
+        "inferred_mp": 0.001, "overlay_frame_mp": 0.009, "refined": 0.05,
+    },
+    "cascade": {"refined_share": 0.45},
+}
+# Extraction stages (pose.STAGES, plus the rest of the run as "other_s")
+# and the features their time is fitted on
+STAGE_FEATURES = {
+    "decode_s": ("decoded_frame_mp", "heavy_codec_frame_mp"),
+    "infer_s": ("inferred", "inferred_lite", "inferred_mp"),
+    "overlay_s": ("overlay_frame_mp",),
+    "refine_s": ("refined",),
+    "other_s": ("base",),
+}
+# Codecs markedly slower to decode than H.264, by FourCC
+HEAVY_CODECS = ("hevc", "hev1", "hvc1", "h265", "av01", "vp09")
+# Sprint step rate used to predict adaptive sampling's dense windows
+_STEPS_PER_S = 4.5
+
+_log_lock = threading.Lock()
+_model = {"mtime": None, "coef": DEFAULT_MODEL}
+_recorded = 0
+_refit_thread = None
+
+
+class BudgetExceeded(ValueError):
+    """The analysis would not fit the memory or time budget"""
+
+
+def memory_limit_mb():
+    """Memory available to this container (cgroup limit) or machine"""
+    for path in ("/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory/memory.limit_in_bytes"):
+        try:
+            with open(path) as f:
+                value = f.read().strip()
+            # cgroup v1 reports "unlimited" as a huge number
+            if value != "max" and int(value) < 2 ** 60:
+                return int(value) / 2 ** 20
+        except (OSError, ValueError):
+            pass
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemTotal:"):
+                    return int(line.split()[1]) / 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def memory_budget_mb():
+    """Peak memory allowed per analysis"""
+    if MEMORY_BUDGET_MB > 0:
+        return MEMORY_BUDGET_MB
+    limit = memory_limit_mb()
+    if limit is None:
+        return None
+    return 0.8 * limit / (execution.worker_count() * max(1, ANALYSIS_PROCESSES))
+
+
+def current_model():
+    """Fitted coefficients if budget_model.json exists, else the defaults"""
+    try:
+        mtime = os.path.getmtime(MODEL_PATH)
+    except OSError:
+        return DEFAULT_MODEL
+    if mtime != _model["mtime"]:
+        with open(MODEL_PATH) as f:
+            fitted = json.load(f)
+        # Features added since the file was written keep their defaults
+        coef = {target: {**DEFAULT_MODEL[target], **fitted.get(target, {})} for target in DEFAULT_MODEL}
+        _model.update(mtime=mtime, coef=coef)
+    return _model["coef"]
+
+
+def fourcc(value: float):
+    """FourCC code as text, or None"""
+    code = int(value)
+    if code <= 0:
+        return None
+    text = "".join(chr((code >> (8 * i)) & 0xFF) for i in range(4)).strip("\x00 ")
+    return text.lower() if text.isprintable() else None
+
+
+def probe(video_path: str):
+    """Container properties, or None if the file cannot be opened"""
+    cap = cv2.VideoCapture(video_path)
+    try:
+        if not cap.isOpened():
+            return None
+        return {
+            "width": int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+            "height": int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+            "fps": cap.get(cv2.CAP_PROP_FPS),
+            "frame_count": max(0, int(cap.get(cv2.CAP_PROP_FRAME_COUNT))),
+            "codec": fourcc(cap.get(cv2.CAP_PROP_FOURCC)),
+        }
+    finally:
+        cap.release()
+
+
+def features(info: dict, sampling="full", infer_width=None, overlay=None, start_s=None, end_s=None, model="heavy"):
+    """Model inputs for a clip and the settings it would run with"""
+    width, height, fps = info["width"], info["height"], info["fps"] or 30.0
+    frames = info["frame_count"]
+    first = int(round(start_s * fps)) if start_s else 0
+    last = min(frames, int(round(end_s * fps))) if end_s is not None else frames
+    frames = max(0, last - first)
+
+    scale = min(1.0, infer_width / width) if infer_width and width else 1.0
+    decoded_mp = width * height / 1e6
+    inferred_mp = decoded_mp * scale * scale
+    overlay_mp = 0.0
+    if overlay is not None:
+        out_width = min(overlay.get("width") or width, width)
+        overlay_mp = decoded_mp * (out_width / width) ** 2 if width else 0.0
+
+    inferred = frames
+    if sampling == "adaptive":
+        # Sparse grid at the base rate plus a dense window around each step
+        step = max(1, round(fps / ADAPTIVE_BASE_FPS))
+        per_s = fps / step + _STEPS_PER_S * (2 * ADAPTIVE_MARGIN + step)
+        inferred = int(frames * min(1.0, per_s / fps))
+    # Cascade runs the lite model on every frame and the heavy one on a share
+    share = current_model()["cascade"]["refined_share"]
+    lite, refined = (inferred, int(frames * share)) if model == "cascade" else (0, 0)
+
+    return {
+        "memory_mb": {
+            "base": 1.0,
+            "decoded_mp": decoded_mp,
+            "inferred_mp": inferred_mp,
+            "overlay_mp": overlay_mp,
+            "kframes": frames / 1000.0,
+            "cascade": 1.0 if model == "cascade" else 0.0,
+        },
+        "extract_s": {
+            "base": 1.0,
+            "decoded_frame_mp": frames * decoded_mp,
+            "heavy_codec_frame_mp": frames * decoded_mp if info.get("codec") in HEAVY_CODECS else 0.0,
+            "inferred": float(inferred - lite),
+            "inferred_lite": float(lite),
+            "inferred_mp": inferred * inferred_mp,
+            "overlay_frame_mp": frames * overlay_mp,
+            "refined": float(refined),
+        },
+    }
+
+
+def estimate(feats: dict, model: dict = None):
+    """Predicted peak memory (MB) and extraction time (s)"""
+    model = model or current_model()
+    return {
+        target: sum(model[target].get(name, 0.0) * value for name, value in feats[target].items())
+        for target in ("memory_mb", "extract_s")
+    }
+
+
+def _over(est, budget_mb, max_s):
+    reasons = []
+    if budget_mb is not None and est["memory_mb"] > budget_mb:
+        reasons.append(f"estimated peak memory {est['memory_mb']:.0f} MB exceeds the {budget_mb:.0f} MB budget")
+    if max_s > 0 and est["extract_s"] > max_s:
+        reasons.append(f"estimated extraction time {est['extract_s']:.0f} s exceeds the {max_s:.0f} s limit")
+    return reasons
+
+
+def plan(
+    video_path: str,
+    sampling: str = "full",
+    overlay: dict = None,
+    start_s: float = None,
+    end_s: float = None,
+    policy: str = BUDGET_POLICY,
+    model: str = "heavy"
+):
+    """Settings to run an analysis with, after checking them against the budget.
+
+    Returns a dict with the (possibly downgraded) sampling, infer_width and
+    overlay, the list of changes made, the estimate and the features it
+    was computed from. Raises BudgetExceeded if the estimate does not fit.
+    policy="off" only estimates. video_path=None (no header to read yet)
+    skips the check.
+    """
+    info = probe(video_path) if video_path is not None else None
+    return plan_info(info, sampling, overlay, start_s, end_s, policy, model)
+
+
+def plan_info(
+    info: dict,
+    sampling: str = "full",
+    overlay: dict = None,
+    start_s: float = None,
+    end_s: float = None,
+    policy: str = BUDGET_POLICY,
+    model: str = "heavy"
+):
+    """plan() for container properties already read (see probe)"""
+    settings = {"sampling": sampling, "infer_width": None, "overlay": overlay}
+    if info is None or not info["width"]:
+        # Unreadable headers fail in extraction with a proper error
+        return {**settings, "downgraded": [], "estimate": None, "features": None}
+
+    budget_mb, max_s = (memory_budget_mb(), MAX_EXTRACT_S) if policy != "off" else (None, 0)
+    window = {"start_s": start_s, "end_s": end_s, "model": model}
+    feats = features(info, **settings, **window)
+    est = estimate(feats)
+    downgraded = []
+
+    if _over(est, budget_mb, max_s) and policy == "downgrade":
+        steps = []
+        if overlay is not None and (overlay.get("width") or info["width"]) > DOWNGRADE_WIDTH:
+            steps.append(("overlay", {**overlay, "width": DOWNGRADE_WIDTH}, f"overlay_width={DOWNGRADE_WIDTH}"))
+        if info["width"] > DOWNGRADE_WIDTH:
+            steps.append(("infer_width", DOWNGRADE_WIDTH, f"infer_width={DOWNGRADE_WIDTH}"))
+        if sampling == "full" and overlay is None and model == "heavy":
+            steps.append(("sampling", "adaptive", "sampling=adaptive"))
+        for key, value, label in steps:
+            settings[key] = value
+            downgraded.append(label)
+            feats = features(info, **settings, **window)
+            est = estimate(feats)
+            if not _over(est, budget_mb, max_s):
+                break
+
+    reasons = _over(est, budget_mb, max_s)
+    if reasons:
+        hints = []
+        if budget_mb is not None and est["memory_mb"] > budget_mb:
+            hints.append("a lower-resolution video" + (" or a smaller overlay_width" if overlay is not None else ""))
+        if max_s > 0 and est["extract_s"] > max_s:
+            hints.append("a shorter start_s/end_s window")
+        raise BudgetExceeded(
+            f"Video too large to analyse: {'; '.join(reasons)}"
+            f"{' even after downgrading' if downgraded else ''}. Try {' or '.join(hints)}"
+        )
+    return {
+        **settings,
+        "downgraded": downgraded,
+        "estimate": {k: round(v, 1) for k, v in est.items()},
+        "features": feats,
+    }
+
+
+def predict(info: dict, overlay: dict = None, start_s: float = None, end_s: float = None):
+    """Estimates for every sampling/model setting an analysis can be asked for.
+
+    Each entry has the settings, the estimate as requested, and what the
+    budget policy would do with them: run as is, downgrade (with the
+    downgraded estimate) or reject.
+    """
+    out = []
+    for sampling in SAMPLING_MODES:
+        for model in MODEL_MODES:
+            # Same combinations the API accepts (see main.model_option)
+            if overlay is not None and (sampling != "full" or model != "heavy"):
+                continue
+            if model == "cascade" and sampling != "full":
+                continue
+            settings = {"sampling": sampling, "model": model, "overlay": overlay, "start_s": start_s, "end_s": end_s}
+            as_requested = estimate(features(info, **settings))
+            entry = {
+                "sampling": sampling,
+                "model": model,
+                "estimate": {k: round(v, 1) for k, v in as_requested.items()},
+            }
+            try:
+                planned = plan_info(info, **settings)
+            except BudgetExceeded as e:
+                entry.update(fits=False, detail=str(e))
+            else:
+                entry.update(fits=True, downgraded=planned["downgraded"])
+                if planned["downgraded"]:
+                    entry["downgraded_estimate"] = planned["estimate"]
+            out.append(entry)
+    return out
+
+
+def _save_model(model: dict):
+    os.makedirs(DATA_DIR, exist_ok=True)
+    tmp = f"{MODEL_PATH}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(model, f, indent=2)
+    os.replace(tmp, MODEL_PATH)
+
+
+def _refit():
+    with _log_lock:
+        records = load_log(window=REFIT_WINDOW)
+    _save_model(fit(records))
+
+
+def record(planned: dict, usage: dict, extract_s: float, stages: dict = None, refined_share: float = None):
+    """Append an analysis's features and measured cost to the calibration log.
+
+    stages holds the seconds of each extraction stage (pose.STAGES); the
+    rest of extract_s is logged as "other_s". refined_share is the share
+    of frames a cascade run re-ran on the heavy model. Every REFIT_EVERY
+    records this process refits the model on the last REFIT_WINDOW
+    records, in a background thread.
+    """
+    global _recorded, _refit_thread
+    if planned.get("features") is None or "peak_rss_mb" not in usage:
+        return
+    entry = {
+        "time": time.time(),
+        "features": planned["features"],
+        "estimate": planned["estimate"],
+        "memory_mb": usage["peak_rss_mb"],
+        "start_rss_mb": usage.get("start_rss_mb"),
+        "extract_s": round(extract_s, 3),
+    }
+    if stages:
+        entry["stages"] = {name: round(float(stages[name]), 4) for name in STAGE_FEATURES if name in stages}
+        entry["stages"]["other_s"] = round(max(0.0, extract_s - sum(entry["stages"].values())), 4)
+    if refined_share is not None:
+        entry["refined_share"] = round(float(refined_share), 4)
+    os.makedirs(DATA_DIR, exist_ok=True)
+    with _log_lock:
+        with open(LOG_PATH, "a") as f:
+            f.write(json.dumps(entry) + "\n")
+        _recorded += 1
+        if REFIT_EVERY <= 0 or _recorded % REFIT_EVERY:
+            return
+        # A refit still running covers this one
+        if _refit_thread is not None and _refit_thread.is_alive():
+            return
+        _refit_thread = threading.Thread(target=_refit, name="budget-refit", daemon=True)
+        _refit_thread.start()
+
+
+def config():
+    """Effective budget settings"""
+    budget_mb = memory_budget_mb()
+    return {
+        "policy": BUDGET_POLICY,
+        "memory_budget_mb": None if budget_mb is None else round(budget_mb),
+        "max_extract_s": MAX_EXTRACT_S or None,
+        "downgrade_width": DOWNGRADE_WIDTH,
+        "model": "fitted" if os.path.exists(MODEL_PATH) else "default",
+        "refit_every": REFIT_EVERY,
+        "refit_window": REFIT_WINDOW,
+        "probe_timeout_s": PROBE_TIMEOUT_S,
+    }
+
+
+def _tail(path: str, count: int, block: int = 1 << 16):
+    """Last count lines of a file, read backwards from its end"""
+    with open(path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        pos = f.tell()
+        data = b""
+        while pos > 0 and data.count(b"\n") <= count:
+            step = min(block, pos)
+            pos -= step
+            f.seek(pos)
+            data = f.read(step) + data
+    # More than count line ends were read, so only a line before them can be cut off
+    return data.splitlines()[-count:]
+
+
+def load_log(path: str = LOG_PATH, window: int = 0):
+    """Records of the calibration log; the last window of them if window > 0"""
+    if window > 0:
+        lines = _tail(path, window)
+    else:
+        with open(path, "rb") as f:
+            lines = f.read().splitlines()
+    return [json.loads(line) for line in lines if line.strip()]
+
+
+def _nnls(records, target: str, names, value):
+    """Non-negative least-squares coefficients of names for value(record)"""
+    X = np.array([[r["features"][target].get(n, 0.0) for n in names] for r in records], dtype=float)
+    y = np.array([value(r) for r in records], dtype=float)
+    active = list(range(len(names)))
+    coef = np.zeros(len(names))
+    # Drop features that fit negative and refit the rest
+    while active:
+        sol = np.linalg.lstsq(X[:, active], y, rcond=None)[0]
+        if (sol >= 0).all():
+            coef[active] = sol
+            break
+        active = [a for a, c in zip(active, sol) if c >= 0]
+    return {n: float(c) for n, c in zip(names, coef)}
+
+
+def _measured(record):
+    """A record with the predicted count of cascade-refined frames replaced by the measured one"""
+    if "refined_share" not in record:
+        return record
+    extract = record["features"]["extract_s"]
+    extract = {**extract, "refined": record["refined_share"] * extract["inferred_lite"]}
+    return {**record, "features": {**record["features"], "extract_s": extract}}
+
+
+def fit(records, min_records: int = 10):
+    """Least-squares coefficients, non-negative, for each model.
+
+    With enough records carrying per-stage timings, each stage is fitted
+    on its own features and the time model is their sum; otherwise the
+    total time is fitted directly. The cascade's refined share is the
+    mean of the logged ones. A model with too few records keeps its
+    current coefficients.
+    """
+    model = json.loads(json.dumps(current_model()))
+    if len(records) < min_records:
+        return model
+    records = [_measured(r) for r in records]
+    cascaded = [r["refined_share"] for r in records if "refined_share" in r]
+    if len(cascaded) >= min_records:
+        model["cascade"]["refined_share"] = float(np.mean(cascaded))
+    model["memory_mb"] = _nnls(records, "memory_mb", list(DEFAULT_MODEL["memory_mb"]), lambda r: r["memory_mb"])
+    staged = [r for r in records if "stages" in r]
+    if len(staged) >= min_records:
+        for stage, names in STAGE_FEATURES.items():
+            model["extract_s"].update(_nnls(staged, "extract_s", names, lambda r: r["stages"].get(stage, 0.0)))
+    else:
+        model["extract_s"] = _nnls(records, "extract_s", list(DEFAULT_MODEL["extract_s"]), lambda r: r["extract_s"])
+    return model
+
+
+def model_error(records, model: dict):
+    """Mean absolute and worst under-estimate of each model on the records"""
+    report = {}
+    for target in ("memory_mb", "extract_s"):
+        if not records:
+            continue
+        err = np.array([estimate(r["features"], model)[target] - r[target] for r in records])
+        report[target] = {"mean_abs": round(float(np.mean(np.abs(err))), 2), "worst_under": round(float(err.min()), 2)}
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check or refit the memory and time estimates")
+    parser.add_argument("--fit", action="store_true", help="Fit the coefficients to the log and save them")
+    parser.add_argument("--log", default=LOG_PATH)
+    parser.add_argument("--window", type=int, default=REFIT_WINDOW, help="Most recent records to use; 0 for all")
+    args = parser.parse_args(argv)
+
+    records = load_log(args.log, window=args.window) if os.path.exists(args.log) else []
+    report = {"records": len(records), "current": model_error(records, current_model())}
+    if args.fit:
+        model = fit(records)
+        report["fitted"] = model_error(records, model)
+        report["model"] = model
+        _save_model(model)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
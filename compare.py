@@ -0,0 +1,155 @@
+"""Run-to-run comparison with banded dynamic time warping.
+
+Two analyses' per-frame speed and knee-angle curves are block-averaged to
+at most ``max_points`` samples, z-normalised with pooled statistics and
+aligned with a Sakoe-Chiba banded DTW.
+
+Each DP row is vectorised: with ``a[j] = c[j] + min(diag, up)`` the row
+recurrence ``D[j] = min(a[j], c[j] + D[j-1])`` unrolls to
+``D = C + minimum.accumulate(a - C)`` where ``C`` is the prefix sum of the
+row costs. Memory is one row of costs plus the band's direction codes,
+n x (2w + 1) of them for a band half-width of w samples. w is
+``band_frac`` of the longer series but at most ``MAX_BAND`` samples, so
+the codes grow linearly with series length rather than quadratically.
+"""
+import math
+
+import numpy as np
+
+COMPARE_FIELDS = ("speed_mps", "knee_angle_left", "knee_angle_right")
+
+DIAG, UP, LEFT = 0, 1, 2
+# Widest band half-width in samples, whatever band_frac asks for
+MAX_BAND = 400
+
+
+def block_mean(t, X, max_points):
+    """Average consecutive frames so at most max_points remain"""
+    n = X.shape[1]
+    factor = max(1, math.ceil(n / max_points))
+    if factor == 1:
+        return t, X
+    starts = np.arange(0, n, factor)
+    counts = np.diff(np.append(starts, n))
+    return (
+        np.add.reduceat(t, starts) / counts,
+        np.add.reduceat(X, starts, axis=1) / counts,
+    )
+
+
+def banded_dtw(A, B, band_frac=0.1, max_band=MAX_BAND):
+    """Align feature sequences A (n, d) and B (m, d) within a diagonal band.
+
+    The band's half-width is band_frac of the longer series, capped at
+    max_band samples (but never narrower than the diagonal's slope needs).
+    Returns the warping path as index arrays into A and B, and the total
+    squared-distance cost along it.
+    """
+    n, m = len(A), len(B)
+    slope = (m - 1) / max(1, n - 1)
+    w = max(1, min(int(band_frac * max(n, m)), max_band), math.ceil(slope))
+    centers = np.rint(np.arange(n) * slope).astype(int)
+    los = np.clip(centers - w, 0, m - 1)
+    his = np.clip(centers + w, 0, m - 1)
+    los[-1] = min(los[-1], m - 1)
+    his[-1] = m - 1
+
+    prev = np.full(m + 1, np.inf)  # prev[j + 1] holds D[i-1, j]; prev[0] is the j = -1 sentinel
+    dirs = []
+    for i in range(n):
+        lo, hi = los[i], his[i]
+        c = ((B[lo:hi + 1] - A[i]) ** 2).sum(axis=1)
+        if i == 0:
+            diag = np.full(len(c), np.inf)
+            up = np.full(len(c), np.inf)
+            if lo == 0:
+                diag[0] = 0.0
+        else:
+            diag = prev[lo:hi + 1]
+            up = prev[lo + 1:hi + 2]
+        from_up = up < diag
+        a = c + np.where(from_up, up, diag)
+        C = np.cumsum(c)
+        D = C + np.minimum.accumulate(a - C)
+        left = np.concatenate([[np.inf], D[:-1]]) + c < a
+        code = np.where(left, LEFT, np.where(from_up, UP, DIAG)).astype(np.int8)
+        dirs.append(code)
+        prev = np.full(m + 1, np.inf)
+        prev[lo + 1:hi + 2] = D
+
+    total = float(prev[m])
+    if not np.isfinite(total):
+        raise ValueError("Band too narrow to align these series")
+
+    path_a, path_b = [], []
+    i, j = n - 1, m - 1
+    while True:
+        path_a.append(i)
+        path_b.append(j)
+        if i == 0 and j == 0:
+            break
+        step = dirs[i][j - los[i]]
+        if step == DIAG:
+            i, j = i - 1, j - 1
+        elif step == UP:
+            i -= 1
+        else:
+            j -= 1
+    return np.array(path_a[::-1]), np.array(path_b[::-1]), total
+
+
+def _channels(lod):
+    fields = [str(f) for f in lod["fields"]]
+    rows = [fields.index(f) for f in COMPARE_FIELDS]
+    return np.asarray(lod["t"], dtype=float), lod["values"][rows].astype(float)
+
+
+def compare_runs(lod_a: dict, lod_b: dict, phases=4, band_frac=0.1, max_points=4000):
+    """Align two analyses and report overall and per-phase differences (B - A)"""
+    t_a, X_a = block_mean(*_channels(lod_a), max_points)
+    t_b, X_b = block_mean(*_channels(lod_b), max_points)
+    if X_a.shape[1] < 2 or X_b.shape[1] < 2:
+        raise ValueError("Both analyses need at least two frames")
+
+    pooled = np.concatenate([X_a, X_b], axis=1)
+    mean = pooled.mean(axis=1, keepdims=True)
+    std = pooled.std(axis=1, keepdims=True) + 1e-9
+    ia, ib, cost = banded_dtw(((X_a - mean) / std).T, ((X_b - mean) / std).T, band_frac)
+
+    diff = X_b[:, ib] - X_a[:, ia]
+    # Phases split run A's duration evenly; each covers the path steps whose
+    # A sample falls inside it
+    edges = np.linspace(t_a[0], t_a[-1], phases + 1)
+    phase_of = np.clip(np.searchsorted(edges, t_a[ia], side="right") - 1, 0, phases - 1)
+
+    out = []
+    for k in range(phases):
+        sel = phase_of == k
+        if not sel.any():
+            continue
+        a0, a1 = t_a[ia[sel]].min(), t_a[ia[sel]].max()
+        b0, b1 = t_b[ib[sel]].min(), t_b[ib[sel]].max()
+        out.append({
+            "phase": k + 1,
+            "a_start_s": round(float(a0), 2),
+            "a_end_s": round(float(a1), 2),
+            "b_start_s": round(float(b0), 2),
+            "b_end_s": round(float(b1), 2),
+            "duration_diff_s": round(float((b1 - b0) - (a1 - a0)), 2),
+            **{
+                f"{field}_diff": round(float(diff[r, sel].mean()), 2)
+                for r, field in enumerate(COMPARE_FIELDS)
+            },
+        })
+
+    return {
+        "duration_a_s": round(float(t_a[-1] - t_a[0]), 2),
+        "duration_b_s": round(float(t_b[-1] - t_b[0]), 2),
+        "alignment_cost": round(cost / len(ia), 4),
+        "path_length": int(len(ia)),
+        "overall": {
+            f"{field}_diff": round(float(diff[r].mean()), 2)
+            for r, field in enumerate(COMPARE_FIELDS)
+        },
+        "phases": out,
+    }
@@ -0,0 +1,212 @@
+"""Video decoding backends for pose extraction.
+
+Pose extraction needs three things from a decoder: the next frame (or to
+skip it cheaply), an RGB copy of a frame at the inference size, and the
+source-size BGR frame when an overlay is rendered. Backends:
+
+- ``opencv`` (default): ``cv2.VideoCapture`` decoding into ``FrameRing``'s
+  preallocated BGR buffers; the inference copy takes a separate
+  ``cvtColor`` (and ``resize`` when downscaling)
+- ``pyav``: PyAV (``pip install av``), FFmpeg's decoder driven directly.
+  libswscale converts each frame straight to RGB at the inference size in
+  one pass, so the BGR intermediate and the separate conversion go away;
+  BGR is only produced for an overlay
+
+Both decode with codec threads: ``SPRINT_DECODER_THREADS`` sets how many
+(0 lets FFmpeg choose from the core count), and for PyAV
+``SPRINT_DECODER_THREAD_TYPE`` picks frame threading (decodes several
+frames at once; best throughput, a few frames of latency), slice threading
+(splits each frame; only for streams encoded with slices) or both
+(``auto``). Neither needs hardware support.
+
+``bench_decode.py`` measures frames/s of each backend and setting.
+"""
+import os
+
+import cv2
+
+import objects
+from frames import FrameRing
+
+DECODER_BACKENDS = ("opencv", "pyav")
+DECODER_BACKEND = os.environ.get("SPRINT_DECODER", "opencv")
+DECODER_THREADS = int(os.environ.get("SPRINT_DECODER_THREADS", "0"))
+THREAD_TYPES = ("auto", "frame", "slice")
+DECODER_THREAD_TYPE = os.environ.get("SPRINT_DECODER_THREAD_TYPE", "auto")
+
+
+class OpenCVDecoder:
+    """cv2.VideoCapture with reusable frame buffers"""
+
+    name = "opencv"
+
+    def __init__(self, source: str, max_width: int = None, threads: int = DECODER_THREADS, thread_type=None):
+        if threads > 0:
+            self.cap = cv2.VideoCapture(source, cv2.CAP_ANY, [cv2.CAP_PROP_N_THREADS, threads])
+        else:
+            self.cap = cv2.VideoCapture(source)
+        self.fps = self.cap.get(cv2.CAP_PROP_FPS)
+        self.width = self.cap.get(cv2.CAP_PROP_FRAME_WIDTH)
+        self.height = self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT)
+        self.frame_count = max(0, int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT)))
+        self.ring = FrameRing(self.width, self.height, max_width=max_width)
+
+    def is_opened(self):
+        return self.cap.isOpened()
+
+    def read(self):
+        """Decode the next frame; None at end of stream"""
+        return self.ring.read(self.cap)
+
+    def grab(self):
+        """Skip the next frame; False at end of stream"""
+        return self.cap.grab()
+
+    def seek(self, frame: int):
+        """Move near frame; returns the index of the next frame, or None if seeking failed"""
+        if not self.cap.set(cv2.CAP_PROP_POS_FRAMES, frame):
+            return None
+        return int(self.cap.get(cv2.CAP_PROP_POS_FRAMES))
+
+    def to_rgb(self, frame):
+        """RGB copy at the inference size, valid until the next call"""
+        return self.ring.to_rgb(frame)
+
+    def to_bgr(self, frame):
+        """Source-size BGR image of a frame"""
+        return frame
+
+    def close(self):
+        self.cap.release()
+
+
+class PyAVDecoder:
+    """FFmpeg through PyAV, converting straight to RGB at the inference size"""
+
+    name = "pyav"
+
+    def __init__(
+        self, source: str, max_width: int = None, threads: int = DECODER_THREADS,
+        thread_type: str = DECODER_THREAD_TYPE
+    ):
+        try:
+            import av
+        except ImportError:
+            raise RuntimeError("SPRINT_DECODER=pyav needs PyAV (pip install av)") from None
+        self._av = av
+        self.container = None
+        self._pending = None
+        try:
+            # Same read-ahead and reconnect settings OpenCV gets for object URLs
+            remote = source.startswith(("http://", "https://"))
+            self.container = av.open(source, options=dict(objects.FFMPEG_OPTIONS) if remote else None)
+            self.stream = self.container.streams.video[0]
+        except (av.error.FFmpegError, IndexError, OSError):
+            self.fps = self.width = self.height = 0
+            self.frame_count = 0
+            return
+        ctx = self.stream.codec_context
+        ctx.thread_type = thread_type.upper()
+        if threads > 0:
+            ctx.thread_count = threads
+        self.fps = float(self.stream.average_rate or self.stream.guessed_rate or 0)
+        self.width, self.height = ctx.width, ctx.height
+        self.frame_count = self.stream.frames or (
+            int(float(self.stream.duration * self.stream.time_base) * self.fps) if self.stream.duration else 0
+        )
+        self._start = self.stream.start_time or 0
+        self.size = (self.width, self.height)
+        self.interpolation = None
+        if max_width and self.width > max_width:
+            self.size = (int(max_width), max(1, int(round(self.height * max_width / self.width))))
+            self.interpolation = "AREA"
+        self._frames = self.container.decode(self.stream)
+
+    def is_opened(self):
+        return self.container is not None
+
+    def read(self):
+        """Decode the next frame; None at end of stream. Raises RuntimeError on corrupt data"""
+        if self._pending is not None:
+            frame, self._pending = self._pending, None
+            return frame
+        try:
+            return next(self._frames)
+        except (StopIteration, self._av.error.EOFError):
+            return None
+        except self._av.error.InvalidDataError as e:
+            raise RuntimeError(f"Corrupt video data: {e}") from None
+
+    def grab(self):
+        """Skip the next frame; False at end of stream. The codec still decodes it"""
+        return self.read() is not None
+
+    def _index(self, frame):
+        if frame.pts is None:
+            return -1
+        return int(round(float((frame.pts - self._start) * self.stream.time_base) * self.fps))
+
+    def seek(self, frame: int):
+        """Seek to frame: from the keyframe before it, decoding forward.
+
+        Returns the index of the next frame, which is past frame when the
+        stream has no frame at that index, or None if seeking failed.
+        """
+        if not self.fps:
+            return None
+        target = self._start + int(frame / self.fps / self.stream.time_base)
+        try:
+            self.container.seek(target, stream=self.stream, backward=True)
+        except self._av.error.FFmpegError:
+            return None
+        self._frames = self.container.decode(self.stream)
+        self._pending = None
+        while True:
+            decoded = self.read()
+            if decoded is None:
+                return None
+            if self._index(decoded) >= frame:
+                self._pending = decoded
+                return self._index(decoded)
+
+    def to_rgb(self, frame):
+        """RGB copy at the inference size, converted and scaled in one pass"""
+        if self.interpolation is None:
+            return frame.to_ndarray(format="rgb24")
+        return frame.to_ndarray(
+            format="rgb24", width=self.size[0], height=self.size[1], interpolation=self.interpolation
+        )
+
+    def to_bgr(self, frame):
+        """Source-size BGR image of a frame"""
+        return frame.to_ndarray(format="bgr24")
+
+    def close(self):
+        if self.container is not None:
+            self.container.close()
+
+
+_BACKENDS = {"opencv": OpenCVDecoder, "pyav": PyAVDecoder}
+
+
+def open_decoder(source: str, max_width: int = None, backend: str = None, threads: int = None, thread_type: str = None):
+    """Decoder for a file or URL with the configured (or given) backend and threading.
+
+    max_width downscales wider frames for inference (see FrameRing).
+    Check is_opened() before use.
+    """
+    backend = backend or DECODER_BACKEND
+    if backend not in _BACKENDS:
+        raise ValueError(f"SPRINT_DECODER must be one of: {', '.join(DECODER_BACKENDS)}")
+    thread_type = thread_type or DECODER_THREAD_TYPE
+    if thread_type not in THREAD_TYPES:
+        raise ValueError(f"SPRINT_DECODER_THREAD_TYPE must be one of: {', '.join(THREAD_TYPES)}")
+    return _BACKENDS[backend](
+        source, max_width=max_width, threads=DECODER_THREADS if threads is None else threads,
+        thread_type=thread_type
+    )
+
+
+def config():
+    """Decoder settings as reported by /runtime"""
+    return {"backend": DECODER_BACKEND, "threads": DECODER_THREADS, "thread_type": DECODER_THREAD_TYPE}
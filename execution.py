@@ -0,0 +1,156 @@
+"""CPU topology-aware thread budgeting.
+
+Every uvicorn worker runs its own OpenCV, MediaPipe (TFLite) and NumPy/BLAS
+thread pools, each sized for every core on the machine by default. With
+several workers this oversubscribes the CPU heavily. ``configure()`` detects
+the cores this process may actually use (affinity mask and cgroup CPU quota),
+divides them between the workers and caps each library accordingly.
+
+MediaPipe's solutions API has no thread-count option, so its threads are
+contained by pinning the worker to its share of cores (``SPRINT_PIN_CPUS``).
+
+``configure()`` must run before NumPy or OpenCV are imported, because BLAS
+reads its thread count from the environment at load time. This module
+therefore imports neither at module level.
+
+Environment:
+- ``SPRINT_WORKERS`` / ``WEB_CONCURRENCY``: workers sharing the machine
+- ``SPRINT_THREADS_PER_WORKER``: override the computed budget
+- ``SPRINT_OPENCV_THREADS`` / ``SPRINT_BLAS_THREADS``: per-library overrides
+- ``SPRINT_PIN_CPUS=1``: pin each worker to a disjoint slice of cores
+"""
+import fcntl
+import math
+import os
+import tempfile
+
+BLAS_ENV_VARS = (
+    "OMP_NUM_THREADS",
+    "OPENBLAS_NUM_THREADS",
+    "MKL_NUM_THREADS",
+    "BLIS_NUM_THREADS",
+    "VECLIB_MAXIMUM_THREADS",
+    "NUMEXPR_NUM_THREADS",
+)
+
+SLOTS_DIR = os.path.join(
+    os.environ.get("SPRINT_DATA_DIR", os.path.join(tempfile.gettempdir(), "sprint_ai")),
+    "cpu_slots",
+)
+
+_config = None
+_slot_handle = None
+
+
+def _env_int(name, default=None):
+    value = os.environ.get(name)
+    return int(value) if value else default
+
+
+def allowed_cpus():
+    """CPU ids in this process's affinity mask"""
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def cgroup_cpu_limit():
+    """CPU limit from the cgroup quota (v2 or v1), or None if unlimited"""
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()[:2]
+        if quota != "max":
+            return int(quota) / int(period)
+        return None
+    except (OSError, ValueError):
+        pass
+    try:
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as f:
+            quota = int(f.read())
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as f:
+            period = int(f.read())
+        if quota > 0 and period > 0:
+            return quota / period
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def effective_cpus():
+    """Cores usable by this process, honouring affinity and cgroup quota"""
+    cpus = len(allowed_cpus())
+    limit = cgroup_cpu_limit()
+    if limit is not None:
+        cpus = min(cpus, max(1, math.ceil(limit)))
+    return max(1, cpus)
+
+
+def worker_count():
+    """Number of server workers sharing the cores"""
+    return max(1, _env_int("SPRINT_WORKERS", _env_int("WEB_CONCURRENCY", 1)))
+
+
+def claim_slot(num_slots):
+    """Claim a free worker slot with a lock file held for the process lifetime"""
+    global _slot_handle
+    os.makedirs(SLOTS_DIR, exist_ok=True)
+    for slot in range(num_slots):
+        handle = open(os.path.join(SLOTS_DIR, f"slot-{slot}.lock"), "w")
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            handle.close()
+            continue
+        _slot_handle = handle
+        return slot
+    return None
+
+
+def configure():
+    """Apply the per-worker thread budget; safe to call more than once"""
+    global _config
+    if _config is not None:
+        return _config
+
+    cpus = allowed_cpus()
+    total = effective_cpus()
+    workers = worker_count()
+    budget = _env_int("SPRINT_THREADS_PER_WORKER", max(1, total // workers))
+    opencv_threads = _env_int("SPRINT_OPENCV_THREADS", budget)
+    # The pipeline's NumPy work is small element-wise maths, so BLAS gets one
+    # thread unless asked otherwise
+    blas_threads = _env_int("SPRINT_BLAS_THREADS", 1)
+
+    for var in BLAS_ENV_VARS:
+        os.environ.setdefault(var, str(blas_threads))
+
+    pinned = None
+    slot = None
+    if os.environ.get("SPRINT_PIN_CPUS") == "1" and hasattr(os, "sched_setaffinity"):
+        slot = claim_slot(workers)
+        if slot is not None:
+            share = max(1, len(cpus) // workers)
+            pinned = cpus[slot * share:(slot + 1) * share] or cpus[-share:]
+            os.sched_setaffinity(0, pinned)
+
+    import cv2
+    cv2.setNumThreads(opencv_threads)
+
+    _config = {
+        "pid": os.getpid(),
+        "allowed_cpus": len(cpus),
+        "cgroup_cpu_limit": cgroup_cpu_limit(),
+        "effective_cpus": total,
+        "workers": workers,
+        "threads_per_worker": budget,
+        "opencv_threads": cv2.getNumThreads(),
+        "blas_threads": int(os.environ["OMP_NUM_THREADS"]),
+        "worker_slot": slot,
+        "pinned_cpus": pinned,
+    }
+    return _config
+
+
+def current_config():
+    """Effective execution configuration of this worker"""
+    return configure()
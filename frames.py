@@ -0,0 +1,120 @@
+"""Reusable buffers for the pose-extraction frame loop.
+
+``cap.read()`` and ``cv2.cvtColor`` allocate a fresh image per frame by
+default, and collecting landmarks as Python tuples allocates several objects
+per keypoint. At 240 fps on 1080p footage that is gigabytes of allocator
+churn per clip. Here decoding writes into a small ring of preallocated BGR
+frames, colour conversion uses a fixed ``dst=`` target and landmark
+coordinates go straight into a preallocated float array that grows by
+doubling.
+
+A frame from the ring stays valid until the ring wraps around; consumers
+that keep frames longer (the overlay writer) must copy them.
+"""
+import os
+
+import cv2
+import numpy as np
+
+FRAME_RING_SIZE = max(1, int(os.environ.get("SPRINT_FRAME_RING_SIZE", "2")))
+
+
+class FrameRing:
+    """Preallocated BGR frames decoded into in turn, plus one RGB target"""
+
+    def __init__(self, width: int, height: int, size: int = FRAME_RING_SIZE, max_width: int = None):
+        shape = (int(height), int(width), 3)
+        known = shape[0] > 0 and shape[1] > 0
+        self.frames = [np.empty(shape, dtype=np.uint8) if known else None for _ in range(size)]
+        # Frames wider than max_width are downscaled before conversion
+        self.scaled = None
+        if known and max_width and shape[1] > max_width:
+            shape = (max(1, int(round(shape[0] * max_width / shape[1]))), int(max_width), 3)
+            self.scaled = np.empty(shape, dtype=np.uint8)
+        self.rgb = np.empty(shape, dtype=np.uint8) if known else None
+        self._i = 0
+
+    def read(self, cap):
+        """Decode the next frame into the ring; None at end of stream"""
+        buf = self.frames[self._i]
+        ret, frame = cap.read(buf) if buf is not None else cap.read()
+        if not ret:
+            return None
+        if frame is not buf:
+            # Size differed from the container header; adopt the new buffer
+            self.frames[self._i] = frame
+        self._i = (self._i + 1) % len(self.frames)
+        return frame
+
+    def to_rgb(self, frame):
+        """Convert a ring frame to RGB in the shared target buffer"""
+        if self.scaled is not None:
+            frame = cv2.resize(
+                frame, (self.scaled.shape[1], self.scaled.shape[0]), dst=self.scaled, interpolation=cv2.INTER_AREA
+            )
+        if self.rgb is None or self.rgb.shape != frame.shape:
+            self.rgb = np.empty_like(frame)
+        return cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=self.rgb)
+
+
+class LandmarkBuffer:
+    """Pixel coordinates and visibility of selected landmarks, one row per frame"""
+
+    def __init__(self, landmark_ids, width: float, height: float, capacity: int = 256):
+        self.ids = tuple(landmark_ids)
+        self.width = width
+        self.height = height
+        self.data = np.empty((max(1, capacity), len(self.ids), 2), dtype=float)
+        self.vis = np.empty((max(1, capacity), len(self.ids)), dtype=float)
+        self.frame_ids = np.empty(max(1, capacity), dtype=np.int64)
+        self.n = 0
+
+    def append(self, landmarks, frame_id: int = -1):
+        """Store one frame of MediaPipe landmarks"""
+        if self.n == len(self.data):
+            grown = np.empty((2 * len(self.data),) + self.data.shape[1:], dtype=float)
+            grown[:self.n] = self.data
+            self.data = grown
+            self.vis = np.resize(self.vis, grown.shape[:2])
+            self.frame_ids = np.resize(self.frame_ids, len(grown))
+        self.frame_ids[self.n] = frame_id
+        row = self.data[self.n]
+        vis = self.vis[self.n]
+        for k, idx in enumerate(self.ids):
+            p = landmarks[idx]
+            row[k, 0] = p.x * self.width
+            row[k, 1] = p.y * self.height
+            vis[k] = p.visibility
+        self.n += 1
+
+    def frames(self):
+        """Source frame index of every stored row"""
+        return self.frame_ids[:self.n].copy()
+
+    def points(self, idx):
+        """(frames, 2) coordinates of one landmark"""
+        return self.data[:self.n, self.ids.index(idx)].copy()
+
+    def visibility(self):
+        """(frames, K) visibility scores"""
+        return self.vis[:self.n].copy()
+
+    def merge(self, other: "LandmarkBuffer"):
+        """Take other's rows: they replace rows of the same frame, new frames are inserted in order"""
+        if other.n == 0:
+            return
+        keep = ~np.isin(self.frame_ids[:self.n], other.frame_ids[:other.n])
+        frame_ids = np.concatenate([self.frame_ids[:self.n][keep], other.frame_ids[:other.n]])
+        order = np.argsort(frame_ids, kind="stable")
+        self.data = np.concatenate([self.data[:self.n][keep], other.data[:other.n]])[order]
+        self.vis = np.concatenate([self.vis[:self.n][keep], other.vis[:other.n]])[order]
+        self.frame_ids = frame_ids[order]
+        self.n = len(order)
+
+
+def fill_normalized(landmarks, out):
+    """Write normalized (x, y) of all landmarks into out, an (N, 2) array"""
+    for k, p in enumerate(landmarks):
+        out[k, 0] = p.x
+        out[k, 1] = p.y
+    return out
@@ -0,0 +1,466 @@
+"""Pose-inference backends for pose extraction.
+
+An estimator turns RGB frames into the 33 BlazePose landmarks (objects with
+normalized ``x``/``y`` and a ``visibility``), tracking one runner from frame
+to frame. Frames are handed over with ``submit`` and their landmarks (or
+None where no pose was found) come back in order from ``flush``; backends
+that batch run several submitted frames in one call, the others infer on
+submit. ``submit`` never keeps the RGB image, so decode buffers can be
+reused straight away. Backends:
+
+- ``solution`` (default): ``mp.solutions.pose``, one frame per call
+- ``tasks``: MediaPipe Tasks ``PoseLandmarker`` in VIDEO mode, from a
+  ``.task`` bundle (``SPRINT_POSE_MODEL``). Frame timestamps drive its
+  landmark smoothing
+- ``onnx``: ONNX Runtime on CPU (``pip install onnxruntime``) with a
+  BlazePose landmark model (``SPRINT_POSE_MODEL``) and pose detector
+  (``SPRINT_POSE_DETECTOR``) exported to ONNX; either may be quantized
+  (e.g. with ``onnxruntime.quantization.quantize_dynamic``). Up to
+  ``SPRINT_POSE_BATCH`` frames share one landmark-model call when the model
+  has a dynamic batch dimension. Frames of a batch are cropped around the
+  runner's position as of the previous batch, up to N-1 frames old, as
+  batching cannot wait for each frame's result; the detector only runs when
+  the runner is lost. Landmarks are smoothed with the same one-euro filters
+  as the MediaPipe graph
+
+For cascade mode, ``SPRINT_POSE_LITE_MODEL`` is the first-pass model of the
+tasks and onnx backends; the solution backend uses the lighter
+``model_complexity`` it is given.
+
+Concurrent extractions in one process can also share the onnx landmark
+model, batching frames across them (``SPRINT_POSE_MAX_BATCH``, see
+``batching``).
+
+``bench_pose.py`` measures frames/s of each backend and batch size.
+"""
+import math
+import os
+from typing import NamedTuple
+
+import mediapipe as mp
+import numpy as np
+
+POSE_BACKENDS = ("solution", "tasks", "onnx")
+POSE_BACKEND = os.environ.get("SPRINT_POSE_BACKEND", "solution")
+POSE_MODEL = os.environ.get("SPRINT_POSE_MODEL", "")
+POSE_LITE_MODEL = os.environ.get("SPRINT_POSE_LITE_MODEL", "")
+POSE_DETECTOR = os.environ.get("SPRINT_POSE_DETECTOR", "")
+# Frames per landmark-model call; 1 until larger batches' stale crops are
+# shown to keep parity with the solution backend on fast runners
+POSE_BATCH = max(1, int(os.environ.get("SPRINT_POSE_BATCH", "1")))
+# ONNX Runtime intra-op threads; 0 uses the worker's thread budget
+POSE_THREADS = int(os.environ.get("SPRINT_POSE_THREADS", "0"))
+
+NUM_LANDMARKS = 33
+
+
+class Landmark(NamedTuple):
+    x: float
+    y: float
+    z: float
+    visibility: float
+
+
+class Estimator:
+    """Queue of submitted frames' results; subclasses implement _infer and reset"""
+
+    name = None
+    batch_size = 1
+
+    def __init__(self):
+        self._results = []
+
+    def submit(self, rgb, t_ms: float = None):
+        """Hand over one RGB frame; t_ms is its timestamp within the clip"""
+        self._results.append(self._infer(rgb, t_ms))
+
+    def flush(self):
+        """Landmarks (or None) of every frame submitted since the last flush, in order"""
+        results, self._results = self._results, []
+        return results
+
+    def process(self, rgb, t_ms: float = None):
+        """Landmarks of a single frame, or None"""
+        self.submit(rgb, t_ms)
+        return self.flush()[-1]
+
+    def reset(self, width: int, height: int):
+        """Forget the tracked runner, so the next frame starts from detection"""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class SolutionEstimator(Estimator):
+    """mp.solutions.pose"""
+
+    name = "solution"
+
+    def __init__(self, settings: dict, lite: bool = False):
+        super().__init__()
+        self.pose = mp.solutions.pose.Pose(**settings)
+
+    def _infer(self, rgb, t_ms):
+        res = self.pose.process(rgb)
+        return res.pose_landmarks.landmark if res.pose_landmarks else None
+
+    def reset(self, width: int, height: int):
+        # An empty frame makes the graph lose track, which also resets
+        # landmark smoothing
+        self.pose.process(np.zeros((max(1, int(height)), max(1, int(width)), 3), dtype=np.uint8))
+
+    def close(self):
+        self.pose.close()
+
+
+class TasksEstimator(Estimator):
+    """MediaPipe Tasks PoseLandmarker in VIDEO mode"""
+
+    name = "tasks"
+
+    def __init__(self, settings: dict, lite: bool = False):
+        super().__init__()
+        from mediapipe.tasks.python import BaseOptions, vision
+        path = model_path(self.name, lite)
+        self.landmarker = vision.PoseLandmarker.create_from_options(vision.PoseLandmarkerOptions(
+            base_options=BaseOptions(model_asset_path=path),
+            running_mode=vision.RunningMode.VIDEO,
+            num_poses=1,
+            min_pose_detection_confidence=settings["min_detection_confidence"],
+            min_pose_presence_confidence=settings["min_tracking_confidence"],
+            min_tracking_confidence=settings["min_tracking_confidence"],
+        ))
+        # VIDEO mode needs strictly increasing timestamps across clips and
+        # resets, so clip timestamps are shifted past the last one used
+        self._base = 0
+        self._last = -1
+
+    def _detect(self, rgb, ts):
+        self._last = ts
+        image = mp.Image(image_format=mp.ImageFormat.SRGB, data=np.ascontiguousarray(rgb))
+        return self.landmarker.detect_for_video(image, ts)
+
+    def _infer(self, rgb, t_ms):
+        ts = self._base + int(t_ms) if t_ms is not None else self._last + 33
+        res = self._detect(rgb, max(ts, self._last + 1))
+        return res.pose_landmarks[0] if res.pose_landmarks else None
+
+    def reset(self, width: int, height: int):
+        self._detect(np.zeros((max(1, int(height)), max(1, int(width)), 3), dtype=np.uint8), self._last + 1)
+        self._base = self._last + 1000
+
+    def close(self):
+        self.landmarker.close()
+
+
+def _sigmoid(x):
+    return 1.0 / (1.0 + np.exp(-np.clip(x, -80.0, 80.0)))
+
+
+def _ssd_anchors(size=224, strides=(8, 16, 32, 32, 32)):
+    """Anchor centres of the BlazePose detector: two per cell, the last three layers sharing a grid"""
+    anchors = []
+    layer = 0
+    while layer < len(strides):
+        per_cell = 0
+        stride = strides[layer]
+        while layer < len(strides) and strides[layer] == stride:
+            per_cell += 2
+            layer += 1
+        cells = math.ceil(size / stride)
+        grid = (np.arange(cells) + 0.5) / cells
+        ys, xs = np.meshgrid(grid, grid, indexing="ij")
+        anchors.append(np.repeat(np.stack([xs.ravel(), ys.ravel()], axis=1), per_cell, axis=0))
+    return np.concatenate(anchors).astype(np.float32)
+
+
+class _OneEuro:
+    """MediaPipe's one-euro landmark filter over an array of pixel coordinates.
+
+    Values are scaled by 1 / the object's size, so the cutoff adapts to
+    how fast the runner moves relative to their size in the frame.
+    """
+
+    def __init__(self, min_cutoff: float, beta: float, derivate_cutoff: float = 1.0):
+        self.min_cutoff = min_cutoff
+        self.beta = beta
+        self.derivate_cutoff = derivate_cutoff
+        self.reset()
+
+    def reset(self):
+        self.t = None
+        self.value = self.raw = self.speed = None
+
+    @staticmethod
+    def _alpha(cutoff, freq):
+        return 1.0 / (1.0 + freq / (2 * math.pi * cutoff))
+
+    def __call__(self, t: float, value, scale: float):
+        if self.t is None:
+            self.t, self.value, self.raw, self.speed = t, value, value, np.zeros_like(value)
+            return value
+        freq = 1.0 / (t - self.t) if t > self.t else 30.0
+        speed = (value - self.raw) * scale * freq
+        self.speed = self.speed + self._alpha(self.derivate_cutoff, freq) * (speed - self.speed)
+        alpha = self._alpha(self.min_cutoff + self.beta * np.abs(self.speed), freq)
+        self.value = self.value + alpha * (value - self.value)
+        self.t, self.raw = t, value
+        return self.value
+
+
+class Track:
+    """State of one tracked runner.
+
+    roi is the next crop (centre and side in pixels, rotation in radians),
+    and the filters smooth landmarks the way the MediaPipe graph does.
+    """
+
+    def __init__(self):
+        self.roi = None
+        self.landmarks = _OneEuro(min_cutoff=0.05, beta=80.0)
+        self.aux = _OneEuro(min_cutoff=0.01, beta=10.0)
+        self.visibility = None
+        self.t = 0.0
+
+    def lose(self):
+        self.roi = None
+        self.landmarks.reset()
+        self.aux.reset()
+        self.visibility = None
+
+
+class OnnxEstimator(Estimator):
+    """BlazePose detector and landmark models on ONNX Runtime, batching landmark inference"""
+
+    name = "onnx"
+    # Crop side relative to twice the hip-centre to body-top distance
+    ROI_SCALE = 1.25
+
+    def __init__(self, settings: dict, lite: bool = False, batch_size: int = POSE_BATCH, threads: int = POSE_THREADS):
+        super().__init__()
+        try:
+            import onnxruntime as ort
+        except ImportError:
+            raise RuntimeError("SPRINT_POSE_BACKEND=onnx needs ONNX Runtime (pip install onnxruntime)") from None
+        if not POSE_DETECTOR:
+            raise ValueError("SPRINT_POSE_BACKEND=onnx needs SPRINT_POSE_DETECTOR")
+        import cv2
+        import execution
+        self._cv2 = cv2
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = threads or execution.configure()["threads_per_worker"]
+        options.inter_op_num_threads = 1
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        providers = ["CPUExecutionProvider"]
+        self.landmarker = ort.InferenceSession(model_path(self.name, lite), options, providers=providers)
+        self.detector = ort.InferenceSession(POSE_DETECTOR, options, providers=providers)
+        self._lm_input = self.landmarker.get_inputs()[0]
+        self._det_input = self.detector.get_inputs()[0]
+        # Exported models come as NHWC or NCHW; the side is read from the shape
+        self._lm_nchw = self._lm_input.shape[1] == 3
+        self._det_nchw = self._det_input.shape[1] == 3
+        self._lm_size = int(self._lm_input.shape[2 if self._lm_nchw else 1])
+        self._det_size = int(self._det_input.shape[2 if self._det_nchw else 1])
+        self._anchors = _ssd_anchors(self._det_size)
+        fixed = isinstance(self._lm_input.shape[0], int)
+        self.batch_size = 1 if fixed else max(1, int(batch_size))
+        self.min_detection = settings["min_detection_confidence"]
+        self.min_presence = settings["min_tracking_confidence"]
+        self._track = Track()
+        self._crops = np.zeros((self.batch_size, self._lm_size, self._lm_size, 3), dtype=np.float32)
+        # (entry, crop slot or None) per submitted frame
+        self._pending = []
+        self._n = 0
+
+    def _to_input(self, images, nchw):
+        return np.ascontiguousarray(images.transpose(0, 3, 1, 2)) if nchw else images
+
+    def _detect(self, rgb):
+        """ROI of the most confident runner from the detector, or None"""
+        cv2 = self._cv2
+        h, w = rgb.shape[:2]
+        size = self._det_size
+        scale = size / max(w, h)
+        rw, rh = max(1, int(round(w * scale))), max(1, int(round(h * scale)))
+        px, py = (size - rw) // 2, (size - rh) // 2
+        square = np.zeros((size, size, 3), dtype=np.float32)
+        square[py:py + rh, px:px + rw] = cv2.resize(rgb, (rw, rh), interpolation=cv2.INTER_AREA)
+        square = square[None] / 127.5 - 1.0
+        outputs = self.detector.run(None, {self._det_input.name: self._to_input(square, self._det_nchw)})
+        boxes = next(o for o in outputs if o.shape[-1] > 1)[0]
+        scores = _sigmoid(next(o for o in outputs if o.shape[-1] == 1)[0, :, 0])
+        keep = scores >= self.min_detection
+        if not keep.any():
+            return None
+        boxes, scores = boxes[keep] / size, scores[keep]
+        anchors = self._anchors[keep]
+        centres = boxes[:, :2] + anchors
+        # Weighted suppression: the top box averaged with the boxes overlapping it
+        lo, hi = centres - boxes[:, 2:4] / 2, centres + boxes[:, 2:4] / 2
+        top = int(np.argmax(scores))
+        inter = np.clip(np.minimum(hi, hi[top]) - np.maximum(lo, lo[top]), 0, None).prod(axis=1)
+        areas = (hi - lo).prod(axis=1)
+        overlap = inter / np.maximum(areas + areas[top] - inter, 1e-9) > 0.3
+        weights = scores[overlap] / scores[overlap].sum()
+        # Keypoint 0 is the hip centre, keypoint 1 a point above the head
+        kps = (boxes[overlap, 4:8].reshape(-1, 2, 2) + anchors[overlap, None]) * weights[:, None, None]
+        kps = kps.sum(axis=0) * size
+        kps = (kps - (px, py)) / scale
+        return self._roi(kps[0], kps[1])
+
+    def _roi(self, centre, top):
+        dx, dy = top[0] - centre[0], top[1] - centre[1]
+        rotation = math.pi / 2 - math.atan2(-dy, dx)
+        rotation -= 2 * math.pi * math.floor((rotation + math.pi) / (2 * math.pi))
+        side = 2 * math.hypot(dx, dy) * self.ROI_SCALE
+        return float(centre[0]), float(centre[1]), side, rotation
+
+    def _affine(self, roi):
+        """Matrix mapping model-input pixels to source pixels"""
+        cx, cy, side, rotation = roi
+        k = side / self._lm_size
+        c, s = math.cos(rotation), math.sin(rotation)
+        return np.array([
+            [k * c, -k * s, cx - side / 2 * (c - s)],
+            [k * s, k * c, cy - side / 2 * (s + c)],
+        ])
+
+    def crop(self, rgb, t_ms: float, track: Track):
+        """Model-input crop of a frame around track's runner, detecting it if lost.
+
+        Returns the frame's entry for resolve and the uint8 crop, or None
+        as the crop when no runner was found.
+        """
+        if track.roi is None:
+            track.roi = self._detect(rgb)
+        h, w = rgb.shape[:2]
+        t = t_ms / 1000 if t_ms is not None else track.t + 1 / 30
+        track.t = t
+        if track.roi is None:
+            return (track, None, None, t, w, h), None
+        affine = self._affine(track.roi)
+        size = self._lm_size
+        crop = self._cv2.warpAffine(
+            rgb, affine, (size, size), flags=self._cv2.INTER_LINEAR | self._cv2.WARP_INVERSE_MAP,
+            borderMode=self._cv2.BORDER_CONSTANT
+        )
+        return (track, track.roi, affine, t, w, h), crop
+
+    def infer(self, crops):
+        """Raw landmarks and pose-presence scores of an (n, size, size, 3) batch of crops scaled to [0, 1]"""
+        outputs = self.landmarker.run(None, {self._lm_input.name: self._to_input(crops, self._lm_nchw)})
+        raw = next(o for o in outputs if o.ndim == 2 and o.shape[1] >= NUM_LANDMARKS * 5)
+        flag = next(o for o in outputs if o.ndim == 2 and o.shape[1] == 1)[:, 0]
+        return raw, flag
+
+    def resolve(self, entry, raw, flag):
+        """Landmarks of one frame from its model outputs, or None; moves its track on"""
+        track, roi, affine, t, w, h = entry
+        if roi is None:
+            return None
+        if flag < self.min_presence:
+            track.lose()
+            return None
+        points = raw.reshape(-1, 5)
+        xy = points[:, :2] @ affine[:, :2].T + affine[:, 2]
+        scale = 1 / roi[2]
+        smooth = track.landmarks(t, xy[:NUM_LANDMARKS], scale)
+        vis = _sigmoid(points[:NUM_LANDMARKS, 3])
+        track.visibility = vis if track.visibility is None else track.visibility + 0.1 * (vis - track.visibility)
+        # The two extra landmarks are the hip centre and body top the next
+        # crop is aligned on
+        if len(points) > NUM_LANDMARKS + 1:
+            centre, top = track.aux(t, xy[NUM_LANDMARKS:NUM_LANDMARKS + 2], scale)
+            track.roi = self._roi(centre, top)
+        return [
+            Landmark(float(x / w), float(y / h), float(z), float(v))
+            for (x, y), z, v in zip(smooth, points[:NUM_LANDMARKS, 2] / self._lm_size, track.visibility)
+        ]
+
+    def submit(self, rgb, t_ms: float = None):
+        if self._n == self.batch_size:
+            self._run()
+        entry, crop = self.crop(rgb, t_ms, self._track)
+        slot = None
+        if crop is not None:
+            slot = self._n
+            np.multiply(crop, 1 / 255, out=self._crops[slot])
+            self._n += 1
+        self._pending.append((entry, slot))
+
+    def _run(self):
+        """Run the landmark model on the cropped frames and resolve them"""
+        if self._n:
+            raw, flag = self.infer(self._crops[:self._n])
+        for entry, slot in self._pending:
+            self._results.append(None if slot is None else self.resolve(entry, raw[slot], flag[slot]))
+        self._pending = []
+        self._n = 0
+
+    def flush(self):
+        self._run()
+        return super().flush()
+
+    def reset(self, width: int, height: int):
+        self._run()
+        self._track.lose()
+
+
+_BACKENDS = {"solution": SolutionEstimator, "tasks": TasksEstimator, "onnx": OnnxEstimator}
+
+
+def model_path(backend: str, lite: bool = False):
+    """Configured landmark model file of the tasks and onnx backends"""
+    path = POSE_LITE_MODEL if lite else POSE_MODEL
+    if not path:
+        raise ValueError(
+            f"SPRINT_POSE_BACKEND={backend} needs SPRINT_POSE_LITE_MODEL for model=cascade" if lite
+            else f"SPRINT_POSE_BACKEND={backend} needs SPRINT_POSE_MODEL"
+        )
+    return path
+
+
+def open_estimator(settings: dict, lite: bool = False, backend: str = None, **options):
+    """Estimator with the configured (or given) backend.
+
+    settings are the solution's Pose options (see pose.POSE_SETTINGS); lite
+    picks the cascade first-pass model of the tasks and onnx backends.
+    options go to the backend (batch_size and threads for onnx). With
+    SPRINT_POSE_MAX_BATCH set and no options, the estimator shares this
+    process's landmark model with other extractions (see ``batching``).
+    """
+    backend = backend or POSE_BACKEND
+    if backend not in _BACKENDS:
+        raise ValueError(f"SPRINT_POSE_BACKEND must be one of: {', '.join(POSE_BACKENDS)}")
+    import batching
+    if batching.MAX_BATCH > 0 and not options:
+        if backend != "onnx":
+            raise ValueError(f"SPRINT_POSE_MAX_BATCH needs SPRINT_POSE_BACKEND=onnx, not {backend}")
+        return batching.shared_batcher(settings, lite).estimator()
+    return _BACKENDS[backend](settings, lite=lite, **options)
+
+
+def model_key():
+    """Backend and model files; part of the single-flight key"""
+    if POSE_BACKEND == "solution":
+        return (POSE_BACKEND,)
+    return (POSE_BACKEND, POSE_MODEL, POSE_LITE_MODEL, POSE_DETECTOR if POSE_BACKEND == "onnx" else "")
+
+
+def config():
+    """Inference settings as reported by /runtime"""
+    return {
+        "backend": POSE_BACKEND,
+        "model": POSE_MODEL or None,
+        "lite_model": POSE_LITE_MODEL or None,
+        "detector": POSE_DETECTOR or None,
+        "batch": POSE_BATCH,
+        "threads": POSE_THREADS,
+    }
@@ -0,0 +1,380 @@
+"""Shared analysis queue for running API and worker nodes separately.
+
+With ``SPRINT_QUEUE_URL`` set, API nodes do not analyse videos themselves:
+they put each analysis in this queue and wait for its result, and worker
+nodes (``python jobqueue.py work``) take jobs out, run them through
+``main.run_analysis`` and store the results. Capacity then grows by adding
+worker nodes, and jobs reach whichever node is free instead of whichever
+one the load balancer picked.
+
+All nodes must share ``SPRINT_DATA_DIR`` (uploads are spooled and results
+stored there) or read the videos from object storage (``/analyze/url``).
+
+A worker holds a lease on its job and renews it with heartbeats while the
+job runs. If a node dies, its lease runs out and the job goes to the next
+worker that asks, up to ``SPRINT_QUEUE_MAX_ATTEMPTS`` attempts. Failures
+that may succeed elsewhere (a crashed or out-of-memory worker process) are
+retried the same way; errors in the video itself are not. Waiting jobs are
+taken shortest estimated job first, with the same ageing as the local
+worker pool. The API node deletes a job once it has read the result; jobs
+nobody collected are deleted ``SPRINT_QUEUE_KEEP_S`` after they finish.
+Videos in object storage travel as their ``s3://`` URL and are presigned
+by the worker that runs them, so a job can wait in the queue longer than a
+presigned URL lives.
+
+The backend is an SQLite database (``sqlite:///path/queue.db``) in its
+default rollback-journal mode; WAL needs memory shared between the
+processes and so works on one host only. Every node locks the database
+file, so the nodes must all run on one host or share a filesystem with
+working POSIX locks (not NFS without lockd, SMB or object-store mounts),
+and all writes go through that one lock, which keeps this to a handful of
+nodes. It is a stand-in for a single host or a small cluster, not a
+replacement for a queue server.
+
+Example:
+    SPRINT_QUEUE_URL=sqlite:////shared/queue.db uvicorn main:app --port 8000
+    SPRINT_QUEUE_URL=sqlite:////shared/queue.db python jobqueue.py work --concurrency 2
+    SPRINT_QUEUE_URL=sqlite:////shared/queue.db python jobqueue.py status
+"""
+import argparse
+import contextlib
+import json
+import os
+import socket
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+
+from store import DATA_DIR
+from workers import SCHED_AGEING
+
+QUEUE_URL = os.environ.get("SPRINT_QUEUE_URL", "")
+LEASE_S = float(os.environ.get("SPRINT_QUEUE_LEASE_S", "60"))
+MAX_ATTEMPTS = int(os.environ.get("SPRINT_QUEUE_MAX_ATTEMPTS", "3"))
+# How long an API node waits for a queued analysis before giving up on it
+WAIT_S = float(os.environ.get("SPRINT_QUEUE_WAIT_S", "3600"))
+# How long a finished job nobody collected stays in the queue
+KEEP_S = float(os.environ.get("SPRINT_QUEUE_KEEP_S", "86400"))
+SPOOL_DIR = os.path.join(DATA_DIR, "spool")
+
+# Errors worth another attempt on a different node, by exception name
+RETRYABLE = ("WorkerCrashed", "MemoryError", "OSError", "TimeoutError")
+FINAL_STATES = ("done", "failed", "cancelled")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    cost REAL NOT NULL,
+    client TEXT,
+    created REAL NOT NULL,
+    started REAL,
+    finished REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    lease_until REAL,
+    result TEXT,
+    error TEXT,
+    error_type TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, lease_until);
+CREATE TABLE IF NOT EXISTS nodes (
+    node_id TEXT PRIMARY KEY,
+    host TEXT,
+    pid INTEGER,
+    started REAL,
+    last_seen REAL,
+    running INTEGER NOT NULL DEFAULT 0,
+    jobs INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+
+class JobQueue:
+    """Analysis jobs in an SQLite database shared by all nodes"""
+
+    def __init__(self, path: str, lease_s: float = LEASE_S, max_attempts: int = MAX_ATTEMPTS, keep_s: float = KEEP_S):
+        self.path = path
+        self.lease_s = lease_s
+        self.max_attempts = max_attempts
+        self.keep_s = keep_s
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._db() as db:
+            # Also switches back queues created in WAL mode
+            db.execute("PRAGMA journal_mode=DELETE")
+            db.executescript(_SCHEMA)
+
+    @contextlib.contextmanager
+    def _db(self, write=False):
+        """A connection; write=True holds the write lock for the whole block"""
+        db = sqlite3.connect(self.path, timeout=30.0, isolation_level=None)
+        db.row_factory = sqlite3.Row
+        try:
+            if write:
+                db.execute("BEGIN IMMEDIATE")
+                try:
+                    yield db
+                except BaseException:
+                    db.execute("ROLLBACK")
+                    raise
+                db.execute("COMMIT")
+            else:
+                yield db
+        finally:
+            db.close()
+
+    def enqueue(self, payload: dict, cost: float = None, client: str = None):
+        """Queue an analysis (run_analysis keyword arguments); returns its job id"""
+        job_id = uuid.uuid4().hex
+        with self._db() as db:
+            db.execute(
+                "INSERT INTO jobs (job_id, status, payload, cost, client, created) VALUES (?, 'queued', ?, ?, ?, ?)",
+                (job_id, json.dumps(payload), float(cost if cost is not None else 0.0), client, time.time()),
+            )
+        return job_id
+
+    def claim(self, worker: str):
+        """Lease the next job to worker: (job_id, payload), or None if there is none.
+
+        Expired leases count as attempts; a job out of attempts fails.
+        Finished jobs older than keep_s are deleted.
+        """
+        now = time.time()
+        with self._db(write=True) as db:
+            db.execute(
+                f"DELETE FROM jobs WHERE status IN ({', '.join('?' * len(FINAL_STATES))}) AND finished < ?",
+                (*FINAL_STATES, now - self.keep_s),
+            )
+            db.execute(
+                "UPDATE jobs SET status = 'failed', finished = ?, worker = NULL, lease_until = NULL, "
+                "error = 'Analysis failed: worker node stopped responding', error_type = 'WorkerCrashed' "
+                "WHERE status = 'running' AND lease_until < ? AND attempts >= ?",
+                (now, now, self.max_attempts),
+            )
+            row = db.execute(
+                "SELECT job_id, payload FROM jobs "
+                "WHERE status = 'queued' OR (status = 'running' AND lease_until < ?) "
+                "ORDER BY cost - ? * (? - created), created LIMIT 1",
+                (now, SCHED_AGEING, now),
+            ).fetchone()
+            if row is None:
+                return None
+            db.execute(
+                "UPDATE jobs SET status = 'running', worker = ?, lease_until = ?, attempts = attempts + 1, "
+                "started = ? WHERE job_id = ?",
+                (worker, now + self.lease_s, now, row["job_id"]),
+            )
+        return row["job_id"], json.loads(row["payload"])
+
+    def heartbeat(self, job_id: str, worker: str):
+        """Extend worker's lease on a job; False if the lease was lost"""
+        with self._db() as db:
+            cur = db.execute(
+                "UPDATE jobs SET lease_until = ? WHERE job_id = ? AND worker = ? AND status = 'running'",
+                (time.time() + self.lease_s, job_id, worker),
+            )
+            return cur.rowcount == 1
+
+    def complete(self, job_id: str, worker: str, result: dict):
+        """Store a job's result if worker still holds its lease"""
+        with self._db() as db:
+            cur = db.execute(
+                "UPDATE jobs SET status = 'done', finished = ?, result = ?, worker = NULL, lease_until = NULL "
+                "WHERE job_id = ? AND worker = ? AND status = 'running'",
+                (time.time(), json.dumps(result), job_id, worker),
+            )
+            return cur.rowcount == 1
+
+    def fail(self, job_id: str, worker: str, error: str, error_type: str):
+        """Record a failed attempt; retryable errors go back in the queue while attempts remain"""
+        retry = error_type in RETRYABLE
+        with self._db() as db:
+            cur = db.execute(
+                "UPDATE jobs SET status = CASE WHEN ? AND attempts < ? THEN 'queued' ELSE 'failed' END, "
+                "finished = CASE WHEN ? AND attempts < ? THEN NULL ELSE ? END, "
+                "error = ?, error_type = ?, worker = NULL, lease_until = NULL "
+                "WHERE job_id = ? AND worker = ? AND status = 'running'",
+                (retry, self.max_attempts, retry, self.max_attempts, time.time(), error, error_type, job_id, worker),
+            )
+            return cur.rowcount == 1
+
+    def cancel(self, job_id: str):
+        """Drop a job that no worker has started"""
+        with self._db() as db:
+            db.execute(
+                "UPDATE jobs SET status = 'cancelled', finished = ? WHERE job_id = ? AND status = 'queued'",
+                (time.time(), job_id),
+            )
+
+    def remove(self, job_id: str):
+        """Delete a finished job whose outcome has been read"""
+        with self._db() as db:
+            db.execute(
+                f"DELETE FROM jobs WHERE job_id = ? AND status IN ({', '.join('?' * len(FINAL_STATES))})",
+                (job_id, *FINAL_STATES),
+            )
+
+    def get(self, job_id: str):
+        """Snapshot of a job, or None if unknown"""
+        with self._db() as db:
+            row = db.execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job["payload"] = json.loads(job["payload"])
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def wait(self, job_id: str, timeout: float = WAIT_S):
+        """Poll until a job reaches a final state; None on timeout"""
+        deadline = time.monotonic() + timeout
+        delay = 0.05
+        while True:
+            job = self.get(job_id)
+            if job is None or job["status"] in FINAL_STATES:
+                return job
+            if time.monotonic() >= deadline:
+                return None
+            time.sleep(delay)
+            delay = min(1.0, delay * 1.5)
+
+    def node_seen(self, node_id: str, running: int, finished: int = 0):
+        """Record a worker node's heartbeat"""
+        now = time.time()
+        with self._db() as db:
+            db.execute(
+                "INSERT INTO nodes (node_id, host, pid, started, last_seen, running, jobs) VALUES (?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (node_id) DO UPDATE SET last_seen = excluded.last_seen, running = excluded.running, "
+                "jobs = jobs + ?",
+                (node_id, socket.gethostname(), os.getpid(), now, now, running, finished, finished),
+            )
+
+    def stats(self):
+        """Job counts by status and the worker nodes seen within a few leases"""
+        now = time.time()
+        with self._db() as db:
+            counts = dict(db.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+            nodes = [
+                dict(row) for row in db.execute(
+                    "SELECT node_id, host, pid, last_seen, running, jobs FROM nodes WHERE last_seen > ? "
+                    "ORDER BY node_id", (now - 3 * self.lease_s,)
+                )
+            ]
+        return {
+            "backend": "sqlite",
+            "path": self.path,
+            "lease_s": self.lease_s,
+            "max_attempts": self.max_attempts,
+            "keep_s": self.keep_s,
+            "jobs": {status: counts.get(status, 0) for status in ("queued", "running") + FINAL_STATES},
+            "nodes": nodes,
+        }
+
+
+def open_queue(url: str = QUEUE_URL):
+    """The queue named by url, or None when distributed mode is off"""
+    if not url:
+        return None
+    if url.startswith("sqlite:///"):
+        return JobQueue(url[len("sqlite:///"):])
+    raise ValueError(f"Unsupported SPRINT_QUEUE_URL '{url}' (expected sqlite:///path)")
+
+
+def spool_dir(queue):
+    """Where API nodes put uploads for the workers; None (system temp) when not distributed"""
+    if queue is None:
+        return None
+    os.makedirs(SPOOL_DIR, exist_ok=True)
+    return SPOOL_DIR
+
+
+class WorkerNode:
+    """Pulls jobs from the queue and runs them, concurrency at a time"""
+
+    def __init__(self, queue: JobQueue, concurrency: int, poll_s: float = 1.0):
+        self.queue = queue
+        self.concurrency = concurrency
+        self.poll_s = poll_s
+        self.node_id = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self._running = {}
+        self._finished = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def _heartbeats(self):
+        """Renew the leases of running jobs and report this node"""
+        while not self._stop.wait(self.queue.lease_s / 3):
+            with self._lock:
+                running = dict(self._running)
+                finished, self._finished = self._finished, 0
+            for job_id, worker in running.items():
+                if not self.queue.heartbeat(job_id, worker):
+                    print(f"lost the lease on job {job_id}", file=sys.stderr, flush=True)
+            self.queue.node_seen(self.node_id, len(running), finished)
+
+    def _run_one(self, slot: int):
+        import main
+
+        worker = f"{self.node_id}/{slot}"
+        while not self._stop.is_set():
+            claimed = self.queue.claim(worker)
+            if claimed is None:
+                self._stop.wait(self.poll_s)
+                continue
+            job_id, payload = claimed
+            with self._lock:
+                self._running[job_id] = worker
+            started = time.perf_counter()
+            try:
+                result = main.run_analysis(**payload)
+            except Exception as e:
+                self.queue.fail(job_id, worker, str(e), type(e).__name__)
+                status = f"failed ({type(e).__name__}: {e})"
+            else:
+                status = "done" if self.queue.complete(job_id, worker, result) else "done, lease lost"
+            with self._lock:
+                del self._running[job_id]
+                self._finished += 1
+            print(f"{job_id} {status} in {time.perf_counter() - started:.1f}s", file=sys.stderr, flush=True)
+
+    def serve(self):
+        """Run until interrupted"""
+        self.queue.node_seen(self.node_id, 0)
+        threads = [threading.Thread(target=self._heartbeats, daemon=True)] + [
+            threading.Thread(target=self._run_one, args=(slot,), daemon=True) for slot in range(self.concurrency)
+        ]
+        for thread in threads:
+            thread.start()
+        try:
+            while any(t.is_alive() for t in threads[1:]):
+                time.sleep(1.0)
+        except KeyboardInterrupt:
+            # Jobs in progress are left to expire and run again elsewhere
+            self._stop.set()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Worker node and status for the shared analysis queue")
+    sub = parser.add_subparsers(dest="command", required=True)
+    work = sub.add_parser("work", help="Take analyses from the queue and run them")
+    work.add_argument("--concurrency", type=int, default=None, help="Jobs at once (default: pose worker processes)")
+    work.add_argument("--poll", type=float, default=1.0, help="Seconds between polls of an empty queue")
+    sub.add_parser("status", help="Print job counts and live worker nodes")
+    args = parser.parse_args(argv)
+
+    queue = open_queue()
+    if queue is None:
+        parser.error("SPRINT_QUEUE_URL is not set")
+    if args.command == "status":
+        print(json.dumps(queue.stats(), indent=2))
+        return
+    from workers import ANALYSIS_PROCESSES
+    concurrency = args.concurrency if args.concurrency is not None else max(1, ANALYSIS_PROCESSES)
+    WorkerNode(queue, concurrency, poll_s=args.poll).serve()
+
+
+if __name__ == "__main__":
+    main()
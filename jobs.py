@@ -0,0 +1,68 @@
+"""Background analysis jobs.
+
+Jobs run on a small thread pool so long analyses do not hold an HTTP
+request open; clients poll ``GET /jobs/{job_id}`` for the result. Finished
+jobs are forgotten ``SPRINT_JOB_TTL_S`` after they end (the analysis itself
+stays in the store).
+"""
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+JOB_WORKERS = int(os.environ.get("SPRINT_JOB_WORKERS", "2"))
+JOB_TTL_S = float(os.environ.get("SPRINT_JOB_TTL_S", "3600"))
+
+
+class JobManager:
+    """Tracks analysis jobs submitted to a thread pool"""
+
+    def __init__(self, max_workers: int = JOB_WORKERS, ttl_s: float = JOB_TTL_S):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self.ttl_s = ttl_s
+
+    def _expire(self):
+        """Drop jobs finished more than ttl_s ago; call with the lock held"""
+        cutoff = time.time() - self.ttl_s
+        for job_id in [k for k, job in self._jobs.items() if job["finished"] is not None and job["finished"] < cutoff]:
+            del self._jobs[job_id]
+
+    def submit(self, fn, *args, **kwargs):
+        """Queue fn(*args, **kwargs) and return its job id"""
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            self._expire()
+            self._jobs[job_id] = {
+                "job_id": job_id,
+                "status": "queued",
+                "created": time.time(),
+                "started": None,
+                "finished": None,
+                "result": None,
+                "error": None,
+            }
+        self._executor.submit(self._run, job_id, fn, args, kwargs)
+        return job_id
+
+    def _run(self, job_id, fn, args, kwargs):
+        self._update(job_id, status="running", started=time.time())
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            self._update(job_id, status="failed", finished=time.time(), error=f"Analysis failed: {e}")
+        else:
+            self._update(job_id, status="done", finished=time.time(), result=result)
+
+    def _update(self, job_id, **fields):
+        with self._lock:
+            self._jobs[job_id].update(fields)
+
+    def get(self, job_id: str):
+        """Snapshot of a job, or None if unknown or expired"""
+        with self._lock:
+            self._expire()
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
@@ -0,0 +1,366 @@
+"""Offline load generator for the SPRINT.AI API.
+
+Renders a mix of synthetic running clips, drives ``/analyze`` at increasing
+concurrency and reports throughput, latency percentiles, error rate and
+peak server RSS for each step. Results are written as JSON (summary) and
+CSV (one row per request) so runs with different worker counts and settings
+can be compared.
+
+Every request uploads a clip made unique by a trailing MP4 ``free`` box,
+which decoders skip: the API coalesces concurrent extractions of identical
+bytes, so repeating the same clip would measure one extraction shared by
+many requests. ``--identical`` sends the clips unchanged to measure that
+coalescing instead.
+
+Targets:
+- in-process (default): the app runs under uvicorn in a thread of this process
+- ``--workers N``: spawns a local ``uvicorn main:app --workers N``
+- ``--url URL``: an already running server (pass ``--server-pid`` for RSS)
+
+Example:
+    python loadtest.py --mix 5s@640x360:3,20s@1280x720:1 --concurrency 1,2,4 --requests 12
+"""
+import argparse
+import csv
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import cv2
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def parse_mix(text: str):
+    """Parse "DURs@WxH[@FPS][:WEIGHT],..." into clip specs"""
+    specs = []
+    for item in text.split(","):
+        item, _, weight = item.strip().partition(":")
+        parts = item.split("@")
+        duration = float(parts[0].rstrip("s"))
+        width, height = (int(v) for v in parts[1].lower().split("x"))
+        fps = float(parts[2].rstrip("fps")) if len(parts) > 2 else 30.0
+        specs.append({
+            "name": item,
+            "duration_s": duration,
+            "width": width,
+            "height": height,
+            "fps": fps,
+            "weight": float(weight or 1),
+        })
+    return specs
+
+
+def draw_runner(width, height, i, fps):
+    """One frame of a stick-figure runner crossing the frame"""
+    frame = np.full((height, width, 3), (90, 140, 60), np.uint8)
+    s = height / 10
+    top = int(height * 0.15)
+    cx = int(width * 0.15 + (i * 90 / fps) % (width * 0.7))
+    phase = i * 2 * np.pi * 2.2 / fps
+    body, skin, shorts = (40, 40, 200), (150, 180, 220), (60, 60, 60)
+    hip = (cx, int(top + s * 4.3))
+    cv2.circle(frame, (cx, int(top + s * 0.6)), int(s * 0.55), skin, -1)
+    cv2.line(frame, (cx, int(top + s * 1.3)), hip, body, int(s * 0.9))
+    for side in (1, -1):
+        kx = int(cx + side * np.sin(phase) * s * 1.2)
+        knee = (kx, int(top + s * 5.8))
+        ankle = (int(kx - s * 0.6), int(top + s * 7.6))
+        cv2.line(frame, hip, knee, shorts, int(s * 0.45))
+        cv2.line(frame, knee, ankle, skin, int(s * 0.35))
+        cv2.line(frame, ankle, (ankle[0] + int(s * 0.5), ankle[1]), (20, 20, 20), int(s * 0.25))
+        elbow = (int(cx - side * np.sin(phase) * s * 0.9), int(top + s * 2.6))
+        cv2.line(frame, (cx, int(top + s * 1.5)), elbow, body, int(s * 0.3))
+        cv2.line(frame, elbow, (elbow[0] + int(s * 0.5), int(top + s * 3.4)), skin, int(s * 0.25))
+    return frame
+
+
+def render_clip(spec: dict, directory: str):
+    """Write a synthetic clip for a spec and return its path"""
+    path = os.path.join(directory, f"{spec['name'].replace('@', '_')}.mp4")
+    if os.path.exists(path):
+        return path
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), spec["fps"], (spec["width"], spec["height"]))
+    for i in range(int(spec["duration_s"] * spec["fps"])):
+        writer.write(draw_runner(spec["width"], spec["height"], i, spec["fps"]))
+    writer.release()
+    return path
+
+
+def unique_payload(content: bytes):
+    """Clip bytes with a random trailing MP4 free box, so no two requests share a content hash"""
+    filler = uuid.uuid4().bytes
+    return content + (8 + len(filler)).to_bytes(4, "big") + b"free" + filler
+
+
+def encode_multipart(fields: dict, filename: str, content: bytes):
+    """Build a multipart/form-data body for /analyze"""
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode()
+        )
+    parts.append(
+        f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+        f"Content-Type: video/mp4\r\n\r\n".encode()
+    )
+    parts.append(content)
+    parts.append(f"\r\n--{boundary}--\r\n".encode())
+    return b"".join(parts), f"multipart/form-data; boundary={boundary}"
+
+
+def post_analyze(base_url: str, clip: dict, distance: str, timeout: float, identical: bool = False):
+    """Send one /analyze request and time it; unique clip bytes unless identical"""
+    content = clip["bytes"] if identical else unique_payload(clip["bytes"])
+    body, content_type = encode_multipart({"distance": distance}, os.path.basename(clip["path"]), content)
+    req = urllib.request.Request(f"{base_url}/analyze", data=body, headers={"Content-Type": content_type})
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as resp:
+            resp.read()
+            status = resp.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    except Exception:
+        status = 0
+    return status, time.perf_counter() - start
+
+
+def process_tree_rss(pid: int):
+    """Resident memory in bytes of pid and its direct children (Linux)"""
+    pids = [pid]
+    try:
+        for tid in os.listdir(f"/proc/{pid}/task"):
+            with open(f"/proc/{pid}/task/{tid}/children") as f:
+                pids += [int(c) for c in f.read().split()]
+    except OSError:
+        pass
+    total = 0
+    for p in pids:
+        try:
+            with open(f"/proc/{p}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1]) * 1024
+        except OSError:
+            continue
+    return total or None
+
+
+class RssSampler:
+    """Samples the server's RSS in the background and keeps the peak"""
+
+    def __init__(self, pid, interval=0.05):
+        self.pid = pid
+        self.interval = interval
+        self.peak = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            rss = process_tree_rss(self.pid) if self.pid else None
+            if rss is not None:
+                self.peak = max(self.peak or 0, rss)
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_healthy(base_url: str, timeout=120.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with urllib.request.urlopen(f"{base_url}/health", timeout=2):
+                return
+        except Exception:
+            time.sleep(0.2)
+    raise RuntimeError(f"Server at {base_url} did not become healthy")
+
+
+def start_in_process():
+    """Serve the app from a background thread of this process"""
+    import uvicorn
+    from main import app
+
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    base_url = f"http://127.0.0.1:{port}"
+    wait_healthy(base_url)
+
+    def stop():
+        server.should_exit = True
+        thread.join()
+
+    return base_url, os.getpid(), stop
+
+
+def start_uvicorn(workers: int):
+    """Spawn a local uvicorn with the given worker count"""
+    port = free_port()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1",
+         "--port", str(port), "--workers", str(workers), "--log-level", "warning"],
+        cwd=HERE,
+        env={**os.environ, "SPRINT_WORKERS": str(workers)},
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    wait_healthy(base_url)
+
+    def stop():
+        proc.terminate()
+        proc.wait()
+
+    return base_url, proc.pid, stop
+
+
+def run_step(base_url, clips, concurrency, requests, distance, timeout, pid, rng, identical=False):
+    """Run one concurrency level and summarise it"""
+    weights = [c["weight"] for c in clips]
+    chosen = rng.choices(clips, weights=weights, k=requests)
+    with RssSampler(pid) as sampler, ThreadPoolExecutor(concurrency) as pool:
+        start = time.perf_counter()
+        outcomes = list(pool.map(lambda c: post_analyze(base_url, c, distance, timeout, identical), chosen))
+        wall = time.perf_counter() - start
+
+    rows = [
+        {"concurrency": concurrency, "clip": c["name"], "status": status, "latency_s": round(latency, 4)}
+        for c, (status, latency) in zip(chosen, outcomes)
+    ]
+    ok = np.array([r["latency_s"] for r in rows if 200 <= r["status"] < 300])
+    errors = sum(1 for r in rows if not 200 <= r["status"] < 300)
+    pct = np.percentile(ok, [50, 95, 99]) if len(ok) else [None] * 3
+    summary = {
+        "concurrency": concurrency,
+        "requests": requests,
+        "wall_s": round(wall, 3),
+        "throughput_rps": round(len(ok) / wall, 4) if wall > 0 else 0.0,
+        "p50_s": round(float(pct[0]), 4) if len(ok) else None,
+        "p95_s": round(float(pct[1]), 4) if len(ok) else None,
+        "p99_s": round(float(pct[2]), 4) if len(ok) else None,
+        "error_rate": round(errors / max(1, requests), 4),
+        "status_counts": {str(s): sum(1 for r in rows if r["status"] == s) for s in sorted({r["status"] for r in rows})},
+        "peak_rss_mb": round(sampler.peak / 2 ** 20, 1) if sampler.peak else None,
+    }
+    return summary, rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load-test the SPRINT.AI /analyze endpoint")
+    parser.add_argument("--mix", default="5s@640x360:3,10s@1280x720:1",
+                        help="Clip mix as DURs@WxH[@FPS][:WEIGHT],...")
+    parser.add_argument("--concurrency", default="1,2,4", help="Comma-separated concurrency ramp")
+    parser.add_argument("--requests", type=int, default=8, help="Requests per concurrency level")
+    parser.add_argument("--distance", default="100m")
+    parser.add_argument("--timeout", type=float, default=600.0, help="Per-request timeout in seconds")
+    parser.add_argument("--url", help="Target an already running server")
+    parser.add_argument("--server-pid", type=int, help="PID of the --url server, for RSS sampling")
+    parser.add_argument("--workers", type=int, help="Spawn a local uvicorn with this many workers")
+    parser.add_argument("--clips-dir", default=os.path.join(tempfile.gettempdir(), "sprint_ai_loadtest"))
+    parser.add_argument("--out", default="loadtest_results", help="Directory for result files")
+    parser.add_argument("--label", default="", help="Free-form label stored with the results")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--identical", action="store_true",
+        help="Upload each clip's bytes unchanged, so concurrent requests share extractions",
+    )
+    args = parser.parse_args(argv)
+
+    specs = parse_mix(args.mix)
+    os.makedirs(args.clips_dir, exist_ok=True)
+    clips = []
+    for spec in specs:
+        path = render_clip(spec, args.clips_dir)
+        with open(path, "rb") as f:
+            clips.append({**spec, "path": path, "bytes": f.read()})
+
+    if args.url:
+        base_url, pid, stop = args.url.rstrip("/"), args.server_pid, lambda: None
+        target = "url"
+    elif args.workers:
+        base_url, pid, stop = start_uvicorn(args.workers)
+        target = "uvicorn"
+    else:
+        base_url, pid, stop = start_in_process()
+        target = "in-process"
+
+    rng = random.Random(args.seed)
+    steps, all_rows = [], []
+    try:
+        try:
+            with urllib.request.urlopen(f"{base_url}/runtime", timeout=10) as resp:
+                runtime = json.loads(resp.read())
+        except Exception:
+            runtime = None
+        for concurrency in (int(c) for c in args.concurrency.split(",")):
+            summary, rows = run_step(base_url, clips, concurrency, args.requests,
+                                     args.distance, args.timeout, pid, rng, identical=args.identical)
+            steps.append(summary)
+            all_rows += rows
+            print(
+                f"c={concurrency:<3} {summary['throughput_rps']:.3f} req/s  "
+                f"p50={summary['p50_s']}s p95={summary['p95_s']}s p99={summary['p99_s']}s  "
+                f"errors={summary['error_rate']:.1%}  peak_rss={summary['peak_rss_mb']}MB",
+                flush=True,
+            )
+    finally:
+        stop()
+
+    stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+    os.makedirs(args.out, exist_ok=True)
+    report = {
+        "label": args.label,
+        "timestamp": datetime.now().isoformat(),
+        "target": target,
+        "url": base_url,
+        "workers": args.workers,
+        "cpu_count": os.cpu_count(),
+        "platform": platform.platform(),
+        "settings": {k: v for k, v in os.environ.items() if k.startswith("SPRINT_")},
+        "runtime": runtime,
+        "mix": specs,
+        "identical_payloads": args.identical,
+        "steps": steps,
+    }
+    json_path = os.path.join(args.out, f"loadtest-{stamp}.json")
+    with open(json_path, "w") as f:
+        json.dump(report, f, indent=2)
+    csv_path = os.path.join(args.out, f"loadtest-{stamp}.csv")
+    with open(csv_path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=["concurrency", "clip", "status", "latency_s"])
+        writer.writeheader()
+        writer.writerows(all_rows)
+    print(f"Results written to {json_path} and {csv_path}")
+    return report
+
+
+if __name__ == "__main__":
+    main()
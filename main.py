@@ -1,14 +1,39 @@
-import math
+import hashlib
 import os
 import tempfile
-from typing import Optional
+import time
+from typing import Callable, Optional
+
+import execution
+
+# Thread budgets must be applied before NumPy and OpenCV start their pools
+execution.configure()
+
 import cv2
-import numpy as np
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException
+from fastapi import FastAPI, UploadFile, File, Form, Header, HTTPException, Request, Response
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-import mediapipe as mp
+from fastapi.responses import FileResponse
 from datetime import datetime
 
+import batching
+import budget
+import decoders
+import inference
+import objects
+from budget import BudgetExceeded
+from compare import compare_runs
+from jobqueue import open_queue, spool_dir
+from jobs import JobManager
+from metrics import DEFAULT_PIXELS_PER_METER, MetricContext, compute_metrics, parse_metric_names, scoring_inputs
+from pose import MODEL_MODES, POSE_SETTINGS, SAMPLING_MODES, STAGES, run_extraction
+from singleflight import SingleFlight
+from splits import MIN_SPLIT_M
+from store import artifact_path, new_analysis_id, save_analysis
+from timeseries import build_lod, cached_lod, query_lod, to_binary, to_json
+from uploads import DEFAULT_CHUNK_SIZE, UploadError, UploadManager, file_sha256
+from workers import ANALYSIS_PROCESSES, TRUSTED_PROXIES, WorkerCrashed, WorkerPool
+
 app = FastAPI(title="SPRINT.AI Biomechanics API")
 
 # CORS configuration - allows frontend to connect
@@ -20,302 +45,301 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-mp_pose = mp.solutions.pose
-POSE_LMK = mp_pose.PoseLandmark
-
-def angle_3pt(a, b, c):
-    """Calculate angle at point b formed by points a-b-c"""
-    ax, ay = a
-    bx, by = b
-    cx, cy = c
-    v1 = np.array([ax - bx, ay - by])
-    v2 = np.array([cx - bx, cy - by])
-    denom = (np.linalg.norm(v1) * np.linalg.norm(v2)) + 1e-9
-    cosang = np.clip(np.dot(v1, v2) / denom, -1.0, 1.0)
-    return float(np.degrees(np.arccos(cosang)))
-
-def smooth(x, k=5):
-    """Smooth time series data"""
-    if len(x) < 3:
-        return np.array(x, dtype=float)
-    k = max(1, int(k))
-    kernel = np.ones(k) / k
-    return np.convolve(x, kernel, mode="same")
-
-def local_minima(y, w=3):
-    """Find local minima in signal (for contact detection)"""
-    mins = []
-    n = len(y)
-    for i in range(w, n - w):
-        window = y[i - w:i + w + 1]
-        if y[i] == min(window):
-            mins.append(i)
-    return mins
-
-def derive_series(x, fps):
-    """Calculate velocity from position"""
-    v = np.diff(x) * fps
-    return np.concatenate([[0.0], v])
-
-def mid(p1, p2):
-    """Calculate midpoint"""
-    return ((p1[0] + p2[0]) * 0.5, (p1[1] + p2[1]) * 0.5)
-
-def extract_pose_series(video_path: str):
-    """Extract pose landmarks from video using MediaPipe"""
-    cap = cv2.VideoCapture(video_path)
-    if not cap.isOpened():
-        raise RuntimeError("Cannot open video file")
-
-    fps = cap.get(cv2.CAP_PROP_FPS)
-    width = cap.get(cv2.CAP_PROP_FRAME_WIDTH)
-    height = cap.get(cv2.CAP_PROP_FRAME_HEIGHT)
-
-    hips_x, hips_y = [], []
-    la_y, ra_y = [], []
-    lknee_pts, rknee_pts = [], []
-    lankle_pts, rankle_pts = [], []
-    ltoe_pts, rtoe_pts = [], []
-    lhip_pts, rhip_pts = [], []
-    lsh_pts, rsh_pts = [], []
-
-    with mp_pose.Pose(
-        static_image_mode=False,
-        model_complexity=2,
-        enable_segmentation=False,
-        min_detection_confidence=0.5,
-        min_tracking_confidence=0.5
-    ) as pose:
-        frame_count = 0
-        while True:
-            ret, frame = cap.read()
-            if not ret:
-                break
-
-            rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            res = pose.process(rgb)
-
-            if res.pose_landmarks:
-                lm = res.pose_landmarks.landmark
-
-                def xy(idx):
-                    return (lm[idx].x * width, lm[idx].y * height)
-
-                lhip = xy(POSE_LMK.LEFT_HIP.value)
-                rhip = xy(POSE_LMK.RIGHT_HIP.value)
-                hipm = mid(lhip, rhip)
-                hips_x.append(hipm[0])
-                hips_y.append(hipm[1])
-
-                lankle = xy(POSE_LMK.LEFT_ANKLE.value)
-                rankle = xy(POSE_LMK.RIGHT_ANKLE.value)
-                la_y.append(lankle[1])
-                ra_y.append(rankle[1])
-
-                lknee = xy(POSE_LMK.LEFT_KNEE.value)
-                rknee = xy(POSE_LMK.RIGHT_KNEE.value)
-                lknee_pts.append(lknee)
-                rknee_pts.append(rknee)
-
-                ltoe = xy(POSE_LMK.LEFT_FOOT_INDEX.value)
-                rtoe = xy(POSE_LMK.RIGHT_FOOT_INDEX.value)
-                ltoe_pts.append(ltoe)
-                rtoe_pts.append(rtoe)
-
-                lankle_pts.append(lankle)
-                rankle_pts.append(rankle)
-                lhip_pts.append(lhip)
-                rhip_pts.append(rhip)
-
-                lsh = xy(POSE_LMK.LEFT_SHOULDER.value)
-                rsh = xy(POSE_LMK.RIGHT_SHOULDER.value)
-                lsh_pts.append(lsh)
-                rsh_pts.append(rsh)
-
-            frame_count += 1
-
-    cap.release()
+jobs = JobManager()
+uploads = UploadManager()
+extractions = SingleFlight()
+# Shared queue to worker nodes (SPRINT_QUEUE_URL); None analyses here
+job_queue = open_queue()
+# Batchers are per process, so with pose worker processes every extraction
+# would batch alone
+if batching.MAX_BATCH > 0 and ANALYSIS_PROCESSES > 0:
+    raise ValueError(
+        "SPRINT_POSE_MAX_BATCH batches extractions within one process; set SPRINT_ANALYSIS_PROCESSES=0 to use it"
+    )
+if batching.MAX_BATCH > 0 and inference.POSE_BACKEND != "onnx":
+    raise ValueError(f"SPRINT_POSE_MAX_BATCH needs SPRINT_POSE_BACKEND=onnx, not {inference.POSE_BACKEND}")
+# Pose extraction runs in supervised processes that share this worker's
+# OpenCV thread budget
+pose_workers = WorkerPool(
+    initializer=cv2.setNumThreads,
+    initargs=(max(1, execution.current_config()["opencv_threads"] // max(1, ANALYSIS_PROCESSES)),),
+    preload=("pose",)
+)
+# Container headers are read in a worker process as well: FFmpeg's probing
+# demuxes and decodes, and a malformed upload must not crash or hang the API
+probe_workers = WorkerPool(processes=min(1, ANALYSIS_PROCESSES), preload=("pose",))
+
+def read_header(video_path: str):
+    """budget.probe in a probe worker, killed after budget.PROBE_TIMEOUT_S; raises WorkerCrashed"""
+    return probe_workers.run(budget.probe, video_path, timeout=budget.PROBE_TIMEOUT_S)
+
+def run_analysis(
+    video_path: str,
+    distance: str,
+    pixels_per_meter: float,
+    follow: Optional[Callable[[], bool]] = None,
+    content_hash: Optional[str] = None,
+    metrics: Optional[list] = None,
+    split_m: Optional[float] = None,
+    overlay: Optional[dict] = None,
+    sampling: str = "full",
+    start_s: Optional[float] = None,
+    end_s: Optional[float] = None,
+    model: str = "heavy",
+    source: Optional[dict] = None,
+    client: Optional[str] = None
+):
+    """Run the full pipeline on a video file and store the result
+
+    video_path may also be an http(s) URL, which is decoded as it streams,
+    or an s3:// URL, presigned here just before it is read. source
+    describes where the video came from and is stored with the result.
 
-    return {
-        "fps": fps,
-        "frames": len(hips_x),
-        "width": width,
-        "height": height,
-        "hips_x": np.array(hips_x, dtype=float),
-        "hips_y": np.array(hips_y, dtype=float),
-        "la_y": np.array(la_y, dtype=float),
-        "ra_y": np.array(ra_y, dtype=float),
-        "lknee": np.array(lknee_pts, dtype=float),
-        "rknee": np.array(rknee_pts, dtype=float),
-        "lankle": np.array(lankle_pts, dtype=float),
-        "rankle": np.array(rankle_pts, dtype=float),
-        "ltoe": np.array(ltoe_pts, dtype=float),
-        "rtoe": np.array(rtoe_pts, dtype=float),
-        "lhip": np.array(lhip_pts, dtype=float),
-        "rhip": np.array(rhip_pts, dtype=float),
-        "lsh": np.array(lsh_pts, dtype=float),
-        "rsh": np.array(rsh_pts, dtype=float),
-    }
+    While all pose workers are busy, the extraction waits its turn by the
+    budget's time estimate (shortest first) and client's fair share.
+
+    With a content_hash, concurrent runs on identical bytes share one pose
+    extraction; metrics are still computed per request.
+
+    overlay ({"width": ..., "fps": ...}) also renders a skeleton-overlay
+    video during the pose pass and stores it with the analysis.
+
+    sampling="adaptive" infers densely only around predicted contacts.
 
-def compute_metrics(series: dict, distance_label: str, pixels_per_meter: float):
-    """Compute biomechanics metrics from pose series"""
-    fps = series["fps"]
-    n = series["frames"]
-    time_taken = n / max(fps, 1e-6)
-
-    # Hip horizontal displacement for speed
-    hx = smooth(series["hips_x"])
-    vx_pixels = derive_series(hx, fps)
-    vx_mps = np.abs(vx_pixels) / pixels_per_meter
-
-    max_speed = float(np.max(vx_mps))
-
-    # Reaction time (first significant movement)
-    thr = 0.5  # m/s threshold
-    rt_idx = int(np.argmax(vx_mps > thr)) if np.any(vx_mps > thr) else 0
-    reaction_time = rt_idx / max(fps, 1e-6)
-
-    # Acceleration phase (0-30m if available)
-    disp_m = (hx - hx[0]) / pixels_per_meter
-    idx_30 = np.where(disp_m >= 30.0)[0]
-    if len(idx_30) > 0:
-        t_30 = idx_30[0] / max(fps, 1e-6)
-        accel_0_30 = 30.0 / t_30 if t_30 > 0 else 0.0
-    else:
-        accel_0_30 = None
-
-    # Step detection from ankle minima
-    la = smooth(series["la_y"])
-    ra = smooth(series["ra_y"])
-    l_contacts = local_minima(la, w=3)
-    r_contacts = local_minima(ra, w=3)
-    contacts = sorted(l_contacts + r_contacts)
-
-    steps = max(0, len(contacts) - 1)
-    cadence_sps = steps / time_taken if time_taken > 0 else 0.0
-    cadence_spm = cadence_sps * 60.0
-
-    # Stride length from consecutive toe positions
-    def stride_lengths(toe):
-        idxs = local_minima(smooth(toe[:,1]), w=3)
-        sl = []
-        for i in range(1, len(idxs)):
-            i0, i1 = idxs[i-1], idxs[i]
-            dx = abs(toe[i1,0] - toe[i0,0])
-            sl.append(dx / pixels_per_meter)
-        return sl
-
-    sl_left = stride_lengths(series["ltoe"])
-    sl_right = stride_lengths(series["rtoe"])
-    all_sl = sl_left + sl_right
-    stride_length = float(np.mean(all_sl)) if len(all_sl) > 0 else None
-
-    # Ground contact and flight times
-    gct_ms = None
-    flight_ms = None
-    if len(contacts) >= 2:
-        window = 2
-        contact_frames = 0
-        for ci in contacts:
-            start = max(0, ci - window)
-            end = min(n - 1, ci + window)
-            contact_frames += (end - start + 1)
-        mean_contact = contact_frames / max(1, len(contacts))
-        step_frames = n / max(1, steps) if steps > 0 else 0
-        mean_flight = step_frames - mean_contact if step_frames > 0 else 0
-        gct_ms = (mean_contact / max(fps, 1e-6)) * 1000.0
-        flight_ms = (mean_flight / max(fps, 1e-6)) * 1000.0
-
-    # Knee drive angle
-    def knee_drive(lhip, lknee, lankle):
-        angs = []
-        for i in range(len(lhip)):
-            angs.append(angle_3pt(lhip[i], lknee[i], lankle[i]))
-        return float(np.nanmin(angs)) if len(angs) else None
-
-    kd_left = knee_drive(series["lhip"], series["lknee"], series["lankle"])
-    kd_right = knee_drive(series["rhip"], series["rknee"], series["rankle"])
-    knee_drive_angle = float(np.nanmin([kd_left, kd_right])) if kd_left and kd_right else None
-
-    # Torso lean
-    torso_lean_deg = None
-    if n > 5:
-        mid_i = n // 2
-        sh_mid = mid(series["lsh"][mid_i], series["rsh"][mid_i])
-        hp_mid = mid(series["lhip"][mid_i], series["rhip"][mid_i])
-        vx, vy = (sh_mid[0] - hp_mid[0], sh_mid[1] - hp_mid[1])
-        dot = vy * (-1)
-        mag = math.sqrt(vx*vx + vy*vy)
-        cosang = np.clip(dot / (mag + 1e-9), -1.0, 1.0)
-        torso_lean_deg = float(np.degrees(np.arccos(cosang)))
-
-    # Fatigue index
-    q = max(1, int(0.2 * n))
-    s1 = np.mean(vx_mps[:q])
-    s2 = np.mean(vx_mps[-q:])
-    drop_speed = ((s1 - s2) / s1) * 100.0 if s1 > 1e-6 else 0.0
-    fatigue_index = max(0.0, drop_speed)
-
-    # Form score calculation
-    score = 100.0
-    nominal_stride = {"100m": 2.3, "400m": 2.1, "1km": 1.9, "5km": 1.75}.get(distance_label, 2.0)
-    if stride_length:
-        score -= min(15.0, abs(stride_length - nominal_stride) / nominal_stride * 15.0)
-    if torso_lean_deg:
-        score -= min(10.0, max(0.0, torso_lean_deg - 10.0) * 0.5)
-    if gct_ms:
-        nominal_gct = {"100m": 110, "400m": 125, "1km": 140, "5km": 160}.get(distance_label, 130)
-        score -= min(15.0, abs(gct_ms - nominal_gct) / nominal_gct * 15.0)
-    score -= min(20.0, fatigue_index * 0.2)
-    form_score = max(0, min(100, score))
-
-    # Generate feedback
-    feedback = []
-    if stride_length:
-        if abs(stride_length - nominal_stride) < 0.1:
-            feedback.append("Excellent stride length consistency")
+    start_s / end_s analyse only that window of the video; decoding seeks
+    to its start and stops at its end.
+
+    model="cascade" runs a lighter pose model on every frame and the heavy
+    one only where the metrics need its precision.
+
+    Settings are first checked against the memory and time budget (see
+    budget.plan), which may downgrade them or raise BudgetExceeded; the
+    header is read in a probe worker process (read_header). A file
+    still being uploaded has no reliable header yet and is not checked.
+    """
+    video_path = readable(video_path)
+    planned = budget.plan_info(
+        read_header(video_path) if follow is None else None,
+        sampling=sampling, overlay=overlay, start_s=start_s, end_s=end_s, model=model
+    )
+    sampling, overlay, infer_width = planned["sampling"], planned["overlay"], planned["infer_width"]
+
+    overlay_path = None
+    if overlay is not None:
+        fd, overlay_path = tempfile.mkstemp(suffix=".mp4")
+        os.close(fd)
+        overlay = {**overlay, "path": overlay_path}
+
+    usage = {}
+    schedule = {
+        "cost": planned["estimate"]["extract_s"] if planned["estimate"] is not None else None,
+        "client": client,
+    }
+    started = time.perf_counter()
+    try:
+        # Rendering is a side output of this pass, so it is never coalesced
+        if content_hash is not None and overlay is None:
+            key = (
+                content_hash, tuple(sorted(POSE_SETTINGS.items())), inference.model_key(), sampling, start_s,
+                end_s, infer_width, model
+            )
+            series, overlay_stats = extractions.do(
+                key, pose_workers.run, run_extraction, video_path,
+                sampling=sampling, start_s=start_s, end_s=end_s, infer_width=infer_width, model=model, usage=usage,
+                **schedule
+            )
         else:
-            diff = stride_length - nominal_stride
-            feedback.append(f"Stride length {'over' if diff > 0 else 'under'} optimal by {abs(diff):.2f}m")
-
-    if torso_lean_deg and torso_lean_deg < 15:
-        feedback.append("Good upright posture maintained")
-    elif torso_lean_deg and torso_lean_deg > 20:
-        feedback.append("Excessive forward lean detected - work on posture")
-
-    if fatigue_index < 5:
-        feedback.append("Strong endurance with minimal speed drop")
-    elif fatigue_index > 15:
-        feedback.append("Significant fatigue in final phase - improve conditioning")
-
-    if cadence_sps > 4.5:
-        feedback.append("High cadence showing good leg turnover")
-
-    # Generate drills
-    drills_map = {
-        "100m": ["A-skips: 3x20m for knee drive", "Bounding: 4x30m for power", "Core planks: 3x45s"],
-        "400m": ["Tempo runs: 3x300m", "Speed endurance: 4x200m", "Core circuit: 15min"],
-        "1km": ["Interval training: 6x400m", "Tempo run: 2km", "Hill repeats: 8x200m"],
-        "5km": ["Long intervals: 5x1km", "Tempo runs: 4km", "Easy distance: 12km"]
+            series, overlay_stats = pose_workers.run(
+                run_extraction, video_path, overlay=overlay, sampling=sampling,
+                start_s=start_s, end_s=end_s, infer_width=infer_width, model=model,
+                callbacks={"follow": follow}, usage=usage, **schedule
+            )
+    except BaseException:
+        if overlay_path is not None:
+            os.unlink(overlay_path)
+        raise
+    # Time spent waiting for a worker is not extraction cost
+    extract_s = time.perf_counter() - started - usage.get("queue_s", 0.0)
+    # Only the run that did the extraction measured it
+    if usage:
+        budget.record(
+            planned, usage, extract_s, stages={k: series[k] for k in STAGES if k in series},
+            refined_share=series["refined_frames"] / max(1, series["frames"]) if "refined_frames" in series else None
+        )
+
+    ctx = MetricContext(series, distance, pixels_per_meter, split_m=split_m)
+    values = compute_metrics(series, distance, pixels_per_meter, metrics=metrics, context=ctx)
+
+    analysis_id = new_analysis_id()
+    result = {
+        "success": True,
+        "analysis_id": analysis_id,
+        "distance": distance,
+        "timestamp": datetime.now().isoformat(),
+        "metrics": values
     }
-    drills = drills_map.get(distance_label, drills_map["100m"])
+    if source is not None:
+        result["source"] = source
+    artifacts = {}
+    if overlay_path is not None:
+        artifacts["overlay.mp4"] = overlay_path
+        result["overlay"] = {
+            "url": f"/analyses/{analysis_id}/overlay",
+            **overlay_stats,
+            "extract_s": round(extract_s, 3),
+            # The encoder thread competes for the same cores as the pass,
+            # so its time counts towards the overhead along with the
+            # loop's own queueing
+            "overhead_pct": round(
+                (overlay_stats["submit_s"] + overlay_stats["encode_s"]) / max(extract_s, 1e-9) * 100.0, 2
+            ),
+            "loop_overhead_pct": round(overlay_stats["submit_s"] / max(extract_s, 1e-9) * 100.0, 2)
+        }
+    if start_s is not None or end_s is not None:
+        result["window"] = {"start_s": start_s or 0.0, "end_s": end_s}
+    if sampling == "adaptive":
+        result["sampling"] = {
+            "mode": sampling,
+            "inferred_frames": int(series["inferred_frames"]),
+            "decoded_frames": int(series["decoded_frames"]),
+            "inferred_pct": round(100.0 * series["inferred_frames"] / max(1, series["decoded_frames"]), 1),
+        }
+    if model == "cascade":
+        result["model"] = {
+            "mode": model,
+            "refined_frames": int(series["refined_frames"]),
+            "refined_pct": round(100.0 * series["refined_frames"] / max(1, series["frames"]), 1),
+        }
+    if planned["estimate"] is not None or usage:
+        result["resources"] = {
+            "estimate": planned["estimate"],
+            "peak_rss_mb": usage.get("peak_rss_mb"),
+            "queue_s": usage.get("queue_s"),
+            "extract_s": round(extract_s, 3),
+            "downgraded": planned["downgraded"],
+        }
+    save_analysis(
+        analysis_id, result, series=series,
+        lod=build_lod(ctx.get("series"), pixels_per_meter, ctx.get("signals")),
+        artifacts=artifacts,
+        inputs=scoring_inputs(ctx)
+    )
+    return result
+
+# Exceptions re-raised on the API node for errors on a worker node, by name
+REMOTE_ERRORS = {
+    "BudgetExceeded": BudgetExceeded, "WorkerCrashed": WorkerCrashed, "MemoryError": MemoryError,
+    "ValueError": ValueError,
+}
+
+def readable(video_path: str):
+    """A path or URL the decoder can open: s3:// URLs are presigned"""
+    return objects.resolve(video_path) if video_path.startswith("s3://") else video_path
+
+def dispatch_analysis(
+    video_path: str,
+    distance: str,
+    pixels_per_meter: float,
+    follow: Optional[Callable[[], bool]] = None,
+    **options
+):
+    """run_analysis here, or on a worker node when a shared queue is configured
 
-    return {
-        "time_taken_s": round(time_taken, 2),
-        "max_speed_mps": round(max_speed, 2),
-        "acceleration_0_30": round(accel_0_30, 2) if accel_0_30 else None,
-        "stride_length_m": round(stride_length, 2) if stride_length else None,
-        "cadence_sps": round(cadence_sps, 2),
-        "cadence_spm": round(cadence_spm, 1),
-        "ground_contact_ms": round(gct_ms, 1) if gct_ms else None,
-        "flight_time_ms": round(flight_ms, 1) if flight_ms else None,
-        "knee_drive_angle": round(knee_drive_angle, 1) if knee_drive_angle else None,
-        "torso_lean_deg": round(torso_lean_deg, 1) if torso_lean_deg else None,
-        "fatigue_index": round(fatigue_index, 1),
-        "form_score": round(form_score, 1),
-        "feedback": feedback,
-        "drills": drills
-    }
+    Queued jobs carry the budget's time estimate so worker nodes take short
+    ones first, and s3:// URLs as they are, for the worker node to presign.
+    A still-growing upload (follow) is always analysed here.
+    """
+    if job_queue is None or follow is not None:
+        return run_analysis(video_path, distance, pixels_per_meter, follow=follow, **options)
+
+    planned = budget.plan_info(
+        read_header(readable(video_path)), sampling=options.get("sampling", "full"), overlay=options.get("overlay"),
+        start_s=options.get("start_s"), end_s=options.get("end_s"), policy="off",
+        model=options.get("model", "heavy")
+    )
+    job_id = job_queue.enqueue(
+        {"video_path": video_path, "distance": distance, "pixels_per_meter": pixels_per_meter, **options},
+        cost=planned["estimate"]["extract_s"] if planned["estimate"] is not None else None,
+        client=options.get("client"),
+    )
+    job = job_queue.wait(job_id)
+    if job is None:
+        job_queue.cancel(job_id)
+        raise TimeoutError("No worker node finished the analysis in time")
+    job_queue.remove(job_id)
+    if job["status"] == "done":
+        return job["result"]
+    raise REMOTE_ERRORS.get(job["error_type"], RuntimeError)(job["error"] or f"Analysis {job['status']}")
+
+def overlay_options(render: bool, width: Optional[int], fps: Optional[float]):
+    """Validate overlay form fields into run_analysis options"""
+    if not render:
+        return None
+    if width is not None and not 16 <= width <= 3840:
+        raise ValueError("overlay_width must be between 16 and 3840")
+    if fps is not None and fps <= 0:
+        raise ValueError("overlay_fps must be positive")
+    return {"width": width, "fps": fps}
+
+def sampling_option(sampling: str, overlay: Optional[dict]):
+    """Validate the sampling form field"""
+    if sampling not in SAMPLING_MODES:
+        raise ValueError(f"sampling must be one of: {', '.join(SAMPLING_MODES)}")
+    if sampling != "full" and overlay is not None:
+        raise ValueError("render_overlay requires sampling=full")
+    return sampling
+
+def model_option(model: str, sampling: str, overlay: Optional[dict]):
+    """Validate the model form field"""
+    if model not in MODEL_MODES:
+        raise ValueError(f"model must be one of: {', '.join(MODEL_MODES)}")
+    if model == "cascade" and (sampling != "full" or overlay is not None):
+        raise ValueError("model=cascade requires sampling=full and no render_overlay")
+    return model
+
+def window_options(start_s: Optional[float], end_s: Optional[float]):
+    """Validate the start_s / end_s form fields"""
+    if start_s is not None and start_s < 0:
+        raise ValueError("start_s must not be negative")
+    if end_s is not None and end_s <= (start_s or 0.0):
+        raise ValueError("end_s must be after start_s")
+    return {"start_s": start_s, "end_s": end_s}
+
+def split_option(split_m: Optional[float]):
+    """Validate the split_m form field"""
+    if split_m is not None and not split_m >= MIN_SPLIT_M:
+        raise ValueError(f"split_m must be at least {MIN_SPLIT_M:g} m")
+    return split_m
+
+def client_id(request: Optional[Request], header: Optional[str]):
+    """Identity a request is fair-shared under: its peer address, or X-Client-Id from a trusted proxy"""
+    peer = request.client.host if request is not None and request.client else None
+    if header and peer in TRUSTED_PROXIES:
+        return header
+    return peer
+
+def run_upload_analysis(upload_id: str, follow: Optional[Callable[[], bool]] = None):
+    """Analysis job for a resumable upload"""
+    upload = uploads.get(upload_id)
+    try:
+        result = dispatch_analysis(
+            upload.data_path,
+            upload.meta["distance"],
+            upload.meta["pixels_per_meter"],
+            follow=follow,
+            # A still-growing file cannot be hashed up front
+            content_hash=file_sha256(upload.data_path) if follow is None else None,
+            **upload.meta.get("options", {})
+        )
+    except Exception:
+        # Keep an unfinished upload so the client can resume and finalize
+        if upload.finalized:
+            uploads.discard(upload_id)
+        else:
+            uploads.set_job(upload_id, None)
+        raise
+    uploads.discard(upload_id)
+    return result
 
 @app.get("/")
 async def root():
@@ -327,9 +351,20 @@ async def root():
 
 @app.post("/analyze")
 async def analyze_video(
+    request: Request,
     file: UploadFile = File(...),
     distance: str = Form(...),
-    pixels_per_meter: Optional[float] = Form(100.0)
+    pixels_per_meter: Optional[float] = Form(DEFAULT_PIXELS_PER_METER),
+    metrics: Optional[str] = Form(None),
+    split_m: Optional[float] = Form(None),
+    render_overlay: bool = Form(False),
+    overlay_width: Optional[int] = Form(None),
+    overlay_fps: Optional[float] = Form(None),
+    sampling: str = Form("full"),
+    start_s: Optional[float] = Form(None),
+    end_s: Optional[float] = Form(None),
+    model: str = Form("heavy"),
+    x_client_id: Optional[str] = Header(None)
 ):
     """
     Analyze running video and return biomechanics metrics
@@ -338,31 +373,74 @@ async def analyze_video(
     - file: Video file (mp4, mov, avi)
     - distance: Running distance (100m, 400m, 1km, 5km)
     - pixels_per_meter: Calibration value (default: 100 pixels = 1 meter)
+    - metrics: Comma-separated metric names to compute (default: all)
+    - split_m: Segment length in meters for per-split metrics, at least 1
+      (default depends on distance)
+    - render_overlay: Also render a skeleton-overlay video, downloadable from
+      /analyses/{analysis_id}/overlay
+    - overlay_width / overlay_fps: Overlay output size and frame rate
+      (default: source)
+    - sampling: "full" (every frame) or "adaptive" (sparse between contacts,
+      dense around them; for high frame rate footage)
+    - start_s / end_s: Analyse only this window of the video, in seconds
+      (default: whole video)
+    - model: "heavy" (heavy pose model on every frame) or "cascade" (lighter
+      model everywhere, heavy model re-run around contacts, knee-drive peaks
+      and poorly visible frames)
+    - X-Client-Id header: Caller identity for fair sharing of pose workers,
+      honoured only from SPRINT_TRUSTED_PROXIES (default: client address)
     """
     try:
-        # Save uploaded file temporarily
+        metric_names = parse_metric_names(metrics)
+        overlay = overlay_options(render_overlay, overlay_width, overlay_fps)
+        sampling = sampling_option(sampling, overlay)
+        model = model_option(model, sampling, overlay)
+        window = window_options(start_s, end_s)
+        split_m = split_option(split_m)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    try:
+        # Save uploaded file temporarily, hashing it on the way instead of
+        # holding the whole video in memory
         suffix = os.path.splitext(file.filename)[-1]
-        with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp:
-            content = await file.read()
-            tmp.write(content)
+        digest = hashlib.sha256()
+        with tempfile.NamedTemporaryFile(delete=False, suffix=suffix, dir=spool_dir(job_queue)) as tmp:
             temp_path = tmp.name
-
-        # Extract pose data
-        series = extract_pose_series(temp_path)
-
-        # Compute metrics
-        metrics = compute_metrics(series, distance, pixels_per_meter)
+            while chunk := await file.read(DEFAULT_CHUNK_SIZE):
+                digest.update(chunk)
+                tmp.write(chunk)
+
+        # Extract pose data and compute metrics, off the event loop so
+        # retries of the same clip can attach to the running extraction
+        result = await run_in_threadpool(
+            dispatch_analysis, temp_path, distance, pixels_per_meter,
+            content_hash=digest.hexdigest(),
+            metrics=metric_names,
+            split_m=split_m,
+            overlay=overlay,
+            sampling=sampling,
+            model=model,
+            client=client_id(request, x_client_id),
+            **window
+        )
 
         # Clean up
         os.unlink(temp_path)
 
-        return {
-            "success": True,
-            "distance": distance,
-            "timestamp": datetime.now().isoformat(),
-            "metrics": metrics
-        }
+        return result
 
+    except BudgetExceeded as e:
+        os.unlink(temp_path)
+        raise HTTPException(status_code=413, detail=str(e))
+    except WorkerCrashed as e:
+        os.unlink(temp_path)
+        raise HTTPException(status_code=422, detail=f"Analysis failed: {str(e)}")
+    except MemoryError:
+        os.unlink(temp_path)
+        raise HTTPException(
+            status_code=507, detail="Analysis ran out of memory; try sampling=adaptive or a shorter start_s/end_s window"
+        )
     except Exception as e:
         if 'temp_path' in locals():
             try:
@@ -371,6 +449,338 @@ async def analyze_video(
                 pass
         raise HTTPException(status_code=500, detail=f"Analysis failed: {str(e)}")
 
+@app.post("/analyze/url")
+async def analyze_object(
+    request: Request,
+    url: str = Form(...),
+    distance: str = Form(...),
+    pixels_per_meter: Optional[float] = Form(DEFAULT_PIXELS_PER_METER),
+    metrics: Optional[str] = Form(None),
+    split_m: Optional[float] = Form(None),
+    render_overlay: bool = Form(False),
+    overlay_width: Optional[int] = Form(None),
+    overlay_fps: Optional[float] = Form(None),
+    sampling: str = Form("full"),
+    start_s: Optional[float] = Form(None),
+    end_s: Optional[float] = Form(None),
+    model: str = Form("heavy"),
+    x_client_id: Optional[str] = Header(None)
+):
+    """
+    Analyze a video that is already in object storage
+
+    The object is streamed into the decoder with ranged reads instead of
+    being downloaded and re-uploaded; nothing is staged on local disk.
+
+    Parameters:
+    - url: s3://bucket/key (signed with the configured S3 credentials), or
+      an http(s) URL on the object store, e.g. a presigned one
+    - All other fields, and X-Client-Id, as for /analyze
+    """
+    try:
+        metric_names = parse_metric_names(metrics)
+        overlay = overlay_options(render_overlay, overlay_width, overlay_fps)
+        sampling = sampling_option(sampling, overlay)
+        model = model_option(model, sampling, overlay)
+        window = window_options(start_s, end_s)
+        split_m = split_option(split_m)
+        # Checked here; s3:// URLs are presigned where they are read
+        objects.resolve(url)
+        info = await run_in_threadpool(objects.stat, url)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except OSError as e:
+        raise HTTPException(status_code=502, detail=f"Object store unreachable: {str(e)}")
+
+    try:
+        return await run_in_threadpool(
+            dispatch_analysis, url, distance, pixels_per_meter,
+            content_hash=objects.content_key(url, info),
+            metrics=metric_names,
+            split_m=split_m,
+            overlay=overlay,
+            sampling=sampling,
+            model=model,
+            source={"url": objects.display_url(url), "size_bytes": info["size"], "etag": info["etag"]},
+            client=client_id(request, x_client_id),
+            **window
+        )
+    except BudgetExceeded as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except WorkerCrashed as e:
+        raise HTTPException(status_code=422, detail=f"Analysis failed: {str(e)}")
+    except MemoryError:
+        raise HTTPException(
+            status_code=507, detail="Analysis ran out of memory; try sampling=adaptive or a shorter start_s/end_s window"
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Analysis failed: {str(e)}")
+
+def probe_metadata(
+    width: Optional[int], height: Optional[int], fps: Optional[float],
+    frame_count: Optional[int], duration_s: Optional[float], codec: Optional[str]
+):
+    """Container properties from /probe form fields, in budget.probe's shape"""
+    if not width or not height or width <= 0 or height <= 0:
+        raise ValueError("width and height must be positive")
+    if not fps or fps <= 0:
+        raise ValueError("fps must be positive")
+    if frame_count is None and duration_s is not None:
+        frame_count = int(round(duration_s * fps))
+    if frame_count is None or frame_count < 0:
+        raise ValueError("Give frame_count or duration_s")
+    return {"width": width, "height": height, "fps": fps, "frame_count": frame_count, "codec": codec and codec.lower()}
+
+@app.post("/probe")
+async def probe_video(
+    file: Optional[UploadFile] = File(None),
+    url: Optional[str] = Form(None),
+    width: Optional[int] = Form(None),
+    height: Optional[int] = Form(None),
+    fps: Optional[float] = Form(None),
+    frame_count: Optional[int] = Form(None),
+    duration_s: Optional[float] = Form(None),
+    codec: Optional[str] = Form(None),
+    render_overlay: bool = Form(False),
+    overlay_width: Optional[int] = Form(None),
+    overlay_fps: Optional[float] = Form(None),
+    start_s: Optional[float] = Form(None),
+    end_s: Optional[float] = Form(None)
+):
+    """
+    Predict processing time and peak memory of an analysis before running it
+
+    Only container metadata is used. For every sampling/model setting the
+    response gives the estimate and whether the budget would run, downgrade
+    or reject it. Estimates come from the cost model fitted to past
+    analyses (see /runtime budget.model).
+
+    Parameters (one source):
+    - url: Object URL as for /analyze/url; only the header is read
+    - width, height, fps, frame_count (or duration_s), codec: Metadata the
+      client read itself, so nothing is sent
+    - file: The video itself
+    Options:
+    - render_overlay, overlay_width, overlay_fps, start_s, end_s: As for /analyze
+    """
+    try:
+        if sum(x is not None for x in (file, url, width)) != 1:
+            raise ValueError("Give exactly one of file, url or width/height/fps/frame_count")
+        overlay = overlay_options(render_overlay, overlay_width, overlay_fps)
+        window = window_options(start_s, end_s)
+        if width is not None:
+            info = probe_metadata(width, height, fps, frame_count, duration_s, codec)
+        elif url is not None:
+            video_url = objects.resolve(url)
+            await run_in_threadpool(objects.stat, url)
+            info = await run_in_threadpool(read_header, video_url)
+        else:
+            suffix = os.path.splitext(file.filename or "")[-1]
+            with tempfile.NamedTemporaryFile(suffix=suffix) as tmp:
+                while chunk := await file.read(DEFAULT_CHUNK_SIZE):
+                    tmp.write(chunk)
+                tmp.flush()
+                info = await run_in_threadpool(read_header, tmp.name)
+        if info is None or not info["width"]:
+            raise ValueError("Cannot read the video's container metadata")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except WorkerCrashed as e:
+        raise HTTPException(status_code=422, detail=f"Cannot read the video: {str(e)}")
+    except OSError as e:
+        raise HTTPException(status_code=502, detail=f"Object store unreachable: {str(e)}")
+
+    return {
+        "video": info,
+        "budget": budget.config(),
+        "settings": budget.predict(info, overlay=overlay, **window),
+    }
+
+@app.post("/uploads")
+async def create_upload(
+    request: Request,
+    filename: str = Form(...),
+    size: int = Form(...),
+    distance: str = Form(...),
+    pixels_per_meter: Optional[float] = Form(DEFAULT_PIXELS_PER_METER),
+    chunk_size: int = Form(DEFAULT_CHUNK_SIZE),
+    early_start: bool = Form(False),
+    metrics: Optional[str] = Form(None),
+    split_m: Optional[float] = Form(None),
+    render_overlay: bool = Form(False),
+    overlay_width: Optional[int] = Form(None),
+    overlay_fps: Optional[float] = Form(None),
+    sampling: str = Form("full"),
+    start_s: Optional[float] = Form(None),
+    end_s: Optional[float] = Form(None),
+    model: str = Form("heavy"),
+    x_client_id: Optional[str] = Header(None)
+):
+    """
+    Start a resumable upload
+
+    Parameters:
+    - filename / size: Video file name and total size in bytes
+    - distance, pixels_per_meter, metrics, split_m, render_overlay,
+      overlay_width, overlay_fps, sampling, start_s, end_s, model,
+      X-Client-Id: As for /analyze
+    - chunk_size: Bytes per chunk (every chunk but the last must be this size)
+    - early_start: Begin decoding received data before the upload completes
+    """
+    try:
+        overlay = overlay_options(render_overlay, overlay_width, overlay_fps)
+        sampling = sampling_option(sampling, overlay)
+        upload = uploads.create(
+            filename, size, chunk_size,
+            meta={
+                "distance": distance,
+                "pixels_per_meter": pixels_per_meter,
+                "options": {
+                    "metrics": parse_metric_names(metrics),
+                    "split_m": split_option(split_m),
+                    "overlay": overlay,
+                    "sampling": sampling,
+                    "model": model_option(model, sampling, overlay),
+                    "client": client_id(request, x_client_id),
+                    **window_options(start_s, end_s)
+                }
+            }
+        )
+    except (UploadError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if early_start:
+        job_id = jobs.submit(run_upload_analysis, upload.upload_id, upload.follower())
+        uploads.set_job(upload.upload_id, job_id)
+    return upload.status()
+
+@app.put("/uploads/{upload_id}/chunks/{index}")
+async def put_upload_chunk(
+    upload_id: str,
+    index: int,
+    request: Request,
+    x_chunk_sha256: Optional[str] = Header(None)
+):
+    """Store one chunk; X-Chunk-SHA256 must be the hex SHA-256 of the body"""
+    data = await request.body()
+    try:
+        return uploads.write_chunk(upload_id, index, data, x_chunk_sha256)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    except UploadError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/uploads/{upload_id}")
+async def upload_status(upload_id: str):
+    """Contiguous offset and missing chunks of an upload"""
+    try:
+        return uploads.get(upload_id).status()
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Upload not found")
+
+@app.post("/uploads/{upload_id}/finalize")
+async def finalize_upload(upload_id: str):
+    """Complete an upload and start (or release) its analysis job"""
+    try:
+        upload = uploads.finalize(upload_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    except UploadError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if upload.job_id is None:
+        uploads.set_job(upload_id, jobs.submit(run_upload_analysis, upload_id))
+    return {"upload_id": upload_id, "job_id": upload.job_id}
+
+@app.get("/jobs/{job_id}")
+async def job_status(job_id: str):
+    """Status and, once done, result of an analysis job"""
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@app.get("/analyses/{analysis_id}/series")
+async def analysis_series(
+    analysis_id: str,
+    start_s: Optional[float] = None,
+    end_s: Optional[float] = None,
+    max_points: int = 1000,
+    fields: Optional[str] = None,
+    format: str = "json"
+):
+    """
+    Per-frame speed, knee-angle and ankle-height series of a completed analysis
+
+    Parameters:
+    - start_s / end_s: Time range in seconds (default: whole run)
+    - max_points: Upper bound on returned buckets; long ranges are served
+      from a min/max downsampling pyramid
+    - fields: Comma-separated subset of series (default: all)
+    - format: "json" or "binary" (float32 columns, see timeseries.to_binary)
+    """
+    try:
+        lod = cached_lod(analysis_id)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Analysis not found")
+    try:
+        window = query_lod(
+            lod, start_s, end_s, max_points,
+            fields.split(",") if fields else None
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if format == "binary":
+        return Response(content=to_binary(window), media_type="application/octet-stream")
+    if format != "json":
+        raise HTTPException(status_code=400, detail="format must be 'json' or 'binary'")
+    return {"analysis_id": analysis_id, **to_json(window)}
+
+@app.get("/analyses/{analysis_id}/overlay")
+async def analysis_overlay(analysis_id: str):
+    """Download the skeleton-overlay video of an analysis"""
+    try:
+        path = artifact_path(analysis_id, "overlay.mp4")
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Overlay not found")
+    return FileResponse(path, media_type="video/mp4", filename=f"{analysis_id}-overlay.mp4")
+
+@app.get("/compare")
+async def compare_analyses(a: str, b: str, phases: int = 4, band: float = 0.1):
+    """
+    Align two completed analyses and report per-phase differences (b - a)
+
+    Parameters:
+    - a / b: Analysis ids
+    - phases: Number of equal-duration phases of run a to report
+    - band: DTW band half-width as a fraction of the longer series, capped
+      at compare.MAX_BAND samples
+    """
+    if not 1 <= phases <= 100 or not 0 < band <= 1:
+        raise HTTPException(status_code=400, detail="phases must be 1-100 and band in (0, 1]")
+    try:
+        lod_a, lod_b = cached_lod(a), cached_lod(b)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Analysis not found")
+    try:
+        result = await run_in_threadpool(compare_runs, lod_a, lod_b, phases=phases, band_frac=band)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"a": a, "b": b, **result}
+
+@app.get("/runtime")
+async def runtime_config():
+    """Effective CPU, thread, budget, decoder, inference, batching, object-storage and queue settings of this worker"""
+    return {
+        **execution.current_config(), "pose_workers": pose_workers.status(), "budget": budget.config(),
+        "decoder": decoders.config(), "inference": inference.config(), "batching": batching.status(),
+        "objects": objects.config(), "queue": job_queue.stats() if job_queue is not None else None
+    }
+
+@app.on_event("shutdown")
+def stop_pose_workers():
+    pose_workers.close()
+    probe_workers.close()
+
 @app.get("/health")
 async def health_check():
     return {"status": "healthy", "timestamp": datetime.now().isoformat()}
@@ -0,0 +1,411 @@
+"""Biomechanics metrics computed from a pose series.
+
+Kept apart from the web app so the batch CLI and its workers compute the
+same metrics as ``/analyze`` without building the API, its job managers
+and worker pools, or opening the shared queue.
+"""
+import math
+from typing import Optional
+
+import numpy as np
+
+import scoring
+from signals import (
+    DEFAULT_FILTER, DEFAULT_WINDOW, is_uniform, joint_angles, local_minima, process_signals, resample_uniform,
+    smooth_channels
+)
+from splits import DEFAULT_SPLIT_M, compute_splits
+
+# Calibration for requests and batch clips that give none: 100 pixels = 1 m
+DEFAULT_PIXELS_PER_METER = 100.0
+
+
+def angle_3pt(a, b, c):
+    """Calculate angle at point b formed by points a-b-c"""
+    ax, ay = a
+    bx, by = b
+    cx, cy = c
+    v1 = np.array([ax - bx, ay - by])
+    v2 = np.array([cx - bx, cy - by])
+    denom = (np.linalg.norm(v1) * np.linalg.norm(v2)) + 1e-9
+    cosang = np.clip(np.dot(v1, v2) / denom, -1.0, 1.0)
+    return float(np.degrees(np.arccos(cosang)))
+
+
+def smooth(x, k=5):
+    """Smooth time series data"""
+    return smooth_channels(np.asarray(x, dtype=float)[None, :], k=k)[0]
+
+
+def derive_series(x, fps):
+    """Calculate velocity from position"""
+    v = np.diff(x) * fps
+    return np.concatenate([[0.0], v])
+
+
+def mid(p1, p2):
+    """Calculate midpoint"""
+    return ((p1[0] + p2[0]) * 0.5, (p1[1] + p2[1]) * 0.5)
+
+
+# Metric registry. Every node declares the inputs it needs; a request only
+# evaluates the metrics it asks for plus their dependencies, and each
+# intermediate is computed once per analysis.
+NODES = {}
+METRIC_NAMES = []
+
+
+def node(name, *requires):
+    """Register an intermediate computed from the named inputs"""
+    def register(fn):
+        NODES[name] = (fn, requires)
+        return fn
+    return register
+
+
+def metric(name, *requires):
+    """Register a reported metric computed from the named inputs"""
+    METRIC_NAMES.append(name)
+    return node(name, *requires)
+
+
+class MetricContext:
+    """Inputs of one analysis plus its memoized intermediates"""
+
+    def __init__(
+        self,
+        series: dict,
+        distance_label: str,
+        pixels_per_meter: float,
+        filter_method: str = DEFAULT_FILTER,
+        filter_window: int = DEFAULT_WINDOW,
+        signals: Optional[dict] = None,
+        split_m: Optional[float] = None,
+    ):
+        # Adaptively sampled series are resampled to an even frame grid so
+        # every frame-based metric applies unchanged
+        if "t" in series and not is_uniform(series["t"], series["fps"]):
+            series = resample_uniform(series)
+        self.values = {
+            "series": series,
+            "distance": distance_label,
+            "ppm": pixels_per_meter,
+            "fps": series["fps"],
+            "n": series["frames"],
+            "filter": (filter_method, filter_window),
+            "split_override": split_m,
+        }
+        if signals is not None:
+            self.values["signals"] = signals
+
+    def get(self, name: str):
+        if name not in self.values:
+            fn, requires = NODES[name]
+            self.values[name] = fn(*(self.get(r) for r in requires))
+        return self.values[name]
+
+
+@node("signals", "series", "filter")
+def batched_signals(series, flt):
+    # Smooth and differentiate every channel in one batched pass
+    return process_signals(series, method=flt[0], window=flt[1])
+
+
+@node("t", "series", "n", "fps")
+def timestamps(series, n, fps):
+    return series["t"] if "t" in series else np.arange(n) / max(fps, 1e-6)
+
+
+@node("time_taken", "n", "fps")
+def time_taken(n, fps):
+    return n / max(fps, 1e-6)
+
+
+@node("hx", "signals")
+def hip_x(signals):
+    # Hip horizontal displacement for speed
+    return signals["smoothed"]["hips_x"]
+
+
+@node("speed", "signals", "ppm")
+def hip_speed(signals, ppm):
+    return np.abs(signals["velocity"]["hips_x"]) / ppm
+
+
+@node("contacts", "signals")
+def contacts(signals):
+    # Step detection from ankle minima
+    l_contacts = local_minima(signals["smoothed"]["la_y"], w=3)
+    r_contacts = local_minima(signals["smoothed"]["ra_y"], w=3)
+    return np.sort(np.concatenate([l_contacts, r_contacts])).tolist()
+
+
+@node("steps", "contacts")
+def steps(contacts):
+    return max(0, len(contacts) - 1)
+
+
+@node("cadence", "steps", "time_taken")
+def cadence(steps, time_taken):
+    return steps / time_taken if time_taken > 0 else 0.0
+
+
+@node("strides", "series", "signals", "ppm")
+def strides(series, signals, ppm):
+    """End frame and length in meters of every detected stride, both feet"""
+    # Stride length from consecutive toe positions
+    frames, lengths = [], []
+    for toe, toe_y in ((series["ltoe"], signals["smoothed"]["ltoe_y"]),
+                       (series["rtoe"], signals["smoothed"]["rtoe_y"])):
+        idxs = local_minima(toe_y, w=3)
+        if len(idxs) > 1:
+            frames.append(idxs[1:])
+            lengths.append(np.abs(toe[idxs[1:], 0] - toe[idxs[:-1], 0]) / ppm)
+    if not frames:
+        return np.empty(0, dtype=int), np.empty(0)
+    frames = np.concatenate(frames)
+    order = np.argsort(frames, kind="stable")
+    return frames[order], np.concatenate(lengths)[order]
+
+
+@node("stride_length", "strides")
+def stride_length(strides):
+    lengths = strides[1]
+    return float(np.mean(lengths)) if len(lengths) > 0 else None
+
+
+@node("contact_frames", "contacts", "n")
+def contact_frames(contacts, n):
+    """Frames counted as ground contact around each contact event"""
+    window = 2
+    ci = np.asarray(contacts, dtype=int)
+    return np.minimum(n - 1, ci + window) - np.maximum(0, ci - window) + 1
+
+
+@node("contact_phases", "contacts", "contact_frames", "steps", "n", "fps")
+def contact_phases(contacts, contact_frames, steps, n, fps):
+    """Mean ground contact and flight times in ms"""
+    if len(contacts) < 2:
+        return None, None
+    mean_contact = int(contact_frames.sum()) / max(1, len(contacts))
+    step_frames = n / max(1, steps) if steps > 0 else 0
+    mean_flight = step_frames - mean_contact if step_frames > 0 else 0
+    gct_ms = (mean_contact / max(fps, 1e-6)) * 1000.0
+    flight_ms = (mean_flight / max(fps, 1e-6)) * 1000.0
+    return gct_ms, flight_ms
+
+
+@node("knee_angles", "series", "n")
+def knee_angles(series, n):
+    """Per-frame left and right knee angles"""
+    if n == 0:
+        return np.empty(0), np.empty(0)
+    return (
+        joint_angles(series["lhip"], series["lknee"], series["lankle"]),
+        joint_angles(series["rhip"], series["rknee"], series["rankle"]),
+    )
+
+
+@node("knee_drive", "knee_angles")
+def knee_drive(knee_angles):
+    kd_left, kd_right = (float(np.nanmin(a)) if len(a) else None for a in knee_angles)
+    return float(np.nanmin([kd_left, kd_right])) if kd_left and kd_right else None
+
+
+@node("torso_lean", "series", "n")
+def torso_lean(series, n):
+    if n <= 5:
+        return None
+    mid_i = n // 2
+    sh_mid = mid(series["lsh"][mid_i], series["rsh"][mid_i])
+    hp_mid = mid(series["lhip"][mid_i], series["rhip"][mid_i])
+    vx, vy = (sh_mid[0] - hp_mid[0], sh_mid[1] - hp_mid[1])
+    dot = vy * (-1)
+    mag = math.sqrt(vx*vx + vy*vy)
+    cosang = np.clip(dot / (mag + 1e-9), -1.0, 1.0)
+    return float(np.degrees(np.arccos(cosang)))
+
+
+@node("fatigue", "speed", "n")
+def fatigue(speed, n):
+    q = max(1, int(0.2 * n))
+    s1 = np.mean(speed[:q])
+    s2 = np.mean(speed[-q:])
+    drop_speed = ((s1 - s2) / s1) * 100.0 if s1 > 1e-6 else 0.0
+    return max(0.0, drop_speed)
+
+
+@node("nominal_stride", "distance")
+def nominal_stride(distance):
+    return scoring.nominal_stride(distance)
+
+
+@node("nominal_gct", "distance")
+def nominal_gct(distance):
+    return scoring.nominal_gct(distance)
+
+
+@metric("time_taken_s", "time_taken")
+def metric_time_taken(time_taken):
+    return round(time_taken, 2)
+
+
+@metric("max_speed_mps", "speed")
+def metric_max_speed(speed):
+    return round(float(np.max(speed)), 2)
+
+
+@metric("acceleration_0_30", "hx", "ppm", "fps")
+def metric_acceleration(hx, ppm, fps):
+    # Acceleration phase (0-30m if available)
+    disp_m = (hx - hx[0]) / ppm
+    idx_30 = np.where(disp_m >= 30.0)[0]
+    if len(idx_30) == 0:
+        return None
+    t_30 = idx_30[0] / max(fps, 1e-6)
+    accel_0_30 = 30.0 / t_30 if t_30 > 0 else 0.0
+    return round(accel_0_30, 2) if accel_0_30 else None
+
+
+@metric("stride_length_m", "stride_length")
+def metric_stride_length(stride_length):
+    return round(stride_length, 2) if stride_length else None
+
+
+@metric("cadence_sps", "cadence")
+def metric_cadence_sps(cadence):
+    return round(cadence, 2)
+
+
+@metric("cadence_spm", "cadence")
+def metric_cadence_spm(cadence):
+    return round(cadence * 60.0, 1)
+
+
+@metric("ground_contact_ms", "contact_phases")
+def metric_ground_contact(contact_phases):
+    gct_ms = contact_phases[0]
+    return round(gct_ms, 1) if gct_ms else None
+
+
+@metric("flight_time_ms", "contact_phases")
+def metric_flight_time(contact_phases):
+    flight_ms = contact_phases[1]
+    return round(flight_ms, 1) if flight_ms else None
+
+
+@metric("knee_drive_angle", "knee_drive")
+def metric_knee_drive(knee_drive):
+    return round(knee_drive, 1) if knee_drive else None
+
+
+@metric("torso_lean_deg", "torso_lean")
+def metric_torso_lean(torso_lean):
+    return round(torso_lean, 1) if torso_lean else None
+
+
+@metric("fatigue_index", "fatigue")
+def metric_fatigue(fatigue):
+    return round(fatigue, 1)
+
+
+@metric("form_score", "stride_length", "torso_lean", "contact_phases", "fatigue", "nominal_stride", "nominal_gct")
+def metric_form_score(stride_length, torso_lean_deg, contact_phases, fatigue_index, nominal_stride, nominal_gct):
+    col = scoring.as_column
+    score = scoring.form_scores(
+        col([stride_length]), col([torso_lean_deg]), col([contact_phases[0]]), col([fatigue_index]),
+        nominal_stride, nominal_gct
+    )
+    return round(float(score[0]), 1)
+
+
+@metric("feedback", "stride_length", "torso_lean", "fatigue", "cadence", "nominal_stride")
+def metric_feedback(stride_length, torso_lean_deg, fatigue_index, cadence_sps, nominal_stride):
+    col = scoring.as_column
+    return scoring.feedback_lists(
+        col([stride_length]), col([torso_lean_deg]), col([fatigue_index]), col([cadence_sps]), nominal_stride
+    )[0]
+
+
+DRILLS = {
+    "100m": ["A-skips: 3x20m for knee drive", "Bounding: 4x30m for power", "Core planks: 3x45s"],
+    "400m": ["Tempo runs: 3x300m", "Speed endurance: 4x200m", "Core circuit: 15min"],
+    "1km": ["Interval training: 6x400m", "Tempo run: 2km", "Hill repeats: 8x200m"],
+    "5km": ["Long intervals: 5x1km", "Tempo runs: 4km", "Easy distance: 12km"]
+}
+
+
+@metric("drills", "distance")
+def metric_drills(distance):
+    return DRILLS.get(distance, DRILLS["100m"])
+
+
+@node("split_m", "distance", "split_override")
+def split_length(distance, split_override):
+    return split_override or DEFAULT_SPLIT_M.get(distance, 10.0)
+
+
+@metric("splits", "t", "signals", "ppm", "split_m", "contacts", "contact_frames", "strides", "fps")
+def metric_splits(t, signals, ppm, split_m, contacts, contact_frames, strides, fps):
+    return compute_splits(
+        t, signals["smoothed"]["hips_x"], ppm, split_m, contacts, contact_frames,
+        strides[0], strides[1], fps, edge=signals["window"] // 2
+    )
+
+
+# Node (and tuple index) holding each scoring-rule input
+SCORING_SOURCES = {
+    "stride_length": ("stride_length", None),
+    "torso_lean": ("torso_lean", None),
+    "gct_ms": ("contact_phases", 0),
+    "fatigue": ("fatigue", None),
+    "cadence": ("cadence", None),
+}
+
+
+def scoring_inputs(ctx: MetricContext):
+    """Unrounded scoring-rule inputs that this analysis computed"""
+    inputs = {}
+    for name in scoring.SCORING_INPUTS:
+        node_name, index = SCORING_SOURCES[name]
+        if node_name in ctx.values:
+            value = ctx.values[node_name]
+            value = value if index is None else value[index]
+            inputs[name] = None if value is None else float(value)
+    return inputs
+
+
+def parse_metric_names(metrics: Optional[str]):
+    """Validate a comma-separated metrics selection (None means all)"""
+    if not metrics:
+        return None
+    names = [m.strip() for m in metrics.split(",") if m.strip()]
+    unknown = [m for m in names if m not in METRIC_NAMES]
+    if unknown:
+        raise ValueError(f"Unknown metrics: {', '.join(unknown)}")
+    return names
+
+
+def compute_metrics(
+    series: dict,
+    distance_label: str,
+    pixels_per_meter: float,
+    filter_method: str = DEFAULT_FILTER,
+    filter_window: int = DEFAULT_WINDOW,
+    signals: Optional[dict] = None,
+    metrics: Optional[list] = None,
+    context: Optional[MetricContext] = None,
+    split_m: Optional[float] = None,
+):
+    """Compute biomechanics metrics from pose series
+
+    metrics selects a subset of METRIC_NAMES (default: all); only those and
+    the intermediates they depend on are evaluated.
+    """
+    ctx = context or MetricContext(
+        series, distance_label, pixels_per_meter,
+        filter_method=filter_method, filter_window=filter_window,
+        signals=signals, split_m=split_m
+    )
+    wanted = METRIC_NAMES if metrics is None else [m for m in METRIC_NAMES if m in set(metrics)]
+    return {name: ctx.get(name) for name in wanted}
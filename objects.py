@@ -0,0 +1,193 @@
+"""Analysis input read straight from S3-compatible object storage.
+
+FFmpeg (under OpenCV or PyAV) opens http(s) URLs itself: it streams the object
+from the current offset and issues a new ranged GET only when the demuxer
+seeks further than the read-ahead window (an MP4 index at the end of the
+file, a start_s seek, cascade refinement). The clip is decoded while it
+arrives and never staged on local disk, so a video already in a bucket
+costs no download, temp copy or upload before the first frame.
+
+``s3://bucket/key`` URLs are turned into presigned (SigV4 query-signed)
+GET URLs against ``SPRINT_S3_ENDPOINT``, which works with AWS S3 and with
+MinIO-style stand-ins; path-style addressing is used so any endpoint with a
+port works. Plain http(s) URLs (already presigned, or public) are accepted
+only on the endpoint's host or a host listed in ``SPRINT_OBJECT_HOSTS``,
+since the server fetches whatever it is given. FFmpeg follows redirects, so
+``stat`` runs before any decoding and refuses an object URL that redirects,
+rather than let it lead off the allowed hosts.
+"""
+import datetime
+import hashlib
+import hmac
+import os
+import urllib.error
+import urllib.parse
+import urllib.request
+
+S3_REGION = os.environ.get("SPRINT_S3_REGION", "us-east-1")
+S3_ENDPOINT = os.environ.get("SPRINT_S3_ENDPOINT", f"https://s3.{S3_REGION}.amazonaws.com").rstrip("/")
+S3_ACCESS_KEY = os.environ.get("SPRINT_S3_ACCESS_KEY", "")
+S3_SECRET_KEY = os.environ.get("SPRINT_S3_SECRET_KEY", "")
+# Presigned URLs must outlive the analysis: it reopens them for refinement
+PRESIGN_EXPIRES_S = int(os.environ.get("SPRINT_S3_PRESIGN_EXPIRES_S", "3600"))
+OBJECT_HOSTS = tuple(h.strip().lower() for h in os.environ.get("SPRINT_OBJECT_HOSTS", "").split(",") if h.strip())
+# Forward seeks shorter than this keep reading the open response instead of
+# starting a new ranged request
+READAHEAD_KB = int(os.environ.get("SPRINT_OBJECT_READAHEAD_KB", "2048"))
+READ_TIMEOUT_S = float(os.environ.get("SPRINT_OBJECT_TIMEOUT_S", "30"))
+
+# FFmpeg http protocol options for reading an object: PyAV takes them as
+# av.open(options=...), OpenCV from the environment on every VideoCapture
+# open (harmless for local files). Set at import so pose workers started
+# afterwards inherit it
+FFMPEG_OPTIONS = {
+    "multiple_requests": "1",
+    "reconnect": "1",
+    "short_seek_size": str(READAHEAD_KB * 1024),
+    "rw_timeout": str(int(READ_TIMEOUT_S * 1e6)),
+}
+os.environ.setdefault("OPENCV_FFMPEG_CAPTURE_OPTIONS", "|".join(f"{k};{v}" for k, v in FFMPEG_OPTIONS.items()))
+
+
+class ObjectError(ValueError):
+    """Object URL the service cannot or may not read"""
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        # Surfaces the 3xx as an HTTPError
+        return None
+
+
+_opener = urllib.request.build_opener(_NoRedirect)
+
+
+def _hmac(key: bytes, msg: str):
+    return hmac.new(key, msg.encode(), hashlib.sha256).digest()
+
+
+def _quote(s: str, safe="-_.~"):
+    return urllib.parse.quote(s, safe=safe)
+
+
+def signed_query(method: str, host: str, path: str, expires_s: int = PRESIGN_EXPIRES_S, now=None):
+    """SigV4 query string authorising method on host/path (path already quoted)"""
+    now = now or datetime.datetime.now(datetime.timezone.utc)
+    amz_date = now.strftime("%Y%m%dT%H%M%SZ")
+    scope = f"{amz_date[:8]}/{S3_REGION}/s3/aws4_request"
+    query = {
+        "X-Amz-Algorithm": "AWS4-HMAC-SHA256",
+        "X-Amz-Credential": f"{S3_ACCESS_KEY}/{scope}",
+        "X-Amz-Date": amz_date,
+        "X-Amz-Expires": str(int(expires_s)),
+        "X-Amz-SignedHeaders": "host",
+    }
+    canonical_query = "&".join(f"{_quote(k)}={_quote(v)}" for k, v in sorted(query.items()))
+    canonical_request = "\n".join((method, path, canonical_query, f"host:{host}\n", "host", "UNSIGNED-PAYLOAD"))
+    string_to_sign = "\n".join(
+        ("AWS4-HMAC-SHA256", amz_date, scope, hashlib.sha256(canonical_request.encode()).hexdigest())
+    )
+    key = _hmac(("AWS4" + S3_SECRET_KEY).encode(), amz_date[:8])
+    for part in (S3_REGION, "s3", "aws4_request"):
+        key = _hmac(key, part)
+    signature = hmac.new(key, string_to_sign.encode(), hashlib.sha256).hexdigest()
+    return f"{canonical_query}&X-Amz-Signature={signature}"
+
+
+def object_url(bucket: str, key: str, method: str = "GET"):
+    """Path-style URL of an object, presigned when credentials are configured"""
+    endpoint = urllib.parse.urlsplit(S3_ENDPOINT)
+    path = f"{endpoint.path}/{_quote(bucket)}/{_quote(key, safe='/-_.~')}"
+    url = f"{endpoint.scheme}://{endpoint.netloc}{path}"
+    if not S3_ACCESS_KEY:
+        return url
+    return f"{url}?{signed_query(method, endpoint.netloc, path)}"
+
+
+def resolve(url: str, method: str = "GET"):
+    """Readable http(s) URL for an s3:// or allowed http(s) object URL"""
+    parts = urllib.parse.urlsplit(url)
+    scheme = parts.scheme.lower()
+    if scheme == "s3":
+        key = parts.path.lstrip("/")
+        if not parts.netloc or not key:
+            raise ObjectError("s3 URLs must look like s3://bucket/key")
+        return object_url(parts.netloc, urllib.parse.unquote(key), method)
+    if scheme not in ("http", "https"):
+        raise ObjectError("url must be an s3://, http:// or https:// object URL")
+    allowed = {urllib.parse.urlsplit(S3_ENDPOINT).hostname.lower(), *OBJECT_HOSTS}
+    if (parts.hostname or "").lower() not in allowed:
+        raise ObjectError(f"Host {parts.hostname} is not an allowed object store (see SPRINT_OBJECT_HOSTS)")
+    return url
+
+
+def display_url(url: str):
+    """URL without its query string, safe to store and return"""
+    parts = urllib.parse.urlsplit(url)
+    return urllib.parse.urlunsplit((parts.scheme, parts.netloc, parts.path, "", ""))
+
+
+def _headers(url: str, method: str, headers=None):
+    """Response headers of one request; redirects are refused, not followed"""
+    request = urllib.request.Request(url, method=method, headers=headers or {})
+    try:
+        with _opener.open(request, timeout=READ_TIMEOUT_S) as response:
+            return response.headers
+    except urllib.error.HTTPError as e:
+        if 300 <= e.code < 400:
+            raise ObjectError(f"{display_url(url)} redirects elsewhere; give the object's own URL") from None
+        raise
+
+
+def stat(url: str):
+    """Size and ETag of an object from a HEAD request
+
+    Raises ObjectError when the store refuses or lacks the object or
+    redirects, and OSError when it cannot be reached or fails (5xx).
+    """
+    s3 = urllib.parse.urlsplit(url).scheme.lower() == "s3"
+    try:
+        try:
+            headers = _headers(resolve(url, method="HEAD") if s3 else resolve(url), "HEAD")
+            size = headers.get("Content-Length")
+        except urllib.error.HTTPError as e:
+            # A URL presigned for GET only is refused for HEAD; a one-byte
+            # ranged GET returns the same headers, and shows the GET is not
+            # redirected either
+            if e.code != 403 or s3:
+                raise
+            headers = _headers(url, "GET", {"Range": "bytes=0-0"})
+            size = (headers.get("Content-Range") or "").rpartition("/")[2] or None
+    except urllib.error.HTTPError as e:
+        message = f"Object store answered {e.code} for {display_url(url)}"
+        if e.code >= 500:
+            raise OSError(message) from None
+        raise ObjectError(message) from None
+    etag = headers.get("ETag")
+    return {
+        "size": int(size) if size and size.isdigit() else None,
+        "etag": etag.strip('"') if etag else None,
+    }
+
+
+def content_key(url: str, info: dict):
+    """Single-flight key for an object: its ETag and size stand in for a content hash.
+
+    ETags are only unique per object (for plain web servers often just
+    mtime and size), so the key also names the object.
+    """
+    if not info.get("etag"):
+        return None
+    return f"etag:{display_url(url)}:{info['etag']}:{info['size']}"
+
+
+def config():
+    """Object-storage settings as reported by /runtime"""
+    return {
+        "endpoint": S3_ENDPOINT,
+        "region": S3_REGION,
+        "signed": bool(S3_ACCESS_KEY),
+        "allowed_hosts": list(OBJECT_HOSTS),
+        "readahead_kb": READAHEAD_KB,
+        "timeout_s": READ_TIMEOUT_S,
+    }
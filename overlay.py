@@ -0,0 +1,157 @@
+"""Skeleton-overlay video rendering in the same decode pass.
+
+``extract_pose_series`` hands every decoded frame and its landmarks to an
+``OverlayWriter``. The decode loop only resizes the frame and puts it on a
+bounded queue. Drawing and encoding happen on a background thread, so the
+added cost to the pose pass stays small, and a slow encoder applies
+backpressure instead of buffering the whole video in memory.
+
+``stats`` reports the seconds the decode loop spent queueing frames
+(``submit_s``) and the CPU seconds the encoder thread used (``encode_s``).
+
+Contact markers are detected online with the same smoothing window and
+local-minimum test as the metrics. This needs a few frames of lookahead, so
+the encoder holds a short delay line of frames.
+"""
+import collections
+import os
+import queue
+import threading
+import time
+
+import cv2
+import numpy as np
+
+OVERLAY_FOURCC = os.environ.get("SPRINT_OVERLAY_FOURCC", "mp4v")
+OVERLAY_QUEUE_SIZE = int(os.environ.get("SPRINT_OVERLAY_QUEUE_SIZE", "32"))
+
+_STOP = object()
+
+
+class OverlayWriter:
+    """Draws skeletons and contact markers and encodes them on a worker thread"""
+
+    def __init__(
+        self,
+        path: str,
+        connections,
+        ankle_ids=(27, 28),
+        out_width=None,
+        out_fps=None,
+        smooth_k=5,
+        minima_w=3,
+        queue_size=OVERLAY_QUEUE_SIZE,
+    ):
+        self.path = path
+        self.src_fps = None
+        self.out_fps = out_fps
+        self.out_width = out_width
+        self.connections = list(connections)
+        self.ankle_ids = ankle_ids
+        self.smooth_k = smooth_k
+        self.minima_w = minima_w
+        self.stats = {"frames_in": 0, "frames_written": 0, "submit_s": 0.0, "encode_s": 0.0}
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._error = None
+        self._next_out = 0.0
+        self._thread = threading.Thread(target=self._run, name="overlay-encoder", daemon=True)
+
+    def start(self, src_fps: float):
+        """Start the encoder once the source frame rate is known"""
+        self.src_fps = src_fps if src_fps and src_fps > 0 else 30.0
+        self.out_fps = min(self.out_fps, self.src_fps) if self.out_fps else self.src_fps
+        self._thread.start()
+
+    def submit(self, frame, landmarks=None):
+        """Queue one decoded BGR frame with normalized (33, 2) landmarks or None"""
+        start = time.perf_counter()
+        i = self.stats["frames_in"]
+        self.stats["frames_in"] += 1
+        # Drop frames to reach the output frame rate
+        keep = i * self.out_fps / self.src_fps >= self._next_out
+        if keep:
+            self._next_out += 1.0
+            h, w = frame.shape[:2]
+            if self.out_width and self.out_width != w:
+                out_h = int(round(h * self.out_width / w / 2)) * 2
+                frame = cv2.resize(frame, (self.out_width, out_h), interpolation=cv2.INTER_AREA)
+            else:
+                # The caller may reuse its frame buffer
+                frame = frame.copy()
+            pts = None if landmarks is None else np.array(landmarks, dtype=np.float32)
+            self._queue.put((frame, pts))
+        self.stats["submit_s"] += time.perf_counter() - start
+
+    def close(self):
+        """Flush remaining frames and wait for the encoder"""
+        if self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join()
+        if self._error is not None:
+            raise self._error
+        self.stats["submit_s"] = round(self.stats["submit_s"], 4)
+        self.stats["encode_s"] = round(self.stats["encode_s"], 4)
+        return self.stats
+
+    def _run(self):
+        writer = None
+        k, w = self.smooth_k, self.minima_w
+        delay = k // 2 + w
+        pending = collections.deque()
+        heights = collections.deque(maxlen=k + 2 * w)
+        stopped = False
+        try:
+            while True:
+                item = self._queue.get()
+                # CPU time, not wall time: the thread is preempted by the
+                # pass it runs alongside
+                start = time.thread_time()
+                if item is _STOP:
+                    stopped = True
+                    while pending:
+                        writer = self._emit(writer, *pending.popleft(), contacts=())
+                    break
+                frame, pts = item
+                pending.append((frame, pts))
+                heights.append(
+                    None if pts is None else np.array([pts[a, 1] for a in self.ankle_ids])
+                )
+                if len(pending) > delay:
+                    writer = self._emit(writer, *pending.popleft(), contacts=self._contacts(heights))
+                self.stats["encode_s"] += time.thread_time() - start
+        except Exception as e:
+            self._error = e
+            # Keep draining so the producer never blocks on a dead consumer
+            while not stopped and self._queue.get() is not _STOP:
+                pass
+        finally:
+            if writer is not None:
+                writer.release()
+
+    def _contacts(self, heights):
+        """Ankles at a local minimum in the frame leaving the delay line"""
+        if len(heights) < heights.maxlen or any(h is None for h in heights):
+            return ()
+        y = np.array(heights)
+        smoothed = np.lib.stride_tricks.sliding_window_view(y, self.smooth_k, axis=0).mean(axis=-1)
+        is_min = smoothed[self.minima_w] == smoothed.min(axis=0)
+        return tuple(a for a, hit in zip(self.ankle_ids, is_min) if hit)
+
+    def _emit(self, writer, frame, pts, contacts):
+        h, w = frame.shape[:2]
+        if writer is None:
+            writer = cv2.VideoWriter(self.path, cv2.VideoWriter_fourcc(*OVERLAY_FOURCC), self.out_fps, (w, h))
+            if not writer.isOpened():
+                raise RuntimeError("Cannot open overlay video writer")
+        if pts is not None:
+            xy = (pts * (w, h)).astype(int)
+            thickness = max(1, w // 320)
+            for a, b in self.connections:
+                cv2.line(frame, tuple(xy[a]), tuple(xy[b]), (255, 255, 255), thickness, cv2.LINE_AA)
+            for p in xy:
+                cv2.circle(frame, tuple(p), thickness + 1, (0, 200, 255), -1, cv2.LINE_AA)
+            for a in contacts:
+                cv2.circle(frame, tuple(xy[a]), thickness * 6, (0, 0, 255), thickness + 1, cv2.LINE_AA)
+        writer.write(frame)
+        self.stats["frames_written"] += 1
+        return writer
@@ -0,0 +1,487 @@
+"""Pose extraction: one decode pass over a video with a BlazePose estimator.
+
+Kept apart from the API module so supervised worker processes (see
+``workers``) can import it without the web app.
+"""
+import collections
+import contextlib
+import math
+import os
+import time
+from typing import Callable, Optional
+
+import mediapipe as mp
+import numpy as np
+
+from decoders import open_decoder
+from frames import LandmarkBuffer, fill_normalized
+from inference import open_estimator
+from overlay import OverlayWriter
+from signals import joint_angles, local_minima, smooth_channels
+
+mp_pose = mp.solutions.pose
+POSE_LMK = mp_pose.PoseLandmark
+
+# Pose model settings; part of the single-flight key so extractions with
+# different settings never share a result
+POSE_SETTINGS = {
+    "static_image_mode": False,
+    "model_complexity": 2,
+    "enable_segmentation": False,
+    "min_detection_confidence": 0.5,
+    "min_tracking_confidence": 0.5,
+}
+
+# Landmarks kept per frame, by series key
+SERIES_LANDMARKS = {
+    "lknee": POSE_LMK.LEFT_KNEE.value,
+    "rknee": POSE_LMK.RIGHT_KNEE.value,
+    "lankle": POSE_LMK.LEFT_ANKLE.value,
+    "rankle": POSE_LMK.RIGHT_ANKLE.value,
+    "ltoe": POSE_LMK.LEFT_FOOT_INDEX.value,
+    "rtoe": POSE_LMK.RIGHT_FOOT_INDEX.value,
+    "lhip": POSE_LMK.LEFT_HIP.value,
+    "rhip": POSE_LMK.RIGHT_HIP.value,
+    "lsh": POSE_LMK.LEFT_SHOULDER.value,
+    "rsh": POSE_LMK.RIGHT_SHOULDER.value,
+}
+
+SAMPLING_MODES = ("full", "adaptive")
+# Adaptive mode infers a sparse grid at about this rate between contacts
+ADAPTIVE_BASE_FPS = float(os.environ.get("SPRINT_ADAPTIVE_BASE_FPS", "60"))
+# Frames inferred densely past each predicted contact
+ADAPTIVE_MARGIN = int(os.environ.get("SPRINT_ADAPTIVE_MARGIN", "6"))
+
+
+MODEL_MODES = ("heavy", "cascade")
+# Cascade mode runs this lighter model on every frame and the heavy model
+# (POSE_SETTINGS) only on frames the metrics are sensitive to
+CASCADE_COMPLEXITY = int(os.environ.get("SPRINT_CASCADE_COMPLEXITY", "0"))
+# Frames re-run on each side of a contact or knee-flexion event
+CASCADE_MARGIN = int(os.environ.get("SPRINT_CASCADE_MARGIN", "2"))
+# First-pass frames with any series landmark less visible than this are re-run
+CASCADE_MIN_VISIBILITY = float(os.environ.get("SPRINT_CASCADE_MIN_VISIBILITY", "0.5"))
+# Knee-flexion peaks within this many degrees of the tightest one are re-run
+CASCADE_KNEE_BAND = float(os.environ.get("SPRINT_CASCADE_KNEE_BAND", "10"))
+# Refinement passes: events found on the merged series that were not
+# re-run yet (first-pass noise can hide or invent them) get another pass
+CASCADE_ROUNDS = int(os.environ.get("SPRINT_CASCADE_ROUNDS", "3"))
+# Gaps between re-run frames longer than this are seeked over, not grabbed
+SEEK_MIN_GAP = 32
+
+# Seconds spent per extraction stage, reported in the series under these
+# keys for the cost model (see budget)
+STAGES = ("decode_s", "infer_s", "overlay_s", "refine_s")
+
+_shared_pose = None
+
+
+def shared_pose():
+    """This process's long-lived estimator, created on first use.
+
+    Passing it to extract_pose_series for every clip avoids loading the
+    model again per clip, for batch workers that process many clips.
+    """
+    global _shared_pose
+    if _shared_pose is None:
+        _shared_pose = open_estimator(POSE_SETTINGS)
+    return _shared_pose
+
+
+class AdaptiveSampler:
+    """Chooses which frames get pose inference in adaptive mode.
+
+    Frames on a sparse grid (every step frames) are always inferred. After
+    each grid sample a parabola through the last three grid samples of each
+    ankle's height predicts its next local minimum, where contacts are
+    detected. If one is due before the grid sample after next can see it,
+    every frame is inferred until margin frames past it.
+    """
+
+    def __init__(self, fps: float, base_fps: float = ADAPTIVE_BASE_FPS, margin: int = ADAPTIVE_MARGIN):
+        self.step = max(1, int(round((fps or base_fps) / base_fps)))
+        self.margin = margin
+        self.dense_until = -1
+        self.inferred = 0
+        self._grid = collections.deque(maxlen=3)
+
+    def wants(self, i: int):
+        """Whether frame i should be inferred"""
+        return i % self.step == 0 or i <= self.dense_until
+
+    def observe(self, i: int, heights):
+        """Record the ankle heights found on inferred frame i"""
+        if i % self.step:
+            return
+        self._grid.append((i, heights))
+        if len(self._grid) < 3:
+            return
+        x = np.array([g[0] for g in self._grid], dtype=float)
+        Y = np.array([g[1] for g in self._grid], dtype=float)
+        a, b, _ = np.polyfit(x - i, Y, 2)
+        for a_k, b_k in zip(a, b):
+            if a_k <= 0:
+                continue
+            vertex = i - b_k / (2 * a_k)
+            if i - self.step <= vertex <= i + self.step + self.margin:
+                self.dense_until = max(self.dense_until, math.ceil(vertex) + self.margin)
+
+
+def cascade_frames(
+    points: LandmarkBuffer,
+    margin: int = CASCADE_MARGIN,
+    min_visibility: float = CASCADE_MIN_VISIBILITY,
+    knee_band: float = CASCADE_KNEE_BAND
+):
+    """Source frames the heavy model should re-run after the first pass.
+
+    - frames with a poorly visible landmark, and frames between the first
+      and last detection where no pose was found
+    - frames around ankle and toe minima (contacts and stride ends)
+    - frames around knee-flexion peaks close to the tightest one, and
+      around the tightest raw angle itself (knee_drive)
+    - frames around the middle frame (torso_lean)
+    """
+    ids = points.frames()
+    if len(ids) == 0:
+        return ids
+    flagged = [ids[points.visibility().min(axis=1) < min_visibility], np.setdiff1d(np.arange(ids[0], ids[-1]), ids)]
+
+    events = [len(ids) // 2]
+    feet = (SERIES_LANDMARKS["lankle"], SERIES_LANDMARKS["rankle"], SERIES_LANDMARKS["ltoe"], SERIES_LANDMARKS["rtoe"])
+    heights = smooth_channels(np.stack([points.points(idx)[:, 1] for idx in feet]))
+    for y in heights:
+        events.extend(local_minima(y, w=3))
+    knees = np.stack([
+        joint_angles(*(points.points(SERIES_LANDMARKS[f"{side}{joint}"]) for joint in ("hip", "knee", "ankle")))
+        for side in "lr"
+    ])
+    for raw, angle in zip(knees, smooth_channels(knees)):
+        peaks = local_minima(angle, w=3)
+        events.extend(peaks[angle[peaks] <= np.nanmin(angle) + knee_band])
+        if not np.isnan(raw).all():
+            events.append(int(np.nanargmin(raw)))
+
+    around = ids[np.asarray(events, dtype=int)][:, None] + np.arange(-margin, margin + 1)
+    return np.unique(np.concatenate(flagged + [around.ravel()]))
+
+
+def refine_frames(
+    video_path: str,
+    frame_ids,
+    width: float,
+    height: float,
+    pose=None,
+    infer_width: Optional[int] = None
+):
+    """Run the heavy model on the given sorted source frames.
+
+    Each run of consecutive frames starts from detection, and long gaps
+    between runs are seeked over. Returns a LandmarkBuffer of the frames
+    where a pose was found.
+    """
+    out = LandmarkBuffer(SERIES_LANDMARKS.values(), width, height, capacity=len(frame_ids) + 1)
+    if len(frame_ids) == 0:
+        return out
+    decoder = open_decoder(video_path, max_width=infer_width)
+    graph = open_estimator(POSE_SETTINGS) if pose is None else contextlib.nullcontext(pose)
+    pos = 0
+    prev = None
+    submitted = []
+
+    def collect():
+        for f, lm in zip(submitted, pose.flush()):
+            if lm is not None:
+                out.append(lm, f)
+        submitted.clear()
+
+    with graph as pose:
+        for f in frame_ids:
+            f = int(f)
+            if prev is None or f != prev + 1:
+                collect()
+                pose.reset(width, height)
+                if f - pos > SEEK_MIN_GAP:
+                    seeked = decoder.seek(f)
+                    pos = pos if seeked is None else seeked
+                if pos > f:
+                    decoder.close()
+                    decoder = open_decoder(video_path, max_width=infer_width)
+                    pos = 0
+                while pos < f and decoder.grab():
+                    pos += 1
+            frame = decoder.read() if pos == f else None
+            if frame is None:
+                break
+            pos += 1
+            prev = f
+            pose.submit(decoder.to_rgb(frame), f * 1000 / max(decoder.fps, 1e-6))
+            submitted.append(f)
+            if len(submitted) >= pose.batch_size:
+                collect()
+        collect()
+    decoder.close()
+    return out
+
+
+def extract_pose_series(
+    video_path: str,
+    follow: Optional[Callable[[], bool]] = None,
+    overlay: Optional[OverlayWriter] = None,
+    sampling: str = "full",
+    start_s: Optional[float] = None,
+    end_s: Optional[float] = None,
+    pose=None,
+    infer_width: Optional[int] = None,
+    model: str = "heavy"
+):
+    """Extract pose landmarks from video with the configured estimator (see inference)
+
+    If follow is given the file is still being written: whenever decoding
+    runs out of data, follow() blocks until more arrives and returns False
+    once the file is complete.
+
+    If overlay is given, every decoded frame and its landmarks are handed to
+    it for skeleton rendering in the same pass; the caller closes it.
+
+    sampling="adaptive" infers only a sparse grid of frames plus dense
+    windows around predicted contacts (see AdaptiveSampler). Skipped frames
+    are only grabbed, which saves their inference and colour conversion;
+    the codec still decodes them. The series then carries per-sample
+    timestamps in "t".
+
+    start_s / end_s restrict the pass to a time window: the capture seeks
+    straight to the first frame and stops after the last, and "t" holds
+    timestamps from the start of the video.
+
+    Rows are kept only for frames where a pose was found, so "t" is also
+    set whenever they are not one per frame from frame 0 (detection gaps,
+    cascade-refined frames); metrics resample such series onto an even
+    grid.
+
+    infer_width downscales wider frames to that width before inference,
+    which bounds the memory the model's input copies take on large
+    footage. Landmarks are normalized, so the series keeps source pixel
+    coordinates.
+
+    pose reuses an existing estimator (see shared_pose) instead of
+    creating one for this clip; it is left open.
+
+    Estimators that batch get several frames per call; the adaptive
+    sampler's grid frames end a batch, so the frames it picks next are
+    chosen on up-to-date landmarks.
+
+    The series reports the seconds spent in each of STAGES.
+
+    model="cascade" runs a lighter model on every frame, then re-runs the
+    heavy model on the frames cascade_frames picks and merges the two (the
+    series then reports "refined_frames"). It needs sampling="full", and an
+    overlay shows the first pass.
+    """
+    if model == "cascade" and sampling != "full":
+        raise ValueError("model=cascade requires sampling=full")
+    decoder = open_decoder(video_path, max_width=infer_width)
+    while not decoder.is_opened() and follow is not None and follow():
+        decoder = open_decoder(video_path, max_width=infer_width)
+    if not decoder.is_opened():
+        raise RuntimeError("Cannot open video file")
+
+    fps = decoder.fps
+    width = decoder.width
+    height = decoder.height
+    if overlay is not None:
+        overlay.start(fps)
+
+    # The header's frame count comes from the client and may be bogus; the
+    # buffer grows past the first allocation when a clip is longer
+    points = LandmarkBuffer(SERIES_LANDMARKS.values(), width, height, capacity=min(decoder.frame_count + 1, 4096))
+    overlay_pts = np.empty((len(POSE_LMK), 2), dtype=np.float32)
+    sampler = AdaptiveSampler(fps) if sampling == "adaptive" else None
+    ankles = (POSE_LMK.LEFT_ANKLE.value, POSE_LMK.RIGHT_ANKLE.value)
+
+    # frame_count is the source index of the next frame
+    first = int(round(start_s * fps)) if start_s else 0
+    last = int(round(end_s * fps)) if end_s is not None else None
+    frame_count = 0
+    if first and follow is None:
+        frame_count = decoder.seek(first) or 0
+    # Frames still short of the window (seek failed or file still growing)
+    # are skipped by grabbing
+
+    heavy = pose
+    if model == "cascade":
+        graph = open_estimator({**POSE_SETTINGS, "model_complexity": CASCADE_COMPLEXITY}, lite=True)
+    elif pose is None:
+        graph = open_estimator(POSE_SETTINGS)
+    else:
+        # A reused estimator still tracks the previous clip's runner; this
+        # clip starts from detection exactly as on a fresh one
+        pose.reset(width, height)
+        graph = contextlib.nullcontext(pose)
+
+    stages = dict.fromkeys(STAGES, 0.0)
+    clock = time.perf_counter
+    # Source index and overlay image of each frame submitted to the
+    # estimator whose landmarks are not collected yet
+    submitted = []
+
+    def collect():
+        tick = clock()
+        results = pose.flush()
+        inferred = clock()
+        stages["infer_s"] += inferred - tick
+        for (i, image), lm in zip(submitted, results):
+            if overlay is not None:
+                overlay.submit(image, fill_normalized(lm, overlay_pts) if lm is not None else None)
+            if lm is not None:
+                points.append(lm, i)
+                if sampler is not None:
+                    sampler.observe(i, [lm[a].y for a in ankles])
+            if sampler is not None:
+                sampler.inferred += 1
+        submitted.clear()
+        stages["overlay_s"] += clock() - inferred
+
+    with graph as pose:
+        while last is None or frame_count < last:
+            tick = clock()
+            if frame_count >= first and (sampler is None or sampler.wants(frame_count)):
+                frame = decoder.read()
+                ok = frame is not None
+            else:
+                frame = None
+                ok = decoder.grab()
+            if not ok:
+                collect()
+                if follow is not None and follow():
+                    # Reopen to see the newly written data (the capture
+                    # stays at end of stream otherwise), seek back to
+                    # where decoding stopped and grab any frames the seek
+                    # fell short by; from frame 0 only if it failed
+                    decoder.close()
+                    decoder = open_decoder(video_path, max_width=infer_width)
+                    skipped = decoder.seek(frame_count) if frame_count and decoder.is_opened() else 0
+                    if skipped is None or skipped > frame_count:
+                        decoder.close()
+                        decoder = open_decoder(video_path, max_width=infer_width)
+                        skipped = 0
+                    while skipped < frame_count and decoder.grab():
+                        skipped += 1
+                    continue
+                break
+            if frame is None:
+                frame_count += 1
+                stages["decode_s"] += clock() - tick
+                continue
+
+            decoded = clock()
+            stages["decode_s"] += decoded - tick
+            pose.submit(decoder.to_rgb(frame), frame_count * 1000 / max(fps, 1e-6))
+            inferred = clock()
+            stages["infer_s"] += inferred - decoded
+            image = None
+            if overlay is not None:
+                # Decode buffers are reused before a batch is collected
+                image = decoder.to_bgr(frame)
+                if pose.batch_size > 1:
+                    image = image.copy()
+                stages["overlay_s"] += clock() - inferred
+            submitted.append((frame_count, image))
+            if len(submitted) >= pose.batch_size or (sampler is not None and frame_count % sampler.step == 0):
+                collect()
+
+            frame_count += 1
+        collect()
+
+    decoder.close()
+
+    refined = None
+    tick = clock()
+    if model == "cascade":
+        attempted = np.empty(0, dtype=np.int64)
+        # The heavy model is loaded once, on the first round with frames to
+        # refine, and serves every round
+        owned = None
+        try:
+            for _ in range(CASCADE_ROUNDS):
+                todo = cascade_frames(points)
+                todo = np.setdiff1d(todo[(todo >= first) & (todo < frame_count)], attempted)
+                if len(todo) == 0:
+                    break
+                if heavy is None:
+                    heavy = owned = open_estimator(POSE_SETTINGS)
+                points.merge(refine_frames(video_path, todo, width, height, pose=heavy, infer_width=infer_width))
+                attempted = np.union1d(attempted, todo)
+        finally:
+            if owned is not None:
+                owned.close()
+        refined = len(attempted)
+    stages["refine_s"] = clock() - tick
+
+    series = {name: points.points(idx) for name, idx in SERIES_LANDMARKS.items()}
+    hips = (series["lhip"] + series["rhip"]) * 0.5
+    # Rows exist only for frames where a pose was found, so a window's
+    # offset, a detection gap or cascade-inserted rows need timestamps
+    # from the frame index of every row
+    frame_ids = points.frames()
+    timed = sampler is not None or not np.array_equal(frame_ids, np.arange(points.n))
+    return {
+        "fps": fps,
+        "frames": points.n,
+        "width": width,
+        "height": height,
+        "hips_x": hips[:, 0].copy(),
+        "hips_y": hips[:, 1].copy(),
+        "la_y": series["lankle"][:, 1].copy(),
+        "ra_y": series["rankle"][:, 1].copy(),
+        **series,
+        **({"t": frame_ids / max(fps, 1e-6)} if timed else {}),
+        **({} if sampler is None else {
+            "inferred_frames": sampler.inferred,
+            "decoded_frames": frame_count - first,
+        }),
+        **({} if refined is None else {"refined_frames": refined}),
+        **stages,
+    }
+
+
+def run_extraction(
+    video_path: str,
+    follow: Optional[Callable[[], bool]] = None,
+    overlay: Optional[dict] = None,
+    sampling: str = "full",
+    start_s: Optional[float] = None,
+    end_s: Optional[float] = None,
+    infer_width: Optional[int] = None,
+    model: str = "heavy"
+):
+    """extract_pose_series with an optional overlay rendered alongside.
+
+    overlay ({"path": ..., "width": ..., "fps": ...}) builds the writer here
+    so the whole pass can run in a worker process. Returns the series and
+    the overlay stats (or None).
+    """
+    if overlay is None:
+        return extract_pose_series(
+            video_path, follow=follow, sampling=sampling, start_s=start_s, end_s=end_s,
+            infer_width=infer_width, model=model
+        ), None
+    writer = OverlayWriter(
+        overlay["path"],
+        mp_pose.POSE_CONNECTIONS,
+        ankle_ids=(POSE_LMK.LEFT_ANKLE.value, POSE_LMK.RIGHT_ANKLE.value),
+        out_width=overlay.get("width"),
+        out_fps=overlay.get("fps")
+    )
+    try:
+        series = extract_pose_series(
+            video_path, follow=follow, overlay=writer, sampling=sampling, start_s=start_s, end_s=end_s,
+            infer_width=infer_width, model=model
+        )
+    except BaseException:
+        try:
+            writer.close()
+        except Exception:
+            pass
+        raise
+    return series, writer.close()
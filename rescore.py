@@ -0,0 +1,146 @@
+"""Bulk re-scoring of stored analyses after the scoring rules change.
+
+Loads the scoring inputs of every stored analysis (``inputs.json``, or the
+rounded metrics for analyses stored before it existed) into stacked NumPy
+columns, evaluates the form-score and feedback rules from ``scoring`` once
+over all of them, and writes changed results back through
+``save_analysis``, which replaces each analysis directory atomically.
+Only metrics an analysis originally reported are updated.
+
+Example:
+    python rescore.py --dry-run
+    python rescore.py --ids 3f2a...,9c1b...
+"""
+import argparse
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import numpy as np
+
+import scoring
+from store import list_analyses, load_inputs, load_result, save_analysis
+
+# Stored (rounded) metric used for each input when inputs.json is missing
+ROUNDED_FALLBACK = {
+    "stride_length": "stride_length_m",
+    "torso_lean": "torso_lean_deg",
+    "gct_ms": "ground_contact_ms",
+    "fatigue": "fatigue_index",
+    "cadence": "cadence_sps",
+}
+
+RESCORED_METRICS = ("form_score", "feedback")
+
+
+def load_table(ids, io_workers=8):
+    """Stored results of the given analyses and their stacked scoring inputs"""
+    def load(analysis_id):
+        try:
+            result = load_result(analysis_id)
+        except (FileNotFoundError, ValueError):
+            return None
+        metrics = result.get("metrics", {})
+        if not any(m in metrics for m in RESCORED_METRICS):
+            return None
+        inputs = load_inputs(analysis_id)
+        if inputs is None and not all(m in metrics for m in ROUNDED_FALLBACK.values()):
+            # Without stored inputs every rule input must have been reported
+            return None
+        return analysis_id, result, inputs
+
+    with ThreadPoolExecutor(max_workers=io_workers) as pool:
+        rows = [row for row in pool.map(load, ids) if row is not None]
+
+    columns = {}
+    for name in scoring.SCORING_INPUTS:
+        columns[name] = scoring.as_column([
+            inputs.get(name) if inputs is not None else result["metrics"].get(ROUNDED_FALLBACK[name])
+            for _, result, inputs in rows
+        ])
+    distances = [result.get("distance") for _, result, _ in rows]
+    columns["nominal_stride"] = np.array([scoring.nominal_stride(d) for d in distances], dtype=float)
+    columns["nominal_gct"] = np.array([scoring.nominal_gct(d) for d in distances], dtype=float)
+    approximate = sum(1 for _, _, inputs in rows if inputs is None)
+    return rows, columns, approximate
+
+
+def score_table(columns):
+    """New form scores and feedback for every row"""
+    scores = scoring.form_scores(
+        columns["stride_length"], columns["torso_lean"], columns["gct_ms"], columns["fatigue"],
+        columns["nominal_stride"], columns["nominal_gct"],
+    )
+    feedback = scoring.feedback_lists(
+        columns["stride_length"], columns["torso_lean"], columns["fatigue"], columns["cadence"],
+        columns["nominal_stride"],
+    )
+    return {
+        "form_score": [None if np.isnan(s) else round(float(s), 1) for s in scores],
+        "feedback": feedback,
+    }
+
+
+def rescore(ids=None, dry_run=False, io_workers=8):
+    """Re-score stored analyses; returns a report with timings and the diff"""
+    started = time.perf_counter()
+    ids = list_analyses() if ids is None else list(ids)
+    rows, columns, approximate = load_table(ids, io_workers)
+    loaded = time.perf_counter()
+    new = score_table(columns)
+    scored = time.perf_counter()
+
+    diff, updates = [], []
+    for i, (analysis_id, result, _) in enumerate(rows):
+        metrics = result["metrics"]
+        changed = {}
+        for name in RESCORED_METRICS:
+            if name in metrics and new[name][i] is not None and metrics[name] != new[name][i]:
+                diff.append({"analysis_id": analysis_id, "metric": name, "old": metrics[name], "new": new[name][i]})
+                changed[name] = new[name][i]
+        if changed:
+            updates.append((analysis_id, {
+                **result,
+                "metrics": {**metrics, **changed},
+                "rescored_at": datetime.now().isoformat(),
+            }))
+
+    if not dry_run and updates:
+        with ThreadPoolExecutor(max_workers=io_workers) as pool:
+            list(pool.map(lambda u: save_analysis(*u), updates))
+    written = time.perf_counter()
+
+    total_s = written - started
+    return {
+        "dry_run": dry_run,
+        "analyses": len(rows),
+        "approximate": approximate,
+        "changed": len(updates),
+        "load_s": round(loaded - started, 3),
+        "score_s": round(scored - loaded, 4),
+        "write_s": round(written - scored, 3),
+        "score_per_s": round(len(rows) / max(scored - loaded, 1e-9)),
+        "analyses_per_s": round(len(rows) / max(total_s, 1e-9), 1),
+        "diff": diff,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Re-score stored analyses with the current scoring rules")
+    parser.add_argument("--dry-run", action="store_true", help="Report changes without writing them")
+    parser.add_argument("--ids", help="Comma-separated analysis ids (default: all)")
+    parser.add_argument("--io-workers", type=int, default=8, help="Threads for loading and writing results")
+    parser.add_argument("--show", type=int, default=20, help="Diff entries to print (-1 for all)")
+    args = parser.parse_args(argv)
+
+    ids = [i.strip() for i in args.ids.split(",") if i.strip()] if args.ids else None
+    report = rescore(ids, dry_run=args.dry_run, io_workers=args.io_workers)
+    if args.show >= 0:
+        report["diff_shown"] = min(args.show, len(report["diff"]))
+        report["diff"] = report["diff"][:args.show]
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""Form-score and feedback rules, vectorised over analyses.
+
+The rules take NumPy arrays with one entry per analysis (NaN where an input
+is unavailable), so the per-request metrics and the bulk re-scorer
+(``rescore.py``) evaluate exactly the same code. Tuning a weight, a
+threshold or a nominal table here changes both.
+"""
+import numpy as np
+
+NOMINAL_STRIDE = {"100m": 2.3, "400m": 2.1, "1km": 1.9, "5km": 1.75}
+NOMINAL_GCT = {"100m": 110, "400m": 125, "1km": 140, "5km": 160}
+DEFAULT_NOMINAL_STRIDE = 2.0
+DEFAULT_NOMINAL_GCT = 130
+
+# Unrounded inputs of the scoring rules, stored with each analysis
+SCORING_INPUTS = ("stride_length", "torso_lean", "gct_ms", "fatigue", "cadence")
+
+
+def nominal_stride(distance):
+    return NOMINAL_STRIDE.get(distance, DEFAULT_NOMINAL_STRIDE)
+
+
+def nominal_gct(distance):
+    return NOMINAL_GCT.get(distance, DEFAULT_NOMINAL_GCT)
+
+
+def as_column(values):
+    """Float array with None mapped to NaN"""
+    return np.array([np.nan if v is None else v for v in values], dtype=float)
+
+
+def _present(x):
+    # Inputs that are missing or zero are skipped, as in the original rules
+    return ~np.isnan(x) & (x != 0)
+
+
+def form_scores(stride_length, torso_lean, gct_ms, fatigue, nominal_stride, nominal_gct):
+    """Form score 0-100 per analysis (unrounded)"""
+    score = np.full(len(fatigue), 100.0)
+    with np.errstate(invalid="ignore"):
+        score -= np.where(
+            _present(stride_length),
+            np.minimum(15.0, np.abs(stride_length - nominal_stride) / nominal_stride * 15.0),
+            0.0,
+        )
+        score -= np.where(
+            _present(torso_lean), np.minimum(10.0, np.maximum(0.0, torso_lean - 10.0) * 0.5), 0.0
+        )
+        score -= np.where(
+            _present(gct_ms), np.minimum(15.0, np.abs(gct_ms - nominal_gct) / nominal_gct * 15.0), 0.0
+        )
+    score -= np.minimum(20.0, fatigue * 0.2)
+    return np.maximum(0, np.minimum(100, score))
+
+
+def feedback_lists(stride_length, torso_lean, fatigue, cadence, nominal_stride):
+    """Feedback messages per analysis"""
+    with np.errstate(invalid="ignore"):
+        has_stride = _present(stride_length)
+        diff = stride_length - nominal_stride
+        stride_ok = has_stride & (np.abs(diff) < 0.1)
+        stride_off = has_stride & ~stride_ok
+        has_lean = _present(torso_lean)
+        upright = has_lean & (torso_lean < 15)
+        leaning = has_lean & ~upright & (torso_lean > 20)
+        fresh = fatigue < 5
+        tired = ~fresh & (fatigue > 15)
+        turnover = cadence > 4.5
+
+    out = [[] for _ in range(len(fatigue))]
+    for i in np.flatnonzero(stride_ok):
+        out[i].append("Excellent stride length consistency")
+    for i in np.flatnonzero(stride_off):
+        out[i].append(f"Stride length {'over' if diff[i] > 0 else 'under'} optimal by {abs(diff[i]):.2f}m")
+    for i in np.flatnonzero(upright):
+        out[i].append("Good upright posture maintained")
+    for i in np.flatnonzero(leaning):
+        out[i].append("Excessive forward lean detected - work on posture")
+    for i in np.flatnonzero(fresh):
+        out[i].append("Strong endurance with minimal speed drop")
+    for i in np.flatnonzero(tired):
+        out[i].append("Significant fatigue in final phase - improve conditioning")
+    for i in np.flatnonzero(turnover):
+        out[i].append("High cadence showing good leg turnover")
+    return out
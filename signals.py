@@ -0,0 +1,165 @@
+"""Batched signal-processing stage shared by every metric.
+
+All per-frame channels used by ``compute_metrics`` are stacked into one
+``(channels, frames)`` array so gap-filling, smoothing and differentiation
+each run as a single vectorised operation instead of once per series.
+"""
+import os
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+# Channels consumed by the metrics, as (name, series key, column or None)
+CHANNELS = (
+    ("hips_x", "hips_x", None),
+    ("la_y", "la_y", None),
+    ("ra_y", "ra_y", None),
+    ("ltoe_y", "ltoe", 1),
+    ("rtoe_y", "rtoe", 1),
+)
+
+DEFAULT_FILTER = os.environ.get("SPRINT_SIGNAL_FILTER", "moving_average")
+DEFAULT_WINDOW = int(os.environ.get("SPRINT_SIGNAL_WINDOW", "5"))
+
+
+def moving_average_kernel(k, polyorder=None):
+    """Uniform kernel of length k"""
+    return np.full(k, 1.0 / k)
+
+
+def savgol_kernel(k, polyorder=2):
+    """Savitzky-Golay smoothing coefficients for an odd window k"""
+    if k % 2 == 0:
+        raise ValueError("Savitzky-Golay window must be odd")
+    if polyorder >= k:
+        raise ValueError("Savitzky-Golay polyorder must be less than window")
+    half = k // 2
+    A = np.vander(np.arange(-half, half + 1, dtype=float), polyorder + 1, increasing=True)
+    return np.linalg.pinv(A)[0]
+
+
+# name -> (kernel builder, edge padding mode)
+# Moving average pads with zeros to match np.convolve(mode="same").
+FILTERS = {
+    "moving_average": (moving_average_kernel, "constant"),
+    "savgol": (savgol_kernel, "edge"),
+}
+
+
+def stack_channels(series, channels=CHANNELS):
+    """Stack the metric channels of a pose series into a 2D array"""
+    n = len(series["hips_x"])
+    X = np.empty((len(channels), n), dtype=float)
+    for row, (_, key, col) in enumerate(channels):
+        src = series[key]
+        X[row] = src[:, col] if col is not None else src
+    return X
+
+
+def fill_gaps(X):
+    """Linearly interpolate NaN gaps along each row (in place)"""
+    missing = np.isnan(X)
+    if not missing.any():
+        return X
+    n = X.shape[1]
+    idx = np.arange(n)
+    prev = np.maximum.accumulate(np.where(missing, -1, idx), axis=1)
+    nxt = np.minimum.accumulate(np.where(missing, n, idx)[:, ::-1], axis=1)[:, ::-1]
+    rows = np.arange(X.shape[0])[:, None]
+    has_prev = prev >= 0
+    has_next = nxt < n
+    prev_c = np.clip(prev, 0, n - 1)
+    next_c = np.clip(nxt, 0, n - 1)
+    y0 = X[rows, prev_c]
+    y1 = X[rows, next_c]
+    both = has_prev & has_next & (nxt > prev)
+    span = np.where(both, nxt - prev, 1)
+    t = np.where(both, (idx - prev) / span, 0.0)
+    filled = np.where(has_prev, y0 + (y1 - y0) * t, y1)
+    filled = np.where(has_prev & ~has_next, y0, filled)
+    X[missing] = filled[missing]
+    return X
+
+
+def smooth_channels(X, method=DEFAULT_FILTER, k=DEFAULT_WINDOW, polyorder=2):
+    """Smooth every row of X with the selected filter"""
+    if X.shape[1] < 3:
+        return X.astype(float, copy=True)
+    if method not in FILTERS:
+        raise ValueError(f"Unknown filter '{method}'")
+    k = max(1, int(k))
+    build, pad_mode = FILTERS[method]
+    kernel = build(k, polyorder)
+    left = k - 1 - (k - 1) // 2
+    right = (k - 1) // 2
+    padded = np.pad(X, ((0, 0), (left, right)), mode=pad_mode)
+    return sliding_window_view(padded, k, axis=1) @ kernel[::-1]
+
+
+def local_minima(y, w=3):
+    """Indices i (w <= i < n - w) where y[i] is the minimum of y[i-w:i+w+1]"""
+    y = np.asarray(y, dtype=float)
+    if len(y) < 2 * w + 1:
+        return np.empty(0, dtype=int)
+    return np.flatnonzero(y[w:len(y) - w] == sliding_window_view(y, 2 * w + 1).min(axis=1)) + w
+
+
+def differentiate(X, fps):
+    """Per-row first difference scaled by fps, with a leading zero"""
+    return np.diff(X, axis=1, prepend=X[:, :1]) * fps
+
+
+def is_uniform(t, fps):
+    """Whether timestamps are evenly spaced at 1/fps"""
+    if len(t) < 2:
+        return True
+    return bool(np.allclose(np.diff(t), 1.0 / max(fps, 1e-6), rtol=1e-3, atol=1e-6))
+
+
+def resample_uniform(series, fps=None):
+    """Interpolate a series with non-uniform "t" onto an even fps grid.
+
+    Every per-frame array (1-D or (frames, 2)) is linearly interpolated;
+    scalars are kept. Samples at the grid's frame times are reproduced
+    exactly, so densely sampled stretches are unchanged.
+    """
+    fps = max(fps or series["fps"], 1e-6)
+    t = np.asarray(series["t"], dtype=float)
+    n = len(t)
+    if n < 2:
+        return series
+    # Round to whole frames so grid points land on the sampled frame times
+    frames = np.rint((t - t[0]) * fps)
+    grid_frames = np.arange(int(frames[-1]) + 1)
+    grid = t[0] + grid_frames / fps
+    out = dict(series, t=grid, frames=len(grid))
+    for key, value in series.items():
+        if key == "t" or not isinstance(value, np.ndarray) or value.ndim == 0 or len(value) != n:
+            continue
+        flat = value.reshape(n, -1).astype(float)
+        cols = [np.interp(grid_frames, frames, flat[:, j]) for j in range(flat.shape[1])]
+        out[key] = np.stack(cols, axis=1).reshape((len(grid),) + value.shape[1:])
+    return out
+
+
+def process_signals(series, method=DEFAULT_FILTER, window=DEFAULT_WINDOW, polyorder=2):
+    """Run gap-filling, smoothing and differentiation on all channels at once"""
+    X = fill_gaps(stack_channels(series))
+    S = smooth_channels(X, method=method, k=window, polyorder=polyorder)
+    V = differentiate(S, series["fps"])
+    names = [name for name, _, _ in CHANNELS]
+    return {
+        "method": method,
+        "window": window,
+        "smoothed": {name: S[i] for i, name in enumerate(names)},
+        "velocity": {name: V[i] for i, name in enumerate(names)},
+    }
+
+
+def joint_angles(a, b, c):
+    """Angle in degrees at b formed by a-b-c, for (frames, 2) point arrays"""
+    v1 = np.asarray(a, dtype=float) - b
+    v2 = np.asarray(c, dtype=float) - b
+    denom = np.linalg.norm(v1, axis=1) * np.linalg.norm(v2, axis=1) + 1e-9
+    cosang = np.clip(np.einsum("ij,ij->i", v1, v2) / denom, -1.0, 1.0)
+    return np.degrees(np.arccos(cosang))
@@ -0,0 +1,49 @@
+"""Single-flight coalescing of identical in-flight work.
+
+When a client retries after a proxy timeout, the same clip arrives again
+while the first analysis is still running. Calls sharing a key (content
+hash plus extraction settings) attach to the running computation and
+receive its result or exception instead of starting a second one.
+"""
+import threading
+from concurrent.futures import Future
+
+
+class SingleFlight:
+    """Runs at most one call per key at a time; concurrent callers share it"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self.stats = {"leaders": 0, "followers": 0}
+
+    def do(self, key, fn, *args, **kwargs):
+        """Call fn(*args, **kwargs), or wait for the in-flight call with key"""
+        with self._lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._inflight[key] = future
+                self.stats["leaders"] += 1
+            else:
+                self.stats["followers"] += 1
+        if not leader:
+            return future.result()
+
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._inflight[key]
+
+    def inflight(self):
+        """Number of keys currently being computed"""
+        with self._lock:
+            return len(self._inflight)
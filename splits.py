@@ -0,0 +1,95 @@
+"""Per-segment split metrics computed in one cumulative pass.
+
+Hip travel, contact events and strides are turned into cumulative arrays
+once: a running maximum of forward hip displacement, and prefix sums of
+contact and stride events. Every segment's totals are then a difference of
+two prefix sums at its boundaries, so any number of segments costs O(n)
+overall with no rescanning of the series.
+"""
+import numpy as np
+
+# Default split length in meters per race distance
+DEFAULT_SPLIT_M = {"100m": 10.0, "400m": 50.0, "1km": 100.0, "5km": 500.0}
+# Shortest split a request may ask for, and most segments reported (longer
+# runs, e.g. from a bogus pixels_per_meter, get longer segments)
+MIN_SPLIT_M = 1.0
+MAX_SPLITS = 1000
+
+
+def _prefix(values):
+    """Prefix sums with a leading zero"""
+    out = np.zeros(len(values) + 1)
+    np.cumsum(values, out=out[1:])
+    return out
+
+
+def compute_splits(t, hx, pixels_per_meter, split_m, contacts, contact_frames, stride_frames, stride_lengths, fps, edge=0):
+    """Split metrics for consecutive segments of split_m meters.
+
+    - t: per-frame timestamps in seconds
+    - hx: smoothed hip x position in pixels
+    - contacts / contact_frames: contact event frames and frames in contact
+    - stride_frames / stride_lengths: stride end frames and lengths in meters
+    - edge: frames at each end distorted by smoothing, excluded from distance
+
+    The final segment may be shorter than split_m; at most MAX_SPLITS
+    segments are returned.
+    """
+    n = len(hx)
+    if n < 2 * edge + 2 or not split_m or split_m <= 0:
+        return []
+
+    # Distance covered is the running maximum of forward displacement, so it
+    # is monotone, ignores jitter while standing, and works in either
+    # running direction
+    lo, hi = edge, n - 1 - edge
+    x = np.clip(np.arange(n), lo, hi)
+    disp = (hx[x] - hx[lo]) / pixels_per_meter
+    if hx[hi] < hx[lo]:
+        disp = -disp
+    dist = np.maximum.accumulate(np.maximum(disp, 0.0))
+    total = dist[-1]
+    if total <= 0:
+        return []
+    split_m = max(split_m, total / MAX_SPLITS)
+    bounds = np.arange(0.0, total, split_m)
+    bounds = np.append(bounds, total)
+
+    # Boundary crossing times interpolated between frames; the frame index
+    # of each boundary locates event prefix sums
+    t_bounds = np.interp(bounds, dist, t)
+    f_bounds = np.searchsorted(dist, bounds, side="left")
+    f_bounds[-1] = n
+
+    contacts = np.asarray(contacts, dtype=int)
+    c_at = np.searchsorted(contacts, f_bounds, side="left")
+    c_frames = _prefix(contact_frames)
+    s_at = np.searchsorted(stride_frames, f_bounds, side="left")
+    s_len = _prefix(stride_lengths)
+
+    dt = np.diff(t_bounds)
+    seg_m = np.diff(bounds)
+    steps = np.diff(c_at)
+    n_strides = np.diff(s_at)
+    sum_strides = np.diff(s_len[s_at])
+    sum_contact = np.diff(c_frames[c_at])
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        speed = np.where(dt > 0, seg_m / dt, 0.0)
+        cadence = np.where(dt > 0, steps / dt * 60.0, 0.0)
+        stride = np.where(n_strides > 0, sum_strides / n_strides, np.nan)
+        gct = np.where(steps > 0, sum_contact / steps / max(fps, 1e-6) * 1000.0, np.nan)
+
+    return [
+        {
+            "segment": i + 1,
+            "start_m": round(float(bounds[i]), 1),
+            "end_m": round(float(bounds[i + 1]), 1),
+            "time_s": round(float(dt[i]), 3),
+            "speed_mps": round(float(speed[i]), 2),
+            "cadence_spm": round(float(cadence[i]), 1),
+            "stride_length_m": None if np.isnan(stride[i]) else round(float(stride[i]), 2),
+            "ground_contact_ms": None if np.isnan(gct[i]) else round(float(gct[i]), 1),
+        }
+        for i in range(len(dt))
+    ]
@@ -0,0 +1,136 @@
+"""Filesystem store for completed analyses.
+
+Each analysis lives in its own directory under ``SPRINT_DATA_DIR``:
+
+- ``result.json`` - the response returned by ``/analyze``
+- ``series.npz``  - the raw pose series from ``extract_pose_series``
+- ``lod.npz``     - the precomputed time-series pyramid (see ``timeseries``)
+- ``inputs.json`` - unrounded scoring-rule inputs, for bulk re-scoring
+- optional artifacts such as ``overlay.mp4`` (the skeleton-overlay video)
+
+Directories are written to a temporary name and renamed into place, so
+readers never observe a half-written analysis.
+"""
+import json
+import os
+import re
+import shutil
+import tempfile
+import uuid
+
+import numpy as np
+
+DATA_DIR = os.environ.get("SPRINT_DATA_DIR", os.path.join(tempfile.gettempdir(), "sprint_ai"))
+ANALYSES_DIR = os.path.join(DATA_DIR, "analyses")
+
+_ID_RE = re.compile(r"^[0-9a-f]{32}$")
+
+
+def new_analysis_id():
+    """Generate a new analysis id"""
+    return uuid.uuid4().hex
+
+
+def analysis_dir(analysis_id: str):
+    """Directory of an analysis, rejecting malformed ids"""
+    if not _ID_RE.match(analysis_id or ""):
+        raise FileNotFoundError(f"Unknown analysis '{analysis_id}'")
+    return os.path.join(ANALYSES_DIR, analysis_id)
+
+
+def _save_arrays(path, arrays: dict):
+    with open(path, "wb") as f:
+        np.savez(f, **arrays)
+
+
+def _load_arrays(path):
+    with np.load(path) as data:
+        return {k: (data[k].item() if data[k].ndim == 0 else data[k]) for k in data.files}
+
+
+def save_analysis(
+    analysis_id: str,
+    result: dict,
+    series: dict = None,
+    lod: dict = None,
+    artifacts: dict = None,
+    inputs: dict = None,
+):
+    """Atomically write an analysis, replacing any previous version.
+
+    Files not supplied are carried over from the previous version. artifacts
+    maps file names to paths that are moved into the analysis.
+    """
+    final = analysis_dir(analysis_id)
+    os.makedirs(ANALYSES_DIR, exist_ok=True)
+    tmp = tempfile.mkdtemp(prefix=f".{analysis_id}.", dir=ANALYSES_DIR)
+    try:
+        if series is not None:
+            _save_arrays(os.path.join(tmp, "series.npz"), series)
+        if lod is not None:
+            _save_arrays(os.path.join(tmp, "lod.npz"), lod)
+        if inputs is not None:
+            with open(os.path.join(tmp, "inputs.json"), "w") as f:
+                json.dump(inputs, f)
+        for name, src in (artifacts or {}).items():
+            shutil.move(src, os.path.join(tmp, os.path.basename(name)))
+        with open(os.path.join(tmp, "result.json"), "w") as f:
+            json.dump(result, f)
+        if os.path.exists(final):
+            for name in os.listdir(final):
+                dst = os.path.join(tmp, name)
+                if not os.path.exists(dst):
+                    try:
+                        os.link(os.path.join(final, name), dst)
+                    except OSError:
+                        shutil.copy2(os.path.join(final, name), dst)
+            old = final + ".old"
+            os.replace(final, old)
+            os.replace(tmp, final)
+            shutil.rmtree(old, ignore_errors=True)
+        else:
+            os.replace(tmp, final)
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+    return final
+
+
+def load_result(analysis_id: str):
+    """Load the stored /analyze response"""
+    with open(os.path.join(analysis_dir(analysis_id), "result.json")) as f:
+        return json.load(f)
+
+
+def load_inputs(analysis_id: str):
+    """Load the stored scoring inputs, or None for older analyses"""
+    try:
+        with open(os.path.join(analysis_dir(analysis_id), "inputs.json")) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def load_series(analysis_id: str):
+    """Load the stored pose series"""
+    return _load_arrays(os.path.join(analysis_dir(analysis_id), "series.npz"))
+
+
+def load_lod(analysis_id: str):
+    """Load the stored time-series pyramid"""
+    return _load_arrays(os.path.join(analysis_dir(analysis_id), "lod.npz"))
+
+
+def artifact_path(analysis_id: str, name: str):
+    """Path of a stored artifact, raising FileNotFoundError if absent"""
+    path = os.path.join(analysis_dir(analysis_id), os.path.basename(name))
+    if not os.path.isfile(path):
+        raise FileNotFoundError(path)
+    return path
+
+
+def list_analyses():
+    """Ids of all stored analyses"""
+    if not os.path.isdir(ANALYSES_DIR):
+        return []
+    return sorted(name for name in os.listdir(ANALYSES_DIR) if _ID_RE.match(name))
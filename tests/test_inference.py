@@ -0,0 +1,143 @@
+import numpy as np
+import pytest
+
+onnx = pytest.importorskip("onnx")
+pytest.importorskip("onnxruntime")
+pytest.importorskip("mediapipe")
+
+from onnx import TensorProto, helper, numpy_helper
+
+import inference
+from inference import NUM_LANDMARKS, OnnxEstimator, _ssd_anchors
+
+SETTINGS = {"min_detection_confidence": 0.5, "min_tracking_confidence": 0.5}
+LM_SIZE = 256
+DET_SIZE = 224
+
+
+def _save(graph, path):
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid("", 13)])
+    model.ir_version = 7
+    onnx.save(model, str(path))
+    return str(path)
+
+
+def detector(path, score_logit=10.0):
+    """A detector that finds one runner around the middle of every frame"""
+    anchors = _ssd_anchors(DET_SIZE)
+    best = int(np.argmin(np.abs(anchors - 0.5).sum(axis=1)))
+    boxes = np.zeros((1, len(anchors), 12), dtype=np.float32)
+    # Box size, then the hip centre on the anchor and a body top 50 px above it
+    boxes[0, best, 2:4] = (60, 120)
+    boxes[0, best, 6:8] = (0, -50)
+    scores = np.full((1, len(anchors), 1), -10.0, dtype=np.float32)
+    scores[0, best, 0] = score_logit
+    graph = helper.make_graph(
+        [
+            helper.make_node("Constant", [], ["boxes"], value=numpy_helper.from_array(boxes)),
+            helper.make_node("Constant", [], ["scores"], value=numpy_helper.from_array(scores)),
+        ],
+        "detector",
+        [helper.make_tensor_value_info("input", TensorProto.FLOAT, [1, DET_SIZE, DET_SIZE, 3])],
+        [
+            helper.make_tensor_value_info("boxes", TensorProto.FLOAT, [1, len(anchors), 12]),
+            helper.make_tensor_value_info("scores", TensorProto.FLOAT, [1, len(anchors), 1]),
+        ],
+    )
+    return _save(graph, path)
+
+
+def landmarker(path):
+    """A landmark model with a dynamic batch: fixed points, and z set by the crop's brightness.
+
+    The hip centre and body top it returns are where the crop put them, so
+    the runner's ROI stays where the detector found it.
+    """
+    points = np.zeros((NUM_LANDMARKS + 6, 5), dtype=np.float32)
+    rng = np.random.default_rng(0)
+    points[:NUM_LANDMARKS, :2] = rng.uniform(64, 192, (NUM_LANDMARKS, 2))
+    points[:NUM_LANDMARKS, 3] = 5.0
+    points[NUM_LANDMARKS] = (LM_SIZE / 2, LM_SIZE / 2, 0, 0, 0)
+    points[NUM_LANDMARKS + 1] = (LM_SIZE / 2, LM_SIZE / 2 - LM_SIZE / 2.5, 0, 0, 0)
+    weights = np.zeros((1, points.size), dtype=np.float32)
+    weights[0, 2::5] = LM_SIZE
+    nodes = [
+        helper.make_node("ReduceMean", ["input"], ["mean"], axes=[1, 2, 3], keepdims=0),
+        helper.make_node("Constant", [], ["axis"], value=numpy_helper.from_array(np.array([1], dtype=np.int64))),
+        helper.make_node("Unsqueeze", ["mean", "axis"], ["brightness"]),
+        helper.make_node("Constant", [], ["weights"], value=numpy_helper.from_array(weights)),
+        helper.make_node("Constant", [], ["points"], value=numpy_helper.from_array(points.reshape(1, -1))),
+        helper.make_node("Mul", ["brightness", "weights"], ["z"]),
+        helper.make_node("Add", ["z", "points"], ["landmarks"]),
+        helper.make_node("Constant", [], ["zero"], value=numpy_helper.from_array(np.zeros((1, 1), np.float32))),
+        helper.make_node("Constant", [], ["present"], value=numpy_helper.from_array(np.full((1, 1), 10, np.float32))),
+        helper.make_node("Mul", ["brightness", "zero"], ["flat"]),
+        helper.make_node("Add", ["flat", "present"], ["presence"]),
+    ]
+    graph = helper.make_graph(
+        nodes,
+        "landmarker",
+        [helper.make_tensor_value_info("input", TensorProto.FLOAT, ["N", LM_SIZE, LM_SIZE, 3])],
+        [
+            helper.make_tensor_value_info("landmarks", TensorProto.FLOAT, ["N", points.size]),
+            helper.make_tensor_value_info("presence", TensorProto.FLOAT, ["N", 1]),
+        ],
+    )
+    return _save(graph, path)
+
+
+def frames(n=10):
+    rng = np.random.default_rng(1)
+    return [rng.integers(0, 256, (240, 320, 3), dtype=np.uint8) for _ in range(n)]
+
+
+@pytest.fixture
+def models(tmp_path, monkeypatch):
+    monkeypatch.setattr(inference, "POSE_MODEL", landmarker(tmp_path / "landmark.onnx"))
+    monkeypatch.setattr(inference, "POSE_DETECTOR", detector(tmp_path / "detector.onnx"))
+    return tmp_path
+
+
+def run(estimator, clip, flush_every=None, reset_at=None):
+    out = []
+    for i, rgb in enumerate(clip):
+        if i == reset_at:
+            estimator.reset(rgb.shape[1], rgb.shape[0])
+        estimator.submit(rgb, i * 1000 / 30)
+        if flush_every and (i + 1) % flush_every == 0:
+            out.extend(estimator.flush())
+    out.extend(estimator.flush())
+    return out
+
+
+def test_landmarks_come_back_in_order(models):
+    clip = frames()
+    result = run(OnnxEstimator(SETTINGS, batch_size=1, threads=1), clip)
+    assert len(result) == len(clip)
+    assert all(lms is not None and len(lms) == NUM_LANDMARKS for lms in result)
+    # z follows each frame's own crop
+    z = [lms[0].z for lms in result]
+    assert len(set(np.round(z, 6))) == len(clip)
+    for lms in result:
+        assert all(0 <= lm.x <= 1 and 0 <= lm.y <= 1 and lm.visibility > 0.9 for lm in lms)
+
+
+@pytest.mark.parametrize("batch_size", [2, 4, 8])
+def test_batching_matches_single_frames(models, batch_size):
+    clip = frames()
+    estimator = OnnxEstimator(SETTINGS, batch_size=batch_size, threads=1)
+    assert estimator.batch_size == batch_size
+    batched = run(estimator, clip, flush_every=3, reset_at=5)
+    reference = run(OnnxEstimator(SETTINGS, batch_size=1, threads=1), clip, reset_at=5)
+    assert len(batched) == len(clip)
+    np.testing.assert_allclose(
+        [[(lm.x, lm.y, lm.z) for lm in lms] for lms in batched],
+        [[(lm.x, lm.y, lm.z) for lm in lms] for lms in reference],
+        atol=1e-5,
+    )
+
+
+def test_no_runner_gives_none(tmp_path, monkeypatch):
+    monkeypatch.setattr(inference, "POSE_MODEL", landmarker(tmp_path / "landmark.onnx"))
+    monkeypatch.setattr(inference, "POSE_DETECTOR", detector(tmp_path / "detector.onnx", score_logit=-10.0))
+    assert run(OnnxEstimator(SETTINGS, batch_size=4, threads=1), frames(6)) == [None] * 6
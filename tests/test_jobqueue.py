@@ -0,0 +1,143 @@
+import sqlite3
+
+import pytest
+
+import jobqueue
+from jobqueue import JobQueue
+
+
+class Clock:
+    """Stands in for the time module so leases expire on demand"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(jobqueue, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def queue(tmp_path, clock):
+    return JobQueue(str(tmp_path / "queue.db"), lease_s=60, max_attempts=2, keep_s=3600)
+
+
+def test_claims_shortest_first_and_nothing_when_empty(queue):
+    long_job = queue.enqueue({"video_path": "long.mp4"}, cost=30.0)
+    short_job = queue.enqueue({"video_path": "short.mp4"}, cost=2.0)
+    assert queue.claim("a") == (short_job, {"video_path": "short.mp4"})
+    assert queue.claim("b")[0] == long_job
+    assert queue.claim("c") is None
+
+
+def test_only_the_lease_holder_completes(queue):
+    job_id = queue.enqueue({}, cost=1.0)
+    queue.claim("a")
+    assert not queue.heartbeat(job_id, "b")
+    assert not queue.complete(job_id, "b", {"success": True})
+    assert queue.heartbeat(job_id, "a")
+    assert queue.complete(job_id, "a", {"success": True})
+    job = queue.get(job_id)
+    assert job["status"] == "done" and job["result"] == {"success": True}
+
+
+def test_heartbeat_keeps_the_lease(queue, clock):
+    job_id = queue.enqueue({}, cost=1.0)
+    queue.claim("a")
+    clock.advance(45)
+    assert queue.heartbeat(job_id, "a")
+    clock.advance(45)
+    assert queue.claim("b") is None
+
+
+def test_expired_lease_goes_to_the_next_worker(queue, clock):
+    job_id = queue.enqueue({}, cost=1.0)
+    queue.claim("a")
+    clock.advance(61)
+    assert queue.claim("b")[0] == job_id
+    assert queue.get(job_id)["attempts"] == 2
+    # The first worker lost its lease and cannot overwrite the new attempt
+    assert not queue.complete(job_id, "a", {"success": True})
+    assert queue.complete(job_id, "b", {"success": True})
+
+
+def test_expired_lease_out_of_attempts_fails(queue, clock):
+    job_id = queue.enqueue({}, cost=1.0)
+    queue.claim("a")
+    clock.advance(61)
+    queue.claim("b")
+    clock.advance(61)
+    assert queue.claim("c") is None
+    job = queue.get(job_id)
+    assert job["status"] == "failed" and job["error_type"] == "WorkerCrashed"
+
+
+def test_retryable_errors_requeue_until_attempts_run_out(queue):
+    job_id = queue.enqueue({}, cost=1.0)
+    queue.claim("a")
+    assert queue.fail(job_id, "a", "worker died", "WorkerCrashed")
+    assert queue.get(job_id)["status"] == "queued"
+    assert queue.claim("b")[0] == job_id
+    assert queue.fail(job_id, "b", "worker died", "WorkerCrashed")
+    job = queue.get(job_id)
+    assert job["status"] == "failed" and job["attempts"] == 2
+
+
+def test_errors_in_the_video_are_not_retried(queue):
+    job_id = queue.enqueue({}, cost=1.0)
+    queue.claim("a")
+    assert queue.fail(job_id, "a", "No frames", "ValueError")
+    assert queue.get(job_id)["status"] == "failed"
+    assert queue.claim("b") is None
+
+
+def test_cancel_only_drops_waiting_jobs(queue):
+    running = queue.enqueue({}, cost=1.0)
+    waiting = queue.enqueue({}, cost=2.0)
+    queue.claim("a")
+    queue.cancel(waiting)
+    queue.cancel(running)
+    assert queue.get(waiting)["status"] == "cancelled"
+    assert queue.get(running)["status"] == "running"
+
+
+def test_remove_deletes_finished_jobs_only(queue):
+    job_id = queue.enqueue({}, cost=1.0)
+    queue.claim("a")
+    queue.remove(job_id)
+    assert queue.get(job_id)["status"] == "running"
+    queue.complete(job_id, "a", {"success": True})
+    queue.remove(job_id)
+    assert queue.get(job_id) is None
+
+
+def test_uncollected_results_expire(queue, clock):
+    old = queue.enqueue({}, cost=1.0)
+    queue.claim("a")
+    queue.complete(old, "a", {"success": True})
+    clock.advance(3000)
+    recent = queue.enqueue({}, cost=1.0)
+    queue.claim("a")
+    queue.complete(recent, "a", {"success": True})
+    clock.advance(1000)
+    queue.claim("a")
+    assert queue.get(old) is None
+    assert queue.get(recent)["status"] == "done"
+    assert queue.stats()["jobs"]["done"] == 1
+
+
+def test_uses_the_rollback_journal(queue, tmp_path):
+    db = sqlite3.connect(str(tmp_path / "queue.db"))
+    try:
+        assert db.execute("PRAGMA journal_mode").fetchone()[0] == "delete"
+    finally:
+        db.close()
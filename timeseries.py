@@ -0,0 +1,148 @@
+"""Level-of-detail per-frame series for charting long runs.
+
+At analysis time the per-frame export channels are reduced into a min/max
+pyramid: level 0 holds the raw values and every level above halves the
+resolution, keeping the min and max of each bucket so peaks survive
+downsampling. A query picks the finest level whose bucket count over the
+requested time range fits in ``max_points``.
+"""
+import json
+import struct
+from functools import lru_cache
+
+import numpy as np
+
+from signals import joint_angles
+from store import load_lod
+
+EXPORT_FIELDS = (
+    "speed_mps",
+    "knee_angle_left",
+    "knee_angle_right",
+    "ankle_height_left_m",
+    "ankle_height_right_m",
+)
+
+BINARY_MAGIC = b"SPTS"
+
+
+def export_channels(series: dict, pixels_per_meter: float, signals: dict):
+    """Per-frame timestamps and export channels stacked as (fields, frames)"""
+    n = series["frames"]
+    fps = max(series["fps"], 1e-6)
+    t = series["t"] if "t" in series else np.arange(n) / fps
+    smoothed = signals["smoothed"]
+    X = np.empty((len(EXPORT_FIELDS), n), dtype=np.float32)
+    X[0] = np.abs(signals["velocity"]["hips_x"]) / pixels_per_meter
+    X[1] = joint_angles(series["lhip"], series["lknee"], series["lankle"]) if n else []
+    X[2] = joint_angles(series["rhip"], series["rknee"], series["rankle"]) if n else []
+    # Image y grows downwards, so height is measured up from the lowest point
+    for row, key in ((3, "la_y"), (4, "ra_y")):
+        y = smoothed[key]
+        X[row] = (y.max() - y) / pixels_per_meter if n else []
+    return np.asarray(t, dtype=float), X
+
+
+def build_lod(series: dict, pixels_per_meter: float, signals: dict):
+    """Precompute the min/max pyramid for an analysis"""
+    t, X = export_channels(series, pixels_per_meter, signals)
+    lod = {"fields": np.array(EXPORT_FIELDS), "t": t, "values": X}
+    lo = hi = X
+    level = 0
+    while lo.shape[1] > 1:
+        if lo.shape[1] % 2:
+            lo = np.concatenate([lo, lo[:, -1:]], axis=1)
+            hi = np.concatenate([hi, hi[:, -1:]], axis=1)
+        lo = np.minimum(lo[:, 0::2], lo[:, 1::2])
+        hi = np.maximum(hi[:, 0::2], hi[:, 1::2])
+        level += 1
+        lod[f"min_{level}"] = lo
+        lod[f"max_{level}"] = hi
+    lod["levels"] = level
+    return lod
+
+
+@lru_cache(maxsize=32)
+def cached_lod(analysis_id: str):
+    """Stored pyramid, kept in memory for repeated chart zooms"""
+    return load_lod(analysis_id)
+
+
+def query_lod(lod: dict, start_s=None, end_s=None, max_points=1000, fields=None):
+    """Select the finest pyramid level covering [start_s, end_s] in max_points"""
+    all_fields = [str(f) for f in lod["fields"]]
+    fields = list(fields) if fields else all_fields
+    unknown = [f for f in fields if f not in all_fields]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    rows = [all_fields.index(f) for f in fields]
+
+    t = lod["t"]
+    n = len(t)
+    i0 = int(np.searchsorted(t, start_s, "left")) if start_s is not None else 0
+    i1 = int(np.searchsorted(t, end_s, "right")) if end_s is not None else n
+    i1 = max(i0, i1)
+    max_points = max(2, int(max_points))
+
+    level = 0
+    b0, b1 = i0, i1
+    while level < lod["levels"] and (b1 - b0) * (1 if level == 0 else 2) > max_points:
+        level += 1
+        size = 1 << level
+        b0, b1 = i0 // size, -(-i1 // size)
+
+    if level == 0:
+        lo = hi = lod["values"][rows, b0:b1]
+    else:
+        lo = lod[f"min_{level}"][rows, b0:b1]
+        hi = lod[f"max_{level}"][rows, b0:b1]
+    return {
+        "level": level,
+        "bucket_frames": 1 << level,
+        "count": b1 - b0,
+        "fields": fields,
+        "t": t[np.arange(b0, b1) << level] if b1 > b0 else t[:0],
+        "min": lo,
+        "max": hi,
+    }
+
+
+def to_json(window: dict, decimals=3):
+    """JSON-ready form of a query result"""
+    return {
+        "level": window["level"],
+        "bucket_frames": window["bucket_frames"],
+        "count": window["count"],
+        "t": np.round(window["t"], decimals).tolist(),
+        "series": {
+            f: {
+                "min": np.round(window["min"][i].astype(float), decimals).tolist(),
+                "max": np.round(window["max"][i].astype(float), decimals).tolist(),
+            }
+            for i, f in enumerate(window["fields"])
+        },
+    }
+
+
+def to_binary(window: dict):
+    """Compact binary form of a query result.
+
+    Layout: ``b"SPTS"``, a little-endian uint32 header length, a UTF-8 JSON
+    header describing the columns, then ``count`` little-endian float32
+    values per column in header order.
+    """
+    layout = ["t"]
+    for f in window["fields"]:
+        layout += [f"{f}.min", f"{f}.max"]
+    header = json.dumps({
+        "level": window["level"],
+        "bucket_frames": window["bucket_frames"],
+        "count": window["count"],
+        "dtype": "<f4",
+        "columns": layout,
+    }).encode()
+    cols = np.empty((len(layout), window["count"]), dtype="<f4")
+    cols[0] = window["t"]
+    cols[1::2] = window["min"]
+    cols[2::2] = window["max"]
+    return BINARY_MAGIC + struct.pack("<I", len(header)) + header + cols.tobytes()
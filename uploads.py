@@ -0,0 +1,232 @@
+"""Resumable chunked uploads.
+
+Protocol:
+
+1. ``POST /uploads`` with the file name and total size creates an upload
+   and fixes its chunk size.
+2. ``PUT /uploads/{id}/chunks/{index}`` stores one chunk. The
+   ``X-Chunk-SHA256`` header must match the body. Chunks may arrive in any
+   order and in parallel; re-sending a chunk is harmless.
+3. ``GET /uploads/{id}`` reports the contiguous byte offset received so far
+   and the chunks still missing, so a client can resume after a drop.
+4. ``POST /uploads/{id}/finalize`` checks every chunk is present and turns
+   the upload into an analysis job.
+
+The data file only ever holds the contiguous prefix: an in-order chunk is
+appended directly, and out-of-order chunks wait as part files until the gap
+before them is filled. Uploads created with ``early_start`` can therefore
+begin decoding the prefix while later chunks are still arriving.
+"""
+import hashlib
+import json
+import os
+import shutil
+import threading
+import uuid
+
+from store import DATA_DIR
+
+UPLOADS_DIR = os.path.join(DATA_DIR, "uploads")
+DEFAULT_CHUNK_SIZE = int(os.environ.get("SPRINT_UPLOAD_CHUNK_SIZE", str(4 * 1024 * 1024)))
+MAX_UPLOAD_SIZE = int(os.environ.get("SPRINT_MAX_UPLOAD_SIZE", str(4 * 1024 ** 3)))
+STALL_TIMEOUT_S = float(os.environ.get("SPRINT_UPLOAD_STALL_TIMEOUT", "300"))
+
+
+def file_sha256(path, block_size=1024 * 1024):
+    """Hex SHA-256 of a file, read in blocks"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class UploadError(ValueError):
+    """Client error in the upload protocol"""
+
+
+class Upload:
+    """State of one resumable upload"""
+
+    def __init__(self, upload_id, filename, size, chunk_size, meta, received=(), finalized=False, job_id=None):
+        self.upload_id = upload_id
+        self.filename = filename
+        self.size = size
+        self.chunk_size = chunk_size
+        self.meta = meta
+        self.received = set(received)
+        self.finalized = finalized
+        self.job_id = job_id
+        self.cond = threading.Condition()
+
+    @property
+    def dir(self):
+        return os.path.join(UPLOADS_DIR, self.upload_id)
+
+    @property
+    def data_path(self):
+        suffix = os.path.splitext(self.filename)[-1]
+        return os.path.join(self.dir, "data" + suffix)
+
+    def part_path(self, index):
+        return os.path.join(self.dir, f"{index}.part")
+
+    @property
+    def num_chunks(self):
+        return max(1, -(-self.size // self.chunk_size))
+
+    def chunk_length(self, index):
+        if index == self.num_chunks - 1:
+            return self.size - index * self.chunk_size
+        return self.chunk_size
+
+    @property
+    def offset(self):
+        """Bytes received contiguously from the start of the file"""
+        i = 0
+        while i in self.received:
+            i += 1
+        return min(self.size, i * self.chunk_size)
+
+    def status(self):
+        with self.cond:
+            return {
+                "upload_id": self.upload_id,
+                "size": self.size,
+                "chunk_size": self.chunk_size,
+                "num_chunks": self.num_chunks,
+                "offset": self.offset,
+                "missing": [i for i in range(self.num_chunks) if i not in self.received],
+                "finalized": self.finalized,
+                "job_id": self.job_id,
+            }
+
+    def follower(self, timeout=STALL_TIMEOUT_S):
+        """Callback for extract_pose_series(follow=...) on the growing file.
+
+        Blocks until more contiguous data arrives (True) or the upload is
+        finalized with nothing new (False).
+        """
+        seen = [-1]
+
+        def follow():
+            with self.cond:
+                if not self.cond.wait_for(lambda: self.offset > seen[0] or self.finalized, timeout):
+                    raise RuntimeError("Upload stalled")
+                if self.offset > seen[0]:
+                    seen[0] = self.offset
+                    return True
+                return False
+
+        return follow
+
+    def _save_state(self):
+        state = {
+            "filename": self.filename,
+            "size": self.size,
+            "chunk_size": self.chunk_size,
+            "meta": self.meta,
+            "received": sorted(self.received),
+            "finalized": self.finalized,
+            "job_id": self.job_id,
+        }
+        tmp = os.path.join(self.dir, "state.json.tmp")
+        with open(tmp, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp, os.path.join(self.dir, "state.json"))
+
+
+class UploadManager:
+    """Creates uploads and stores their chunks"""
+
+    def __init__(self):
+        self._uploads = {}
+        self._lock = threading.Lock()
+
+    def create(self, filename: str, size: int, chunk_size: int = DEFAULT_CHUNK_SIZE, meta: dict = None):
+        if size <= 0 or size > MAX_UPLOAD_SIZE:
+            raise UploadError(f"size must be between 1 and {MAX_UPLOAD_SIZE} bytes")
+        if chunk_size <= 0:
+            raise UploadError("chunk_size must be positive")
+        upload = Upload(uuid.uuid4().hex, os.path.basename(filename or "video"), size, chunk_size, meta or {})
+        os.makedirs(upload.dir)
+        open(upload.data_path, "wb").close()
+        upload._save_state()
+        with self._lock:
+            self._uploads[upload.upload_id] = upload
+        return upload
+
+    def get(self, upload_id: str):
+        """Look up an upload, reloading its state from disk after a restart"""
+        with self._lock:
+            upload = self._uploads.get(upload_id)
+            if upload is not None:
+                return upload
+            try:
+                uuid.UUID(hex=upload_id)
+                with open(os.path.join(UPLOADS_DIR, upload_id, "state.json")) as f:
+                    state = json.load(f)
+            except (ValueError, OSError):
+                raise KeyError(upload_id)
+            upload = Upload(upload_id, **state)
+            self._uploads[upload_id] = upload
+            return upload
+
+    def write_chunk(self, upload_id: str, index: int, data: bytes, sha256: str):
+        upload = self.get(upload_id)
+        if upload.finalized:
+            raise UploadError("Upload already finalized")
+        if not 0 <= index < upload.num_chunks:
+            raise UploadError(f"Chunk index must be between 0 and {upload.num_chunks - 1}")
+        if len(data) != upload.chunk_length(index):
+            raise UploadError(f"Chunk {index} must be {upload.chunk_length(index)} bytes")
+        if not sha256 or hashlib.sha256(data).hexdigest() != sha256.lower():
+            raise UploadError(f"Checksum mismatch for chunk {index}")
+
+        with upload.cond:
+            if index in upload.received:
+                return upload.status()
+            first_missing = upload.offset // upload.chunk_size
+            if index != first_missing:
+                with open(upload.part_path(index), "wb") as f:
+                    f.write(data)
+            else:
+                with open(upload.data_path, "ab") as f:
+                    f.write(data)
+                    nxt = index + 1
+                    while nxt in upload.received:
+                        with open(upload.part_path(nxt), "rb") as part:
+                            shutil.copyfileobj(part, f)
+                        os.unlink(upload.part_path(nxt))
+                        nxt += 1
+                    f.flush()
+                    os.fsync(f.fileno())
+            upload.received.add(index)
+            upload._save_state()
+            upload.cond.notify_all()
+        return upload.status()
+
+    def finalize(self, upload_id: str):
+        """Mark an upload complete once every chunk has arrived"""
+        upload = self.get(upload_id)
+        with upload.cond:
+            missing = upload.num_chunks - len(upload.received)
+            if missing:
+                raise UploadError(f"{missing} chunk(s) still missing")
+            upload.finalized = True
+            upload._save_state()
+            upload.cond.notify_all()
+        return upload
+
+    def set_job(self, upload_id: str, job_id: str):
+        upload = self.get(upload_id)
+        with upload.cond:
+            upload.job_id = job_id
+            upload._save_state()
+
+    def discard(self, upload_id: str):
+        """Remove an upload and its data"""
+        with self._lock:
+            upload = self._uploads.pop(upload_id, None)
+        if upload is not None:
+            shutil.rmtree(upload.dir, ignore_errors=True)
@@ -0,0 +1,387 @@
+"""Supervised worker processes for crash-prone native work.
+
+MediaPipe and OpenCV decode untrusted video in native code. Running them in
+child processes means a segfault on a malformed clip fails that one job
+with ``WorkerCrashed`` instead of taking the API down, and a replacement
+worker is started for the next job.
+
+Workers are recycled after ``max_jobs`` jobs or once their resident memory
+passes ``max_rss_mb``, which keeps long-running instances flat despite
+allocator fragmentation from repeated pose-graph creation.
+
+When every worker is busy, waiting jobs are handed the next free worker
+shortest estimated job first (``SPRINT_SCHED_POLICY=sjf``, the default) or
+in arrival order (``fifo``). A waiting job's estimate shrinks by
+``SPRINT_SCHED_AGEING`` seconds per second waited, so a long clip is
+delayed by short ones only for about its own estimated run time. Each
+client gets an equal share of the workers while others are waiting; a
+client over its share is served only when nobody within theirs waits.
+A client is its peer address; only requests from a proxy listed in
+``SPRINT_TRUSTED_PROXIES`` may name one with ``X-Client-Id``, so a caller
+cannot escape its share by sending a fresh identity with every request.
+A freed worker is handed straight to the chosen job, which alone is woken.
+
+The function to run must be importable (it is pickled by reference).
+Callbacks that need the parent's state, such as an upload's ``follow``,
+stay in the parent: the worker gets a proxy that calls back over the pipe.
+"""
+import multiprocessing
+import os
+import signal
+import itertools
+import threading
+import time
+from collections import Counter
+
+ANALYSIS_PROCESSES = int(os.environ.get("SPRINT_ANALYSIS_PROCESSES", "2"))
+WORKER_MAX_JOBS = int(os.environ.get("SPRINT_WORKER_MAX_JOBS", "50"))
+WORKER_MAX_RSS_MB = float(os.environ.get("SPRINT_WORKER_MAX_RSS_MB", "1500"))
+WORKER_START_METHOD = os.environ.get("SPRINT_WORKER_START_METHOD", "forkserver")
+SCHED_POLICIES = ("sjf", "fifo")
+SCHED_POLICY = os.environ.get("SPRINT_SCHED_POLICY", "sjf")
+SCHED_AGEING = float(os.environ.get("SPRINT_SCHED_AGEING", "1.0"))
+# Assumed run time of jobs submitted without an estimate
+SCHED_DEFAULT_COST_S = float(os.environ.get("SPRINT_SCHED_DEFAULT_COST_S", "30"))
+# Peers whose X-Client-Id header is taken as the client's identity
+TRUSTED_PROXIES = frozenset(
+    h.strip() for h in os.environ.get("SPRINT_TRUSTED_PROXIES", "").split(",") if h.strip()
+)
+
+
+class WorkerCrashed(RuntimeError):
+    """The worker process died while running a job"""
+
+
+def rss_bytes():
+    """Resident memory of this process, or None where it cannot be read (no /proc)"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return None
+
+
+def reset_peak_rss():
+    """Start a new peak-memory window for this process (Linux only)"""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def peak_rss_bytes():
+    """Peak resident memory since reset_peak_rss, or over the process lifetime"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _portable(exc):
+    """The exception itself if it survives pickling, else a RuntimeError"""
+    import pickle
+    try:
+        pickle.loads(pickle.dumps(exc))
+        return exc
+    except Exception:
+        return RuntimeError(f"{type(exc).__name__}: {exc}")
+
+
+def _mb(size):
+    return None if size is None else round(size / 2 ** 20, 1)
+
+
+def _usage_mb(start_rss, peak_rss):
+    return {"start_rss_mb": _mb(start_rss), "peak_rss_mb": _mb(peak_rss)}
+
+
+class _Callback:
+    """Worker-side proxy for a callable that runs in the parent"""
+
+    def __init__(self, conn, name):
+        self.conn = conn
+        self.name = name
+
+    def __call__(self, *args):
+        self.conn.send(("call", self.name, args))
+        status, value = self.conn.recv()
+        if status == "error":
+            raise value
+        return value
+
+
+def _serve(conn, initializer, initargs):
+    """Worker process main loop"""
+    if initializer is not None:
+        initializer(*initargs)
+    while True:
+        try:
+            msg = conn.recv()
+        except EOFError:
+            return
+        if msg is None:
+            return
+        fn, args, kwargs, callbacks = msg
+        for name in callbacks:
+            kwargs[name] = _Callback(conn, name)
+        start_rss = rss_bytes()
+        reset_peak_rss()
+        try:
+            reply = ("done", "ok", fn(*args, **kwargs))
+        except BaseException as e:
+            reply = ("done", "error", _portable(e))
+        usage = (rss_bytes(), start_rss, peak_rss_bytes())
+        try:
+            conn.send(reply + usage)
+        except Exception as e:
+            conn.send(("done", "error", _portable(e)) + usage)
+
+
+class _Worker:
+    def __init__(self, ctx, initializer, initargs):
+        self.conn, child = ctx.Pipe()
+        self.process = ctx.Process(
+            target=_serve, args=(child, initializer, initargs), name="analysis-worker", daemon=True
+        )
+        self.process.start()
+        child.close()
+        self.jobs = 0
+        self.rss = 0
+
+    def stop(self, timeout=5.0):
+        try:
+            self.conn.send(None)
+        except OSError:
+            pass
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.conn.close()
+
+
+class WorkerPool:
+    """A fixed number of supervised worker processes, started on demand.
+
+    processes=0 runs jobs inline in the calling thread.
+    """
+
+    def __init__(
+        self,
+        processes: int = ANALYSIS_PROCESSES,
+        max_jobs: int = WORKER_MAX_JOBS,
+        max_rss_mb: float = WORKER_MAX_RSS_MB,
+        initializer=None,
+        initargs=(),
+        start_method: str = WORKER_START_METHOD,
+        preload=(),
+        policy: str = SCHED_POLICY,
+        ageing: float = SCHED_AGEING,
+    ):
+        self.processes = processes
+        self.max_jobs = max_jobs
+        self.max_rss = max_rss_mb * 2 ** 20
+        self.initializer = initializer
+        self.initargs = initargs
+        if policy not in SCHED_POLICIES:
+            raise ValueError(f"policy must be one of: {', '.join(SCHED_POLICIES)}")
+        self.policy = policy
+        self.ageing = ageing
+        if start_method not in multiprocessing.get_all_start_methods():
+            start_method = "spawn"
+        self._ctx = multiprocessing.get_context(start_method)
+        if start_method == "forkserver" and preload:
+            # Workers fork from a server that has already imported these
+            self._ctx.set_forkserver_preload(list(preload))
+        self._idle = []
+        self._live = 0
+        self._waiting = []
+        self._running = Counter()
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self._closed = False
+        self.stats = {"started": 0, "recycled": 0, "crashed": 0, "jobs": 0}
+
+    def run(
+        self, fn, *args, callbacks: dict = None, usage: dict = None, cost: float = None, client: str = None,
+        timeout: float = None, **kwargs
+    ):
+        """Run fn(*args, **kwargs) in a worker, passing callbacks as keyword proxies.
+
+        cost (estimated seconds) and client decide the job's place in the
+        queue when all workers are busy. A worker still busy timeout seconds
+        after taking the job is killed, and the job fails with WorkerCrashed.
+
+        usage, if given, receives the worker's resident memory when the job
+        started and its peak during the job, in MB, and the time it waited
+        for a worker.
+        """
+        callbacks = {k: v for k, v in (callbacks or {}).items() if v is not None}
+        if self.processes <= 0:
+            # Inline runs measure the whole (shared) process
+            start_rss = rss_bytes()
+            reset_peak_rss()
+            try:
+                return fn(*args, **kwargs, **callbacks)
+            finally:
+                if usage is not None:
+                    usage.update(_usage_mb(start_rss, peak_rss_bytes()))
+
+        worker, waited = self._acquire(SCHED_DEFAULT_COST_S if cost is None else cost, client)
+        if usage is not None:
+            usage["queue_s"] = round(waited, 3)
+        retire = True
+        try:
+            # A worker that died while idle fails the send rather than the recv
+            try:
+                deadline = None if timeout is None else time.monotonic() + timeout
+                worker.conn.send((fn, args, kwargs, list(callbacks)))
+                while True:
+                    if deadline is not None and not worker.conn.poll(max(0.0, deadline - time.monotonic())):
+                        worker.process.kill()
+                        with self._lock:
+                            self.stats["crashed"] += 1
+                        raise WorkerCrashed(f"worker process did not finish this video within {timeout:g} s")
+                    msg = worker.conn.recv()
+                    if msg[0] == "call":
+                        _, name, call_args = msg
+                        try:
+                            reply = ("ok", callbacks[name](*call_args))
+                        except Exception as e:
+                            reply = ("error", _portable(e))
+                        worker.conn.send(reply)
+                        continue
+                    _, status, value, worker.rss, start_rss, peak_rss = msg
+                    if usage is not None:
+                        usage.update(_usage_mb(start_rss, peak_rss))
+                    break
+            except (EOFError, OSError):
+                worker.process.join(5.0)
+                code = worker.process.exitcode
+                with self._lock:
+                    self.stats["crashed"] += 1
+                if code == -signal.SIGKILL:
+                    # What the kernel's OOM killer sends
+                    raise WorkerCrashed(
+                        "worker process was killed, most likely out of memory, while processing this video"
+                    ) from None
+                raise WorkerCrashed(
+                    f"worker process exited with code {code} while processing this video"
+                ) from None
+            worker.jobs += 1
+            # Without a current RSS reading only the job count recycles workers
+            retire = worker.jobs >= self.max_jobs or (worker.rss is not None and worker.rss >= self.max_rss)
+            if retire:
+                with self._lock:
+                    self.stats["recycled"] += 1
+        finally:
+            self._release(worker, retire, client)
+        if status == "error":
+            raise value
+        return value
+
+    def _next(self):
+        """Waiting ticket to hand the next free worker to"""
+        if self.policy == "fifo":
+            return min(self._waiting, key=lambda t: t["seq"])
+        clients = {t["client"] for t in self._waiting} | {c for c, n in self._running.items() if n}
+        share = max(1, self.processes // len(clients))
+        within = [t for t in self._waiting if self._running[t["client"]] < share]
+        now = time.monotonic()
+        return min(
+            within or self._waiting,
+            key=lambda t: (t["cost"] - self.ageing * (now - t["arrived"]), t["seq"])
+        )
+
+    def _dispatch(self):
+        """Hand free workers to waiting tickets and wake only those; call with the lock held"""
+        while self._waiting and (self._idle or self._live < self.processes):
+            ticket = self._next()
+            self._waiting.remove(ticket)
+            if self._idle:
+                ticket["worker"] = self._idle.pop()
+            else:
+                # Reserved here, started by the woken job
+                self._live += 1
+            self._running[ticket["client"]] += 1
+            ticket["ready"].set()
+
+    def _acquire(self, cost, client):
+        """A worker for this job once it is the job's turn, and the seconds waited"""
+        ticket = {
+            "cost": cost, "client": client, "arrived": time.monotonic(), "seq": next(self._seq),
+            "worker": None, "ready": threading.Event(),
+        }
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("Worker pool is closed")
+            self._waiting.append(ticket)
+            self._dispatch()
+        ticket["ready"].wait()
+        if ticket.get("closed"):
+            raise RuntimeError("Worker pool is closed")
+        waited = time.monotonic() - ticket["arrived"]
+        if ticket["worker"] is not None:
+            return ticket["worker"], waited
+        try:
+            worker = _Worker(self._ctx, self.initializer, self.initargs)
+        except BaseException:
+            with self._lock:
+                self._live -= 1
+                self._running[client] -= 1
+                self._dispatch()
+            raise
+        with self._lock:
+            self.stats["started"] += 1
+        return worker, waited
+
+    def _release(self, worker, retire, client):
+        if retire:
+            # Stop outside the lock; a dead worker just gets reaped
+            threading.Thread(target=worker.stop, daemon=True).start()
+        with self._lock:
+            self.stats["jobs"] += 1
+            self._running[client] -= 1
+            if retire or self._closed:
+                self._live -= 1
+            else:
+                self._idle.append(worker)
+            self._dispatch()
+        if self._closed and not retire:
+            worker.stop()
+
+    def status(self):
+        """Pool configuration, counters and live workers"""
+        with self._lock:
+            return {
+                "processes": self.processes,
+                "max_jobs": self.max_jobs,
+                "max_rss_mb": self.max_rss / 2 ** 20,
+                "live": self._live,
+                "policy": self.policy,
+                "queued": len(self._waiting),
+                "idle": [
+                    {"pid": w.process.pid, "jobs": w.jobs, "rss_mb": _mb(w.rss)}
+                    for w in self._idle
+                ],
+                **self.stats,
+            }
+
+    def close(self):
+        """Stop idle workers; busy ones stop when their job ends"""
+        with self._lock:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._live -= len(idle)
+            waiting, self._waiting = self._waiting, []
+        for ticket in waiting:
+            ticket["closed"] = True
+            ticket["ready"].set()
+        for worker in idle:
+            worker.stop()